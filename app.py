@@ -1,19 +1,42 @@
-from flask import Flask, request, jsonify, render_template, session
+from flask import Flask, Blueprint, current_app, g, request, jsonify, render_template, session, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from flask import redirect
+from sqlalchemy import event
+from flask import redirect, url_for
 import os
 import uuid
-import traceback
-import spacy
+import click
 from mlask import MLAsk
 import unicodedata
 import random
 import csv
+import json
 import re
+import zlib
+import secrets
+import tempfile
 from io import StringIO
+import threading
+import time
+import queue
+import multiprocessing
+import logging
+import sys
+from importlib import metadata
+import atexit
+from collections import Counter, deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from flask import Response
+from types import SimpleNamespace
+from itertools import chain, islice
 from dotenv import load_dotenv
+from nlp_backend import NlpBatchScheduler, NlpClient, NlpServerError, load_model, parse_with_model
+from metrics import Registry
+from session_store import create_session_interface
+import chat_archive
+import notification_sinks
 
 # ✅ .env 読み込み（このタイミングで実行）
 load_dotenv()
@@ -22,16 +45,379 @@ load_dotenv()
 # ✅ パス設定
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-app = Flask(__name__, static_folder="static", template_folder="templates")
-app.config["SECRET_KEY"] = os.urandom(24)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(basedir, "instance", "chat.db")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+db = SQLAlchemy()
+migrate = Migrate()
+bp = Blueprint("main", __name__, cli_group=None)
+logger = logging.getLogger(__name__)
+
+# ✅ メトリクス（/metrics で Prometheus テキスト形式を返す）
+metrics_registry = Registry()
+chat_stage_seconds = metrics_registry.histogram(
+    "chat_stage_seconds", "/chat の処理段階ごとの所要時間（秒）", ["stage"]
+)
+http_request_seconds = metrics_registry.histogram(
+    "http_request_seconds", "リクエストの処理時間（秒）", ["endpoint", "method", "status"]
+)
+chat_messages = metrics_registry.counter(
+    "chat_messages", "/chat で処理したメッセージ数", ["mood", "sensitive", "harassment"]
+)
+admin_notifications_dispatched = metrics_registry.counter(
+    "admin_notifications_dispatched", "管理者通知の送信回数（送り先・結果別）", ["sink", "result"]
+)
+
+# ✅ 設定（環境変数から読み込み、create_app(config) の値で上書き）
+def load_config(app, config=None):
+    # SECRET_KEY は全ワーカー・全ノードで同じ値にする（.env で設定。未設定なら instance/secret_key を作って使う）
+    app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
+    app.config["SECRET_KEY_FILE"] = os.getenv("SECRET_KEY_FILE", os.path.join(basedir, "instance", "secret_key"))
+    app.config["SESSION_BACKEND"] = os.getenv("SESSION_BACKEND", "cookie")  # cookie / database / filesystem
+    app.config["SESSION_FILE_DIR"] = os.getenv("SESSION_FILE_DIR", os.path.join(basedir, "instance", "sessions"))
+    app.config["LOG_LEVEL"] = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG でメッセージごとの判定ログを出す
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL", "sqlite:///" + os.path.join(basedir, "instance", "chat.db"))
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["CHAT_BATCH_MAX_SIZE"] = int(os.getenv("CHAT_BATCH_MAX_SIZE", "1000"))  # /chat_batch の1回あたりの上限
+    app.config["TOPIC_CONSISTENCY_WINDOW"] = int(os.getenv("TOPIC_CONSISTENCY_WINDOW", "5"))
+    app.config["SESSION_CACHE_SIZE"] = int(os.getenv("SESSION_CACHE_SIZE", "1024"))  # 0 で無効
+    app.config["SESSION_CACHE_TTL"] = float(os.getenv("SESSION_CACHE_TTL", "300"))  # 秒
+    app.config["SESSION_CACHE_VALIDATE"] = os.getenv("SESSION_CACHE_VALIDATE", "1") == "1"  # ヒット時に state_version を確認（複数ワーカー向け）
+    app.config["ANALYSIS_CACHE_SIZE"] = int(os.getenv("ANALYSIS_CACHE_SIZE", "2048"))  # 0 で無効
+    app.config["ANALYSIS_CACHE_MAX_BYTES"] = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+    app.config["ANALYSIS_CACHE_MAX_TEXT_LENGTH"] = int(os.getenv("ANALYSIS_CACHE_MAX_TEXT_LENGTH", "100"))  # これより長い文面は保存しない
+    app.config["NLP_BACKEND"] = os.getenv("NLP_BACKEND", "local")  # local / server
+    app.config["NLP_PIPELINE_PROFILE"] = os.getenv("NLP_PIPELINE_PROFILE", "trimmed")  # full / trimmed
+    app.config["NLP_SERVER_SOCKET"] = os.getenv("NLP_SERVER_SOCKET", os.path.join(basedir, "instance", "nlp.sock"))
+    app.config["NLP_SERVER_AUTHKEY"] = os.getenv("NLP_SERVER_AUTHKEY")  # server モードでは必須（解析サーバーと同じ値）
+    app.config["NLP_BATCH_ENABLED"] = os.getenv("NLP_BATCH_ENABLED", "0") == "1"
+    app.config["NLP_BATCH_MAX_WAIT_MS"] = float(os.getenv("NLP_BATCH_MAX_WAIT_MS", "5"))
+    app.config["NLP_BATCH_MAX_SIZE"] = int(os.getenv("NLP_BATCH_MAX_SIZE", "32"))
+    app.config["NLP_BATCH_TIMEOUT"] = float(os.getenv("NLP_BATCH_TIMEOUT", "10"))  # 秒。超えたら待たずに直接解析する
+    app.config["NLP_EXECUTOR"] = os.getenv("NLP_EXECUTOR", "inline")  # inline / process
+    app.config["NLP_EXECUTOR_WORKERS"] = int(os.getenv("NLP_EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+    app.config["NLP_EXECUTOR_TIMEOUT"] = float(os.getenv("NLP_EXECUTOR_TIMEOUT", "10"))  # 秒
+    app.config["NLP_EXECUTOR_MAX_PENDING"] = int(os.getenv("NLP_EXECUTOR_MAX_PENDING", str(4 * (os.cpu_count() or 1))))
+    app.config["NLP_EXECUTOR_START_METHOD"] = os.getenv("NLP_EXECUTOR_START_METHOD", "forkserver")
+    app.config["NLP_PRELOAD"] = os.getenv("NLP_PRELOAD", "0") == "1"  # gunicorn.conf.py では 1
+    app.config["CHAT_LOG_WRITE_BEHIND"] = os.getenv("CHAT_LOG_WRITE_BEHIND", "0") == "1"
+    app.config["CHAT_LOG_QUEUE_SIZE"] = int(os.getenv("CHAT_LOG_QUEUE_SIZE", "1000"))
+    app.config["CHAT_LOG_FLUSH_ROWS"] = int(os.getenv("CHAT_LOG_FLUSH_ROWS", "50"))
+    app.config["CHAT_LOG_FLUSH_MS"] = int(os.getenv("CHAT_LOG_FLUSH_MS", "200"))
+    app.config["ARCHIVE_DIR"] = os.getenv("ARCHIVE_DIR", os.path.join(basedir, "instance", "archive"))
+    app.config["ARCHIVE_RETENTION_DAYS"] = int(os.getenv("ARCHIVE_RETENTION_DAYS", "365"))  # これより古いログを flask archive-logs で移す
+    app.config["ADMIN_NOTIFICATION_DISPATCH"] = os.getenv("ADMIN_NOTIFICATION_DISPATCH", "thread")  # thread / off（off なら flask dispatch-notifications で送る）
+    app.config["ADMIN_NOTIFICATION_SINKS"] = os.getenv("ADMIN_NOTIFICATION_SINKS", "log")  # log / smtp / webhook（カンマ区切り）
+    app.config["ADMIN_NOTIFICATION_INTERVAL"] = float(os.getenv("ADMIN_NOTIFICATION_INTERVAL", "5"))  # 秒（他ワーカーの通知の拾い直し間隔）
+    app.config["ADMIN_NOTIFICATION_MAX_ATTEMPTS"] = int(os.getenv("ADMIN_NOTIFICATION_MAX_ATTEMPTS", "3"))
+    app.config["ADMIN_NOTIFICATION_LEASE"] = float(os.getenv("ADMIN_NOTIFICATION_LEASE", "120"))  # 送信中の印の有効期限（秒、sink の送信時間より長く）
+    app.config["ADMIN_NOTIFICATION_MAX_WAIT"] = float(os.getenv("ADMIN_NOTIFICATION_MAX_WAIT", "25"))  # 未読の long-poll の最大待ち時間（秒）
+    app.config["ADMIN_NOTIFICATION_POLL_MS"] = int(os.getenv("ADMIN_NOTIFICATION_POLL_MS", "1000"))  # long-poll 中に DB を見直す間隔
+    app.config["ADMIN_NOTIFICATION_MAX_WAITERS"] = int(os.getenv("ADMIN_NOTIFICATION_MAX_WAITERS", "1"))  # プロセスごとの long-poll の同時待機数（スレッドを占有する）
+    app.config["ADMIN_NOTIFICATION_SINK_TIMEOUT"] = float(os.getenv("ADMIN_NOTIFICATION_SINK_TIMEOUT", "10"))
+    app.config["ADMIN_NOTIFICATION_EMAIL_FROM"] = os.getenv("ADMIN_NOTIFICATION_EMAIL_FROM", "chatbot@localhost")
+    app.config["ADMIN_NOTIFICATION_EMAIL_TO"] = os.getenv("ADMIN_NOTIFICATION_EMAIL_TO", "kanri@localhost")
+    app.config["ADMIN_NOTIFICATION_WEBHOOK_URL"] = os.getenv("ADMIN_NOTIFICATION_WEBHOOK_URL")
+    app.config["SMTP_HOST"] = os.getenv("SMTP_HOST", "localhost")
+    app.config["SMTP_PORT"] = int(os.getenv("SMTP_PORT", "1025"))  # 既定はローカルのデバッグ用 SMTP サーバー
+    app.config["LOG_FEED_POLL_MS"] = int(os.getenv("LOG_FEED_POLL_MS", "1000"))  # ライブ配信で他ワーカーの書き込みを拾う間隔
+    app.config["LOG_FEED_BUFFER_SIZE"] = int(os.getenv("LOG_FEED_BUFFER_SIZE", "2000"))  # プロセスごとに持つ直近の行数
+    app.config["LOG_FEED_MAX_STREAMS"] = int(os.getenv("LOG_FEED_MAX_STREAMS", "2"))  # プロセスごとの SSE・long-poll の同時接続数（スレッドを占有する）
+    app.config["LOG_FEED_HEARTBEAT"] = float(os.getenv("LOG_FEED_HEARTBEAT", "15"))  # 秒
+    app.config["LOG_FEED_STREAM_SECONDS"] = float(os.getenv("LOG_FEED_STREAM_SECONDS", "300"))  # SSE を切って再接続させるまでの秒数
+    app.config["LOG_FEED_MAX_WAIT"] = float(os.getenv("LOG_FEED_MAX_WAIT", "25"))  # /api/logs/feed の最大待ち時間（秒）
+    app.config["MOOD_ROLLUP_ON_WRITE"] = os.getenv("MOOD_ROLLUP_ON_WRITE", "1") == "1"
+    app.config["SQLITE_PRAGMAS_ENABLED"] = os.getenv("SQLITE_PRAGMAS_ENABLED", "1") == "1"
+    app.config["SQLITE_JOURNAL_MODE"] = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    app.config["SQLITE_BUSY_TIMEOUT_MS"] = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    app.config["SQLITE_SYNCHRONOUS"] = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # WAL では NORMAL で十分
+    app.config["SQLITE_CACHE_SIZE_KB"] = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+    if config:
+        app.config.update(config)
+
+# ✅ SECRET_KEY をファイルから読む（なければ作る）。1台で複数ワーカーを動かす場合は全ワーカーが同じ鍵になる
+# 複数ワーカーが同時に起動しても、最初に作られたファイルを全員が使う（一時ファイルを os.link で置くので上書きしない）
+def load_or_create_secret_key(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(secrets.token_hex(32))
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+    finally:
+        os.remove(tmp_path)
+    with open(path, encoding="utf-8") as f:
+        return f.read().strip()
+
+# ✅ SQLite の接続ごとの設定（複数ワーカーでの同時書き込み向け）
+# WAL: 読み取りが書き込みを待たない / busy_timeout: ロック中は待ってから再試行（"database is locked" を防ぐ）
+def apply_sqlite_pragmas(app):
+    if db.engine.dialect.name != "sqlite" or not app.config["SQLITE_PRAGMAS_ENABLED"]:
+        return
+
+    pragmas = [
+        f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}",
+        f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA cache_size=-{app.config['SQLITE_CACHE_SIZE_KB']}"
+    ]
+
+    @event.listens_for(db.engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+# ✅ 起動時間をフェーズごとに記録（app.extensions["startup_timings"]）
+@contextmanager
+def startup_phase(app, name):
+    started = time.perf_counter()
+    yield
+    app.extensions.setdefault("startup_timings", {})[name] = round(time.perf_counter() - started, 3)
+
+# ✅ 重いNLPリソース（GiNZA・ML-Ask・kakasi・キーワード照合器）は最初に使うときに読み込む
+# マイグレーションや CLI ではモデルを読み込まず、NLP_PRELOAD=1 のときだけ create_app で先読みする
+# モデルは読み込み専用なのでプロセスで共有する（パイプライン構成ごとに1つ。fork 後のワーカーは copy-on-write で共有）
+_nlp_models = {}
+_emotion_analyzer = None
+_converter = None
+_keyword_matchers = None
+_resource_lock = threading.RLock()
+# GiNZA（SudachiPy）の Tokenizer はスレッドセーフではない（gunicorn の threads で同時に呼ぶと "Already borrowed"）
+_nlp_call_lock = threading.Lock()
+
+def get_nlp(profile=None):
+    profile = profile or services().nlp_profile
+    nlp = _nlp_models.get(profile)
+    if nlp is None:
+        with _resource_lock:
+            nlp = _nlp_models.get(profile)
+            if nlp is None:
+                nlp = _nlp_models[profile] = load_model(profile=profile)
+    return nlp
+
+def get_emotion_analyzer():
+    global _emotion_analyzer
+    if _emotion_analyzer is None:
+        with _resource_lock:
+            if _emotion_analyzer is None:
+                _emotion_analyzer = MLAsk()
+    return _emotion_analyzer
+
+def installed_version(package):
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+# ✅ アプリごとの実行時オブジェクト（app.extensions["chat_services"]）
+# 解析バックエンド・キャッシュ・バックグラウンド処理は create_app ごとに作る（別のアプリの設定で上書きしない）
+# リクエスト外（バックグラウンドスレッド）ではアプリを渡して取り出す
+class ChatServices:
+    def __init__(self):
+        self.nlp_profile = "trimmed"
+        self.nlp_model_version = None
+        self.nlp_client = None
+        self.nlp_scheduler = None
+        self.analysis_executor = None
+        self.analysis_cache = None
+        self.session_cache = None
+        self.chat_log_writer = None
+        self.notification_dispatcher = None
+        self.notification_waiters = None
+        self.log_feed = None
+
+def services(app=None):
+    return (app or current_app).extensions["chat_services"]
+
+# ✅ 解析バックエンドの初期化
+# server モード：モデルは解析サーバー（python nlp_backend.py）だけが持ち、ワーカーはソケット経由で解析する
+# NLP_BATCH_ENABLED=1：同時リクエストの形態素解析をまとめて実行するスケジューラを使う
+def init_nlp(app):
+    state = services(app)
+    state.nlp_profile = app.config["NLP_PIPELINE_PROFILE"]
+    state.nlp_model_version = (
+        app.config["NLP_BACKEND"], state.nlp_profile, installed_version("ja_ginza"), installed_version("pykakasi")
+    )
 
-nlp = spacy.load("ja_ginza")
-emotion_analyzer = MLAsk()
+    if app.config["NLP_BACKEND"] == "server":
+        state.nlp_client = NlpClient(app.config["NLP_SERVER_SOCKET"], app.config["NLP_SERVER_AUTHKEY"])
+
+    if app.config["NLP_BATCH_ENABLED"]:
+        state.nlp_scheduler = NlpBatchScheduler(
+            lambda texts: parse_many(texts, state),
+            max_wait_ms=app.config["NLP_BATCH_MAX_WAIT_MS"],
+            max_batch=app.config["NLP_BATCH_MAX_SIZE"],
+            timeout=app.config["NLP_BATCH_TIMEOUT"]
+        )
+
+    if app.config["NLP_EXECUTOR"] == "process":
+        worker_config = {key: value for key, value in app.config.items() if key.startswith("NLP_")}
+        worker_config.update({"NLP_EXECUTOR": "inline", "NLP_BATCH_ENABLED": False})
+        state.analysis_executor = AnalysisExecutor(
+            worker_config,
+            workers=app.config["NLP_EXECUTOR_WORKERS"],
+            timeout=app.config["NLP_EXECUTOR_TIMEOUT"],
+            max_pending=app.config["NLP_EXECUTOR_MAX_PENDING"],
+            start_method=app.config["NLP_EXECUTOR_START_METHOD"]
+        )
+
+# ✅ 解析のプロセスプール（NLP_EXECUTOR=process のとき）
+# /chat の CPU 負荷の高い解析（GiNZA・ML-Ask・kakasi・キーワード照合）をモデルを読み込んだ子プロセスで行い、
+# リクエストのスレッドは結果を待つだけにする（待機中は GIL を手放すので、同じワーカーの他のリクエストが止まらない）
+# 子プロセスは gunicorn ワーカーごとに最初の /chat で起動する。待ちを含めて max_pending 件を超えたら 503 を返す
+# 子プロセスのキーワードリストはソース上のもの（親プロセスで実行中に変更しても反映されない）
+# 子プロセスではアプリコンテキストを入れたままにして、解析から services() を使えるようにする
+def init_analysis_worker(config):
+    worker_app = Flask(__name__)
+    worker_app.config.update(config)
+    worker_app.extensions["chat_services"] = ChatServices()
+    init_nlp(worker_app)
+    preload_nlp_resources(worker_app)
+    worker_app.app_context().push()
+
+def analyze_in_worker(text):
+    analysis = MessageAnalysis(text)
+    return analysis, analyze_mood(text, analysis)
+
+# 子プロセスの chat_stage_seconds は /metrics に出ないため、段階ごとの所要時間を結果と一緒に返す
+def analyze_in_pool(text):
+    with chat_stage_seconds.capture() as stages:
+        analysis, mood = analyze_in_worker(text)
+    return analysis, mood, stages
+
+class AnalysisExecutor:
+    def __init__(self, worker_config, workers, timeout, max_pending, start_method="forkserver"):
+        self.worker_config = worker_config
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.completed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.restarts = 0
+
+    # fork 後のワーカーではプールが引き継がれないため、プロセスごとに最初の投入時に起動する
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=init_analysis_worker,
+                    initargs=(self.worker_config,)
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # 枠は子プロセスでの解析が実際に終わった（またはキャンセルされた）ときに返す
+    # 待ちを打ち切っても実行中の解析は止まらないため、タイムアウト時に返すと max_pending を超えて投入してしまう
+    def _release(self, future):
+        self._slots.release()
+
+    # セマフォの待ちと結果の待ちは同じ締め切り（timeout 秒）で打ち切る
+    def analyze(self, text):
+        deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.rejected += 1
+            raise FuturesTimeoutError("解析の待ち行列が上限に達しました")
+        executor = None
+        try:
+            executor = self._get_executor()
+            future = executor.submit(analyze_in_pool, text)
+        except BaseException as e:
+            self._slots.release()
+            if isinstance(e, BrokenProcessPool) and executor is not None:
+                self._reset(executor)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            result = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FuturesTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise
+        with self._lock:
+            self.completed += 1
+        analysis, mood, stages = result
+        for labels, seconds in stages:
+            chat_stage_seconds.observe(seconds, **labels)
+        return analysis, mood
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None and self._pid == os.getpid():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "timeout": self.timeout,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "restarts": self.restarts
+            }
+
+# ✅ 先読み（gunicorn の preload_app と組み合わせ、fork 後のワーカーで copy-on-write 共有する）
+def preload_nlp_resources(app):
+    state = services(app)
+    if state.nlp_client is None and state.analysis_executor is None:
+        with startup_phase(app, "ginza"):
+            get_nlp(state.nlp_profile)
+    with startup_phase(app, "mlask"):
+        get_emotion_analyzer()
+    with startup_phase(app, "kakasi"):
+        get_converter()
+    with startup_phase(app, "keyword_matcher"):
+        get_keyword_matchers()
+
+# ✅ 複数テキストの形態素解析（サーバー → プロセス内モデルの順にフォールバック）
+# サーバーの接続・認証・応答のどの失敗でも、retry_interval 秒はプロセス内モデルで解析する
+def parse_many(texts, state=None):
+    state = state or services()
+    if state.nlp_client is not None and state.nlp_client.available():
+        try:
+            return state.nlp_client.parse_many(texts)
+        except NlpServerError as e:
+            logger.warning("⚠️ 解析サーバーを使えないため、プロセス内モデルで解析します: %s", e)
+    nlp = get_nlp(state.nlp_profile)
+    with _nlp_call_lock:
+        return parse_with_model(nlp, texts)
+
+# ✅ 形態素解析の入口（表層形リストと品詞リストを返す）
+def parse_text(text):
+    scheduler = services().nlp_scheduler
+    if scheduler is not None:
+        return scheduler.parse(text)
+    return parse_many([text])[0]
 
 # ✅ モデル定義
 class User(db.Model):
@@ -43,8 +429,9 @@ class User(db.Model):
     stress_count = db.Column(db.Integer, nullable=False, default=0)
     department = db.Column(db.String(50))
     age_group = db.Column(db.String(20))
+    state_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")  # ✅ 更新のたびに +1（他ワーカーのキャッシュの鮮度確認用）
 
-from datetime import datetime  # ← 追加
+from datetime import datetime, timedelta, timezone  # ← 追加
 
 class ChatHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -57,6 +444,80 @@ class ChatHistory(db.Model):
     psychological_state = db.Column(db.String(20))  # ← ✅ 追加
     harassment_flag = db.Column(db.Boolean, default=False)
     sensitive_flag = db.Column(db.Boolean, default=False)
+    nouns = db.Column(db.Text)  # ✅ 抽出済み名詞（JSON配列）。トピック一貫性分析で再解析しないために保存
+
+    # ✅ よく使う検索に合わせた索引（セッション単位の直近ログ・日付範囲・部署/年代/心理状態/フラグでの絞り込み）
+    __table_args__ = (
+        db.Index("ix_chat_history_session_id_id", "session_id", "id"),
+        db.Index("ix_chat_history_timestamp", "timestamp"),
+        db.Index("ix_chat_history_department_id", "department", "id"),
+        db.Index("ix_chat_history_age_group_id", "age_group", "id"),
+        db.Index("ix_chat_history_psychological_state_id", "psychological_state", "id"),
+        db.Index("ix_chat_history_harassment_flag_id", "harassment_flag", "id"),
+        db.Index("ix_chat_history_sensitive_flag_id", "sensitive_flag", "id"),
+    )
+
+# ✅ 心理状態の日次集計（日付(JST) × 部署 × 年代 × 心理状態）。ChatHistory を走査せずに集計を返すためのテーブル
+class MoodRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    department = db.Column(db.String(50), nullable=False, default="")
+    age_group = db.Column(db.String(20), nullable=False, default="")
+    psychological_state = db.Column(db.String(20), nullable=False, default="")
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    harassment_count = db.Column(db.Integer, nullable=False, default=0)
+    sensitive_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint("day", "department", "age_group", "psychological_state", name="uq_mood_rollup_bucket"),
+    )
+
+# ✅ バッチ処理（集計・再分類）の処理済み位置（ChatHistory.id）。途中で止まっても続きから再開できる
+class RollupCursor(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+
+# ✅ アーカイブ済みログの月別ファイル（ARCHIVE_DIR 内）。bytes はコミット済みの書き込み位置で、
+# ChatHistory の削除と同じトランザクションで更新する（これより後ろのバイトは未確定として読まない）
+class ChatArchive(db.Model):
+    month = db.Column(db.String(7), primary_key=True)  # YYYY-MM（timestamp の UTC 基準）
+    path = db.Column(db.String(255), nullable=False)  # ARCHIVE_DIR からの相対パス
+    bytes = db.Column(db.Integer, nullable=False, default=0)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    min_id = db.Column(db.Integer)
+    max_id = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# ✅ サーバー側セッション（SESSION_BACKEND=database のときに使う。中身は Flask のセッションと同じ形式の JSON）
+class ServerSession(db.Model):
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_server_session_expires_at", "expires_at"),
+    )
+
+# ✅ 管理者通知（ハラスメント疑いなど）。read_at が NULL のものが未読、dispatched_at が NULL のものが送信待ち（claimed_at は送信中の印）
+# 未読一覧・送信待ちの取得はそれぞれ索引の先頭（NULL の範囲）だけを読むので、件数は未読・送信待ちの分しか増えない
+class AdminNotification(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False, default="harassment")
+    session_id = db.Column(db.String(100), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    department = db.Column(db.String(50))
+    age_group = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    read_at = db.Column(db.DateTime)
+    dispatched_at = db.Column(db.DateTime)
+    claimed_at = db.Column(db.DateTime)
+    dispatch_attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    dispatch_error = db.Column(db.Text)
+
+    __table_args__ = (
+        db.Index("ix_admin_notification_read_at_id", "read_at", "id"),
+        db.Index("ix_admin_notification_dispatched_at_id", "dispatched_at", "id"),
+    )
 
 
 # ✅ アドバイス生成
@@ -184,48 +645,160 @@ def get_response_by_mood(mood, response_type):
     return base
 
 
+# ✅ ストレス・ポジティブ判定用キーワード（ひらがな）
+stress_keywords = [
+    "つかれ", "つらい", "しんどい", "しにたい", "おこられた", "もうむり",
+    "やばい", "きらい", "むかつく", "いらいら", "にがて", "きもちわるい", "いそがしい",
+    "だるい", "ねむい", "へとへと", "すとれす", "きがおもい", "にげたい", "かなし",
+    "おちこむ", "げんかい", "こどく", "ふあん", "ゆううつ", "どなられた", "ののしられた", "こわい", "もうだめ", "ひどいことをされた"
+]
+positive_keywords = [
+    "たのしい", "うれしい", "ほめられた", "ありがとう", "さいこう", "だいじょうぶ",
+    "すき", "あいしてる", "あんしん", "おもしろい", "わらえた", "はっぴー", "いやされた",
+    "げんきでた", "はげまされた", "ぽじてぃぶ", "じしんがある", "きぶんがいい", "すっきり", "まえむき", "しあわせ",
+    "せいちょう", "できた", "がんばった", "しゅうちゅうできた", "たっせい",
+    "しゅうりょう", "しゅくだいおわった", "まにあった", "ほめられて", "やりとげた",
+    "うまくいった", "じぶんにかてた", "やくにたった", "いいかんじ", "のりこえた"
+]
+
 # ✅ ハラスメントキーワードと検出関数
 harassment_keywords = [
     "いじめ", "嫌がらせ", "無視された", "暴言", "パワハラ", "セクハラ", "モラハラ",
     "怒鳴られた", "強制された", "叩かれた", "暴力", "蹴られた", "圧力", "脅された"
 ]
 
-def detect_harassment(text):
-    normalized = unicodedata.normalize("NFKC", text)
-    hiragana_text = to_hiragana(normalized).replace(" ", "")
-    return any(keyword in hiragana_text for keyword in harassment_keywords)
+def detect_harassment(text, analysis=None):
+    analysis = analysis or MessageAnalysis(text)
+    return "harassment" in analysis.keyword_hits
 
 # ✅ ひらがな変換のためのインポート（ファイル冒頭に追加しておく）
 from pykakasi import kakasi
 
-kakasi_inst = kakasi()
-kakasi_inst.setMode("J", "H")  # 漢字→ひらがな
-kakasi_inst.setMode("K", "H")  # カタカナ→ひらがな
-kakasi_inst.setMode("H", "H")  # ひらがな→ひらがな（そのまま）
-converter = kakasi_inst.getConverter()
+def get_converter():
+    global _converter
+    if _converter is None:
+        with _resource_lock:
+            if _converter is None:
+                kakasi_inst = kakasi()
+                kakasi_inst.setMode("J", "H")  # 漢字→ひらがな
+                kakasi_inst.setMode("K", "H")  # カタカナ→ひらがな
+                kakasi_inst.setMode("H", "H")  # ひらがな→ひらがな（そのまま）
+                _converter = kakasi_inst.getConverter()
+    return _converter
 
 def to_hiragana(text):
-    return converter.do(text).replace(" ", "").lower()
+    return get_converter().do(text).replace(" ", "").lower()
+
+# ✅ 複数キーワードリストの一括照合（Aho-Corasick 法）
+# 起動時に全リストからオートマトンを1回だけ構築し、テキストを1回走査するだけで
+# 「どのリストの・どのキーワードに」一致したかをまとめて返す（キーワード数に比例しない）
+class KeywordMatcher:
+    def __init__(self):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+    def add(self, pattern, label, keyword=None):
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[node][ch] = nxt
+            node = nxt
+        self._out[node].append((label, keyword or pattern))
+
+    def build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+        return self
+
+    def find_all(self, text):
+        hits = {}
+        node = 0
+        for ch in text:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for label, keyword in self._out[node]:
+                found = hits.setdefault(label, [])
+                if keyword not in found:
+                    found.append(keyword)
+        return hits
 
 def extract_nouns(text):
-    doc = nlp(text)
-    return [token.text for token in doc if token.pos_ == "NOUN"]
-
-# ✅ トピック一貫性分析
-def analyze_topic_consistency(current_text, session_id, limit=5):
-    current_nouns = set(extract_nouns(current_text))
+    tokens, pos_tags = parse_text(text)
+    return [tok for tok, pos in zip(tokens, pos_tags) if pos == "NOUN"]
+
+# ✅ メッセージ単位の解析結果（NFKC正規化・ひらがな変換・形態素解析を1回だけ実行し、各判定関数で共有）
+class MessageAnalysis:
+    def __init__(self, text, parsed=None):
+        self.text = text
+        self.normalized = unicodedata.normalize("NFKC", text)
+        self.normalized_lower = self.normalized.lower()
+        with chat_stage_seconds.time(stage="kakasi"):
+            self.hiragana = to_hiragana(self.normalized)
+
+        # ✅ 全キーワードリストを1回の走査で照合（センシティブ語は正規化テキストの原文一致も見る）
+        with chat_stage_seconds.time(stage="keyword_match"):
+            keyword_matcher, sensitive_raw_matcher = get_keyword_matchers()
+            self.keyword_hits = keyword_matcher.find_all(self.hiragana)
+            for label, keywords in sensitive_raw_matcher.find_all(self.normalized_lower).items():
+                found = self.keyword_hits.setdefault(label, [])
+                found.extend(kw for kw in keywords if kw not in found)
+
+        # parsed: まとめて解析済みの（表層形リスト, 品詞リスト）。省略時はここで解析する
+        if parsed is None:
+            with chat_stage_seconds.time(stage="spacy"):
+                parsed = parse_text(text)
+        self.tokens, self.pos_tags = parsed
+        self.emotions = None  # ML-Ask の感情カテゴリ（analyze_mood で設定）
+        self.nouns = [tok for tok, pos in zip(self.tokens, self.pos_tags) if pos == "NOUN"]
+
+# ✅ 名詞リストの保存形式（ChatHistory.nouns 列は JSON 配列の文字列）
+def dump_nouns(nouns):
+    return json.dumps(list(nouns), ensure_ascii=False)
+
+def load_nouns(value):
+    return json.loads(value) if value else []
+
+# ✅ トピック一貫性分析（過去ログは保存済みの名詞を読むだけ。未保存の古い行のみ再解析）
+def analyze_topic_consistency(current_text, session_id, limit=None, analysis=None, state=None):
+    analysis = analysis or MessageAnalysis(current_text)
+    current_nouns = set(analysis.nouns)
     if not current_nouns:
         return 0.0  # 名詞がない場合は一貫性なし
 
-    past_logs = (
-        ChatHistory.query
-        .filter_by(session_id=session_id)
-        .order_by(ChatHistory.id.desc())
-        .limit(limit)
-        .all()
-    )
+    if limit is None:
+        limit = current_app.config["TOPIC_CONSISTENCY_WINDOW"]
 
-    past_noun_sets = [set(extract_nouns(log.user_message)) for log in past_logs]
+    if state is not None and state.history_loaded and limit <= state.recent_nouns.maxlen:
+        past_noun_sets = [set(nouns) for nouns in list(state.recent_nouns)[-limit:]]
+    else:
+        past_logs = (
+            db.session.query(ChatHistory.nouns, ChatHistory.user_message)
+            .filter(ChatHistory.session_id == session_id)
+            .order_by(ChatHistory.id.desc())
+            .limit(limit)
+            .all()
+        )
+        past_noun_sets = [
+            set(load_nouns(nouns)) if nouns is not None else set(extract_nouns(user_message))
+            for nouns, user_message in past_logs
+        ]
     overlap_scores = [
         len(current_nouns & nouns) / len(current_nouns | nouns) if nouns else 0
         for nouns in past_noun_sets
@@ -259,16 +832,13 @@ def get_keyword_trend(session_id, keywords, limit=10):
 
 # ✅ 感情分析本体
 
-def analyze_mood(text):
-    doc = nlp(text)
-    tokens = [token.text for token in doc]
-    wakati_text = " ".join(tokens)
-    emotion = emotion_analyzer.analyze(wakati_text)
-    print("🔍 ML-Askの結果:", emotion)
-
-    normalized_text = unicodedata.normalize("NFKC", text)
-    hiragana_text = to_hiragana(normalized_text).replace(" ", "")
-    print("🧪 ひらがな変換後のテキスト:", hiragana_text)
+def analyze_mood(text, analysis=None):
+    analysis = analysis or MessageAnalysis(text)
+    wakati_text = " ".join(analysis.tokens)
+    with chat_stage_seconds.time(stage="mlask"):
+        emotion = get_emotion_analyzer().analyze(wakati_text)
+    logger.debug("🔍 ML-Askの結果: %s", emotion)
+    logger.debug("🧪 ひらがな変換後のテキスト: %s", analysis.hiragana)
 
     # ✅ 感情カテゴリを抽出（文字列でも辞書でも対応）
     emotion_data = emotion.get("emotion") if isinstance(emotion, dict) else None
@@ -279,34 +849,18 @@ def analyze_mood(text):
     else:
         emotions = set()
 
-    print("🧪 感情カテゴリ:", emotions)
+    logger.debug("🧪 感情カテゴリ: %s", emotions)
 
     # ✅ 英語カテゴリに基づく感情セット
     is_stress_emotion = emotions.intersection({"anger", "fear", "dislike", "sadness"})
     is_positive_emotion = emotions.intersection({"joy", "relief", "like"})
 
-    # ✅ キーワード判定（ひらがな対応）
-    stress_keywords = [
-        "つかれ", "つらい", "しんどい", "しにたい", "おこられた", "もうむり",
-        "やばい", "きらい", "むかつく", "いらいら", "にがて", "きもちわるい", "いそがしい",
-        "だるい", "ねむい", "へとへと", "すとれす", "きがおもい", "にげたい", "かなし",
-        "おちこむ", "げんかい", "こどく", "ふあん", "ゆううつ", "どなられた", "ののしられた", "こわい", "もうだめ", "ひどいことをされた"
-    ]
-    positive_keywords = [
-    "たのしい", "うれしい", "ほめられた", "ありがとう", "さいこう", "だいじょうぶ",
-    "すき", "あいしてる", "あんしん", "おもしろい", "わらえた", "はっぴー", "いやされた",
-    "げんきでた", "はげまされた", "ぽじてぃぶ", "じしんがある", "きぶんがいい", "すっきり", "まえむき", "しあわせ",
-    "せいちょう", "できた", "がんばった", "しゅうちゅうできた", "たっせい",
-    "しゅうりょう", "しゅくだいおわった", "まにあった", "ほめられて", "やりとげた",
-    "うまくいった", "じぶんにかてた", "やくにたった", "いいかんじ", "のりこえた"
-]
-
-    import re
-    contains_stress_word = any(re.search(word, hiragana_text) for word in stress_keywords)
-    contains_positive_word = any(re.search(word, hiragana_text) for word in positive_keywords)
+    # ✅ キーワード判定（ひらがな対応・構築済みのキーワード照合器の結果を参照）
+    contains_stress_word = "stress" in analysis.keyword_hits
+    contains_positive_word = "positive" in analysis.keyword_hits
 
-    print("🧪 キーワード判定（ストレス）:", contains_stress_word)
-    print("🧪 キーワード判定（ポジティブ）:", contains_positive_word)
+    logger.debug("🧪 キーワード判定（ストレス）: %s", contains_stress_word)
+    logger.debug("🧪 キーワード判定（ポジティブ）: %s", contains_positive_word)
 
     # ✅ 最終的な感情の分類（優先度つき）
     if contains_stress_word:
@@ -324,12 +878,265 @@ def analyze_mood(text):
     else:
         mood = "普通"
 
-    print("🧪 判定結果:", mood)
+    logger.debug("🧪 判定結果: %s", mood)
+    analysis.emotions = emotions
     return mood
 
 
+# ✅ メッセージ単位の解析結果キャッシュ（受け取った文面そのものがキー、プロセス内の LRU）
+# 形態素解析・ML-Ask は正規化前の文面で行うため、全角/半角だけが違う文面も別々に解析して保持する
+# 「疲れた」「眠い」のような短い定型メッセージは社員間で何度も繰り返されるため、
+# GiNZA・ML-Ask・kakasi の結果（MessageAnalysis と心理状態）を再利用する
+# キーワードリスト・解析モデルが変わると fingerprint が変わり、キャッシュ全体を破棄する
+# 保持する MessageAnalysis は複数リクエストで共有するので、読み取り専用として扱うこと
+class AnalysisCache:
+    def __init__(self, max_size, max_bytes, max_text_length):
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.configure(max_size, max_bytes, max_text_length)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def configure(self, max_size, max_bytes, max_text_length):
+        with self._lock:
+            self.max_size = max_size
+            self.max_bytes = max_bytes
+            self.max_text_length = max_text_length
+            self._items.clear()
+            self.bytes = 0
+            self.fingerprint = None
+
+    def _check_fingerprint(self, fingerprint):
+        if fingerprint != self.fingerprint:
+            if self._items:
+                self.invalidations += 1
+            self._items.clear()
+            self.bytes = 0
+            self.fingerprint = fingerprint
+
+    def get(self, key, fingerprint):
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1], item[2]
+
+    def put(self, key, fingerprint, analysis, mood):
+        if self.max_size <= 0 or len(key) > self.max_text_length:
+            return
+        size = estimate_analysis_size(analysis)
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[0]
+            self._items[key] = (size, analysis, mood)
+            self.bytes += size
+            while self._items and (len(self._items) > self.max_size or self.bytes > self.max_bytes):
+                evicted_size, _, _ = self._items.popitem(last=False)[1]
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "max_size": self.max_size,
+                "max_bytes": self.max_bytes,
+                "max_text_length": self.max_text_length
+            }
+
+# 1エントリのおおよそのメモリ量（文字列・リストの sys.getsizeof の合計）
+def estimate_analysis_size(analysis):
+    strings = [analysis.text, analysis.normalized, analysis.normalized_lower, analysis.hiragana]
+    strings += analysis.tokens + analysis.pos_tags + analysis.nouns
+    strings += [keyword for keywords in analysis.keyword_hits.values() for keyword in keywords]
+    lists = [analysis.tokens, analysis.pos_tags, analysis.nouns, *analysis.keyword_hits.values()]
+    return (
+        sum(sys.getsizeof(value) for value in strings)
+        + sum(sys.getsizeof(value) for value in lists)
+        + sys.getsizeof(analysis.keyword_hits) + sys.getsizeof(analysis.__dict__) + 200
+    )
+
+# キャッシュを無効にする条件（キーワードリストの内容・解析バックエンド・モデルのバージョン）
+def analysis_fingerprint():
+    return hash((keyword_fingerprint(), services().nlp_model_version))
+
+def analyze_message(text):
+    state = services()
+    fingerprint = analysis_fingerprint()
+    cached = state.analysis_cache.get(text, fingerprint)
+    if cached is not None:
+        return cached
+
+    if state.analysis_executor is not None:
+        try:
+            analysis, mood = state.analysis_executor.analyze(text)
+        except BrokenProcessPool as e:
+            logger.warning("⚠️ 解析プロセスが停止したため、このリクエストはプロセス内で解析します: %s", e)
+            analysis, mood = analyze_in_worker(text)
+    else:
+        analysis, mood = analyze_in_worker(text)
+    state.analysis_cache.put(text, fingerprint, analysis, mood)
+    return analysis, mood
+
+# ✅ 複数メッセージの解析（/chat_batch 用）。キャッシュにない文面だけを重複を除いて nlp.pipe でまとめて解析する
+# （NLP_EXECUTOR=process でもプロセスプールは使わず、このプロセスで解析する）
+def analyze_messages(texts):
+    analysis_cache = services().analysis_cache
+    fingerprint = analysis_fingerprint()
+    results = {}
+    missing = []
+    for text in texts:
+        if text in results:
+            continue
+        cached = analysis_cache.get(text, fingerprint)
+        results[text] = cached
+        if cached is None:
+            missing.append(text)
+
+    if missing:
+        for text, fields in zip(missing, parse_many(missing)):
+            analysis = MessageAnalysis(text, parsed=fields)
+            mood = analyze_mood(text, analysis)
+            results[text] = (analysis, mood)
+            analysis_cache.put(text, fingerprint, analysis, mood)
+    return [results[text] for text in texts]
+
+
+# ✅ セッション単位の会話状態（プロフィール・ログ件数・直近の応答/心理状態/名詞）
+RECENT_RESPONSE_LIMIT = 3
+
+class SessionState:
+    def __init__(self, user):
+        self.session_id = user.session_id
+        self.preferred_response_type = user.preferred_response_type
+        self.last_psychological_state = user.last_psychological_state
+        self.previous_psychological_state = user.previous_psychological_state
+        self.stress_count = user.stress_count
+        self.department = user.department
+        self.age_group = user.age_group
+        self.state_version = user.state_version
+
+        # 履歴部分は /chat で必要になったときに読み込む
+        self.history_loaded = False
+        self.log_count = 0
+        self.recent_responses = deque(maxlen=RECENT_RESPONSE_LIMIT)
+        self.recent_moods = deque(maxlen=RECENT_RESPONSE_LIMIT)
+        self.recent_nouns = deque(maxlen=current_app.config["TOPIC_CONSISTENCY_WINDOW"])
+
+    def load_history(self):
+        window = max(RECENT_RESPONSE_LIMIT, current_app.config["TOPIC_CONSISTENCY_WINDOW"])
+        self.log_count = ChatHistory.query.filter_by(session_id=self.session_id).count()
+        recent_logs = (
+            db.session.query(ChatHistory.bot_response, ChatHistory.psychological_state,
+                             ChatHistory.nouns, ChatHistory.user_message)
+            .filter(ChatHistory.session_id == self.session_id)
+            .order_by(ChatHistory.id.desc())
+            .limit(window)
+            .all()
+        )
+        for bot_response, state, nouns, user_message in reversed(recent_logs):
+            self.recent_responses.append(bot_response)
+            self.recent_moods.append(state)
+            self.recent_nouns.append(load_nouns(nouns) if nouns is not None else extract_nouns(user_message))
+        self.history_loaded = True
+
+    # ✅ コミット済みの書き込みをそのまま反映（DBを読み直さない）
+    def record_message(self, mood, stress_count, bot_response, nouns):
+        self.previous_psychological_state = self.last_psychological_state
+        self.last_psychological_state = mood
+        self.stress_count = stress_count
+        self.state_version += 1
+        self.log_count += 1
+        self.recent_responses.append(bot_response)
+        self.recent_moods.append(mood)
+        self.recent_nouns.append(list(nouns))
+
+# ✅ TTL + LRU で上限を持つプロセス内キャッシュ（ワーカー間で共有しないため TTL で鮮度を保つ）
+class SessionStateCache:
+    def __init__(self, max_size, ttl):
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.configure(max_size, ttl)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def configure(self, max_size, ttl):
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._items.clear()
+
+    def get(self, session_id):
+        with self._lock:
+            item = self._items.get(session_id)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, state = item
+            if expires_at < time.monotonic():
+                del self._items[session_id]
+                self.misses += 1
+                return None
+            self._items.move_to_end(session_id)
+            self.hits += 1
+            return state
+
+    def put(self, state):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._items[state.session_id] = (time.monotonic() + self.ttl, state)
+            self._items.move_to_end(state.session_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._items.pop(session_id, None)
+
+# ✅ キャッシュのヒット時も、別のワーカーがこのユーザーを更新していないか state_version だけ確認する
+# （スティッキーセッションなしで複数ワーカー・ノードに振り分けられても古い状態を使わない。主キー索引の1行読みのみ）
+def get_session_state(session_id, with_history=False):
+    session_cache = services().session_cache
+    state = session_cache.get(session_id)
+    if state is not None and current_app.config["SESSION_CACHE_VALIDATE"]:
+        version = db.session.query(User.state_version).filter_by(session_id=session_id).scalar()
+        if version is None or version > state.state_version:
+            session_cache.invalidate(session_id)
+            session_cache.stale += 1
+            state = None
+    if state is None:
+        flush_pending_chat_logs()
+        user = User.query.filter_by(session_id=session_id).first()
+        if not user:
+            return None
+        state = SessionState(user)
+        session_cache.put(state)
+    if with_history and not state.history_loaded:
+        flush_pending_chat_logs()
+        state.load_history()
+    return state
+
 # ✅ セッションID取得
-@app.route("/session_info", methods=["GET"])
+@bp.route("/session_info", methods=["GET"])
 def session_info():
     if "session_id" not in session or not session["session_id"]:
         session["session_id"] = str(uuid.uuid4())
@@ -338,12 +1145,12 @@ def session_info():
     return jsonify({"session_id": session["session_id"]})
 
 # ✅ プロフィール取得
-@app.route("/get_profile", methods=["GET"])
+@bp.route("/get_profile", methods=["GET"])
 def get_profile():
     if "session_id" not in session:
         return jsonify({"error": "セッションがありません"}), 400
 
-    user = User.query.filter_by(session_id=session["session_id"]).first()
+    user = get_session_state(session["session_id"])
     if not user:
         return jsonify({"error": "ユーザーが見つかりません"}), 404
 
@@ -353,7 +1160,7 @@ def get_profile():
     })
 
 # ✅ プロフィール登録
-@app.route("/set_profile", methods=["POST"])
+@bp.route("/set_profile", methods=["POST"])
 def set_profile():
     if "session_id" not in session:
         return jsonify({"error": "セッションがありません"}), 400
@@ -388,13 +1195,18 @@ def set_profile():
     user.department = department
     user.age_group = age_group
     user.preferred_response_type = preferred_response_type
+    user.state_version = (user.state_version or 0) + 1
     db.session.commit()
+    services().session_cache.invalidate(user.session_id)
 
-    print(f"🧑‍💼 ユーザー情報 - セッションID: {user.session_id}, 部署: {user.department}, 年代: {user.age_group}, 応答タイプ: {user.preferred_response_type}")
+    logger.debug(
+        "🧑‍💼 ユーザー情報 - セッションID: %s, 部署: %s, 年代: %s, 応答タイプ: %s",
+        user.session_id, user.department, user.age_group, user.preferred_response_type
+    )
     return jsonify({"message": "プロフィールを更新しました。"})
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         session_id = request.form.get("session_id")
@@ -407,23 +1219,24 @@ def login():
     return render_template("login.html")
 
 # ✅ トップページ
-from flask import redirect, url_for
-
-@app.route("/")
+@bp.route("/")
 def index():
     # ✅ セッションIDが未設定ならログイン画面にリダイレクト
     if "session_id" not in session or not session["session_id"]:
-        return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
 
     # ✅ セッションIDに対応するユーザーが存在しなければログイン画面に戻す
-    user = User.query.filter_by(session_id=session["session_id"]).first()
+    user = get_session_state(session["session_id"])
     if not user:
-        return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
 
     return render_template("index.html")
 
 # ✅ 直近ログの応答履歴を取得（文脈分析用）
-def get_recent_mood_trend(session_id, limit=3):
+def get_recent_mood_trend(session_id, limit=3, state=None):
+    if state is not None and state.history_loaded:
+        return list(state.recent_responses)[-limit:]
+
     recent_logs = (
         ChatHistory.query
         .filter_by(session_id=session_id)
@@ -439,20 +1252,371 @@ SENSITIVE_KEYWORDS = [
     "消えたくなる", "つらい", "もう無理", "終わりにしたい"
 ]
 
-# センシティブ判定関数
-def detect_sensitive_content(text):
-    print("📣 センシティブ判定開始")
-    normalized = unicodedata.normalize("NFKC", text.lower())
-    hiragana_text = to_hiragana(normalized)
+# ✅ キーワード照合器の構築（プロセスで1回だけ。センシティブ語のひらがな変換もここで済ませる）
+def build_keyword_matchers():
+    matcher = KeywordMatcher()
+    for keyword in stress_keywords:
+        matcher.add(keyword, "stress")
+    for keyword in positive_keywords:
+        matcher.add(keyword, "positive")
+    for keyword in harassment_keywords:
+        matcher.add(keyword, "harassment")
+    for keyword in SENSITIVE_KEYWORDS:
+        matcher.add(to_hiragana(keyword), "sensitive", keyword)
 
+    raw_matcher = KeywordMatcher()
     for keyword in SENSITIVE_KEYWORDS:
-        keyword_hiragana = to_hiragana(keyword)
-        if keyword in normalized or keyword_hiragana in hiragana_text:
-            print(f"🔍 センシティブキーワード検出: {keyword}")
-            return True
+        raw_matcher.add(keyword, "sensitive")
+
+    return matcher.build(), raw_matcher.build()
+
+# キーワードリストの中身が変わったら照合器を作り直す（解析キャッシュも同じ値で無効化する）
+def keyword_fingerprint():
+    return hash((tuple(stress_keywords), tuple(positive_keywords), tuple(harassment_keywords), tuple(SENSITIVE_KEYWORDS)))
+
+def get_keyword_matchers():
+    global _keyword_matchers
+    fingerprint = keyword_fingerprint()
+    if _keyword_matchers is None or _keyword_matchers[0] != fingerprint:
+        with _resource_lock:
+            if _keyword_matchers is None or _keyword_matchers[0] != fingerprint:
+                _keyword_matchers = (fingerprint, build_keyword_matchers())
+    return _keyword_matchers[1]
+
+# センシティブ判定関数
+def detect_sensitive_content(text, analysis=None):
+    logger.debug("📣 センシティブ判定開始")
+    analysis = analysis or MessageAnalysis(text)
+
+    matched = analysis.keyword_hits.get("sensitive")
+    if matched:
+        keyword = next(kw for kw in SENSITIVE_KEYWORDS if kw in matched)
+        logger.debug("🔍 センシティブキーワード検出: %s", keyword)
+        return True
     return False
 
-@app.route("/chat", methods=["POST"])
+# ✅ ChatHistory の行を一括 INSERT 用の値に変換（既定値もここで確定させ、時刻はメッセージ受信時点にする）
+def chat_row_values(row):
+    values = {column.name: getattr(row, column.name) for column in ChatHistory.__table__.columns if column.name != "id"}
+    values["timestamp"] = values["timestamp"] or datetime.utcnow()
+    values["harassment_flag"] = bool(values["harassment_flag"])
+    values["sensitive_flag"] = bool(values["sensitive_flag"])
+    return values
+
+# ✅ 複数ターン分（ユーザー状態の更新＋ログ行）を1トランザクションで書き込む
+# 同じセッションの複数ターンは最後の状態だけを書き、state_version はターン数だけ進める
+def write_chat_turns(turns):
+    updates = {}
+    for turn in turns:
+        values, count = updates.get(turn["session_id"], ({}, 0))
+        updates[turn["session_id"]] = ({**values, **turn["user_update"]}, count + 1)
+    for session_id, (values, count) in updates.items():
+        db.session.execute(
+            db.update(User).where(User.session_id == session_id)
+            .values(**values, state_version=User.state_version + count)
+        )
+    rows = [row for turn in turns for row in turn["rows"]]
+    if rows:
+        # ✅ 日次集計も同じトランザクションで更新（集計済み位置から追いつくので、取りこぼしも拾う）
+        # 未集計のログが MOOD_ROLLUP_WRITE_LIMIT 件を超えている間（移行直後など）は書き込み時には集計せず、flask rollup-moods に任せる
+        rollup = current_app.config["MOOD_ROLLUP_ON_WRITE"] and not mood_rollup_behind(MOOD_ROLLUP_WRITE_LIMIT)
+        db.session.execute(db.insert(ChatHistory), rows)
+        if rollup:
+            apply_mood_rollups(limit=MOOD_ROLLUP_WRITE_LIMIT + len(rows))
+    notices = [notice for turn in turns for notice in turn.get("notices", ())]
+    if notices:
+        db.session.execute(db.insert(AdminNotification), notices)
+    db.session.commit()
+    feed = services().log_feed
+    if rows and feed is not None:
+        feed.wake()
+    if notices:
+        announce_admin_notifications()
+
+# ✅ ログの遅延書き込み（write-behind、CHAT_LOG_WRITE_BEHIND=1 のときのみ）
+# /chat は1ターン分をキューに積んですぐ応答し、バックグラウンドスレッドが flush_ms ミリ秒ごと
+# （flush_rows 件たまったら即座に）まとめて1トランザクションで書き込む
+# 書き込み前の状態はセッションキャッシュ（record_message）が保持し、キャッシュにないセッションは DB を読む前に flush する
+class ChatLogWriter:
+    def __init__(self, app, max_queue=1000, flush_rows=50, flush_ms=200):
+        self.app = app
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_ms / 1000.0
+        self._queue = queue.Queue(max_queue)
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.queued = 0
+        self.sync_fallbacks = 0
+        self.batches = 0
+        self.written_rows = 0
+        self.failed_turns = 0
+
+    # fork 後のワーカーではスレッドが引き継がれないため、最初の投入時に起動する
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self._queue.maxsize)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="chat-log-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, turn):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(turn)
+        except queue.Full:
+            # キューが満杯なら、待っている分と合わせてこのリクエスト内で書き込む（ターンの順序を保つ）
+            with self._lock:
+                self.sync_fallbacks += 1
+            self.flush(extra=[turn])
+            return
+        with self._lock:
+            self.queued += 1
+        if self._queue.qsize() >= self.flush_rows:
+            self._wakeup.set()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _drain(self):
+        turns = []
+        while True:
+            try:
+                turns.append(self._queue.get_nowait())
+            except queue.Empty:
+                return turns
+
+    # キューから取り出して書き込むまでをロック内で行う（書き込み順 = 投入順）
+    def flush(self, extra=()):
+        with self._flush_lock:
+            turns = self._drain() + list(extra)
+            if turns:
+                self._write(turns)
+
+    def _write(self, turns):
+        with self.app.app_context():
+            try:
+                write_chat_turns(turns)
+                written = turns
+            except Exception:
+                db.session.rollback()
+                logger.exception("❌ ログのまとめ書き込みに失敗しました。1ターンずつ書き直します")
+                # まとめて書けなければ1ターンずつ書き直し、失敗したターンだけ破棄する
+                written = []
+                for turn in turns:
+                    try:
+                        write_chat_turns([turn])
+                        written.append(turn)
+                    except Exception as e:
+                        db.session.rollback()
+                        services(self.app).session_cache.invalidate(turn["session_id"])
+                        logger.error("❌ ログの書き込みに失敗しました（%s）: %s", turn["session_id"], e)
+        with self._lock:
+            self.batches += 1
+            self.written_rows += sum(len(turn["rows"]) for turn in written)
+            self.failed_turns += len(turns) - len(written)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("❌ ログの遅延書き込みスレッドでエラーが発生しました")
+
+    # 終了時に残りを書き込む（atexit / gunicorn の worker_exit から呼ぶ）
+    def close(self):
+        if self._pid == os.getpid():
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self.queued,
+                "pending": self.pending(),
+                "sync_fallbacks": self.sync_fallbacks,
+                "batches": self.batches,
+                "written_rows": self.written_rows,
+                "failed_turns": self.failed_turns,
+                "max_queue": self._queue.maxsize,
+                "flush_rows": self.flush_rows,
+                "flush_ms": self.flush_interval * 1000.0
+            }
+
+def init_chat_log_writer(app):
+    if app.config["CHAT_LOG_WRITE_BEHIND"]:
+        writer = services(app).chat_log_writer = ChatLogWriter(
+            app,
+            max_queue=app.config["CHAT_LOG_QUEUE_SIZE"],
+            flush_rows=app.config["CHAT_LOG_FLUSH_ROWS"],
+            flush_ms=app.config["CHAT_LOG_FLUSH_MS"]
+        )
+        atexit.register(writer.close)
+
+# ✅ 遅延書き込み中のログを先に反映する（DB を読む直前に呼ぶ。同一プロセス内で自分の書き込みが見えるように）
+def flush_pending_chat_logs():
+    writer = services().chat_log_writer
+    if writer is not None and writer.pending():
+        writer.flush()
+
+# ✅ 1メッセージ分の書き込み内容（ユーザー状態の更新＋ログ行＋管理者通知）。user は書き込み前の状態
+def build_chat_turn(user, mood, stress_count, rows, notices=()):
+    return {
+        "session_id": user.session_id,
+        "user_update": {
+            "stress_count": stress_count,
+            "previous_psychological_state": user.last_psychological_state,
+            "last_psychological_state": mood
+        },
+        "rows": [chat_row_values(row) for row in rows],
+        "notices": list(notices)
+    }
+
+# ✅ 1メッセージ分の書き込み（ユーザー状態の更新＋ログ行の追加）を1トランザクションでコミット
+# 読み取りを先に済ませ、最初の書き込みから commit までを短く保つ（SQLite の書き込みロック保持時間を最小化）
+# write-behind が有効なら、キューに積むだけで応答する
+def save_chat_turn(user, mood, stress_count, rows, notices=()):
+    turn = build_chat_turn(user, mood, stress_count, rows, notices)
+    writer = services().chat_log_writer
+    if writer is not None:
+        writer.submit(turn)
+    else:
+        write_chat_turns([turn])
+
+# ✅ 解析済みの1メッセージから応答・新しいストレスカウント・保存するログ行・管理者通知を作る（DB には書かない）
+# /chat と /chat_batch で共通。user はセッション状態（SessionState）
+def compose_chat_reply(user, user_input, analysis, mood):
+    with chat_stage_seconds.time(stage="sensitive_detection"):
+        sensitive_flag = detect_sensitive_content(user_input, analysis)
+    logger.debug("🛠 センシティブ検出結果: %s", sensitive_flag)
+
+    previous_state = user.last_psychological_state
+
+    stress_count = user.stress_count + 1 if mood == "ストレスが高い" else 0
+
+    # ✅ センシティブ発言検出（優先処理）
+    if sensitive_flag:
+        response_text = (
+            "そのようなお気持ちを打ち明けてくださってありがとうございます。\n"
+            "つらい時には一人で抱えず、誰かに話すことがとても大切です。\n"
+            "必要であれば、以下の相談窓口もご利用ください：\n"
+            "📞 いのちの電話：https://www.find-help.jp/"
+        )
+        support = "https://www.find-help.jp/"
+
+        rows = [ChatHistory(
+            session_id=user.session_id,
+            user_message=user_input,
+            bot_response=response_text,
+            department=user.department,
+            age_group=user.age_group,
+            psychological_state=mood,
+            harassment_flag=False,
+            sensitive_flag=True,
+            nouns=dump_nouns(analysis.nouns)
+        )]
+        return {
+            "response": response_text,
+            "state": mood,
+            "support": support
+        }, stress_count, rows, []
+
+    # ✅ 通常応答処理（センシティブでなければこちら）
+    if stress_count >= 4:
+        response_text = "ストレスが続いているようですね。無理せず専門家の相談を受けてみませんか？"
+        support = "https://www.mhlw.go.jp/kokoro/soudan.html"
+    elif stress_count == 3:
+        response_text = "最近ストレスが続いていますね…大丈夫ですか？"
+        support = None
+    else:
+        response_text = get_response_by_mood(mood, user.preferred_response_type)
+        support = None
+
+    # ✅ 初回セッションは前回との比較をスキップ
+    log_count = user.log_count
+    if log_count > 0 and previous_state != mood:
+        response_text += f"（前回の心理状態「{previous_state}」から変化がありますね）"
+
+    # ✅ 感情傾向チェック
+    with chat_stage_seconds.time(stage="history"):
+        recent_responses = get_recent_mood_trend(user.session_id, state=user)
+    if len(recent_responses) >= 2:
+        last = recent_responses[-1]
+        second_last = recent_responses[-2]
+        if "ストレス" in second_last and "ストレス" in last and mood == "ストレスが高い":
+            response_text += " 最近ストレスの傾向が続いているようですね。心と体の休息を意識してみてくださいね。"
+        elif "気分が良い" in second_last and mood == "ストレスが高い":
+            response_text += " 少し気分が落ちているようですね。無理しないでください。"
+
+    # ✅ ハラスメント検出
+    with chat_stage_seconds.time(stage="harassment_detection"):
+        harassment_detected = detect_harassment(user_input, analysis)
+    if harassment_detected:
+        response_text += " ※ハラスメントの可能性がある内容が確認されました。困ったときは管理統括部に相談してくださいね。"
+        if not support:
+            support = "https://www.mhlw.go.jp/stf/seisakunitsuite/bunya/0000189195.html"
+
+            # ✅ アドバイスと一貫性
+    advice, advice_support = provide_advice(mood)
+
+    # ✅ consistency_score による話題の一貫性チェック（初回セッション時はスキップ）
+    if log_count > 0:
+        with chat_stage_seconds.time(stage="topic_consistency"):
+            consistency_score = analyze_topic_consistency(user_input, user.session_id, analysis=analysis, state=user)
+        if consistency_score is not None:
+            if consistency_score < 0.2:
+                response_text += "（最近の話題と少しずれているようですね。何かあったのかもしれませんね）"
+            elif consistency_score > 0.7:
+                response_text += "（最近の会話内容とつながりがありますね）"
+
+    # ✅ ログ行（保存は呼び出し側で、ユーザー状態の更新と合わせて1トランザクション）
+    rows = [ChatHistory(
+        session_id=user.session_id,
+        user_message=user_input,
+        bot_response=response_text,
+        department=user.department,
+        age_group=user.age_group,
+        psychological_state=mood,
+        harassment_flag=harassment_detected,
+        sensitive_flag=False,
+        nouns=dump_nouns(analysis.nouns)
+    )]
+
+    # ✅ 管理統括部への通知（AdminNotification。ログ行と同じトランザクションで書き込み、送信はディスパッチャーが行う）
+    notices = []
+    if harassment_detected:
+        notices.append({
+            "kind": "harassment",
+            "session_id": user.session_id,
+            "message": user_input,
+            "department": user.department,
+            "age_group": user.age_group,
+            "created_at": datetime.utcnow()
+        })
+
+    result = {
+        "response": response_text,
+        "state": mood,
+        "advice": advice
+    }
+    if support or advice_support:
+        result["support"] = support or advice_support
+
+    return result, stress_count, rows, notices
+
+def count_chat_message(mood, row):
+    chat_messages.inc(
+        mood=mood, sensitive="1" if row.sensitive_flag else "0", harassment="1" if row.harassment_flag else "0"
+    )
+
+@bp.route("/chat", methods=["POST"])
 def chat():
     if "session_id" not in session:
         return jsonify({"error": "セッションがありません"}), 400
@@ -461,165 +1625,924 @@ def chat():
         data = request.get_json()
         user_input = data.get("message", "").strip()
 
-        print(f"🛠 ユーザー入力: {user_input}")
-        print(f"🛠 センシティブ検出結果: {detect_sensitive_content(user_input)}")
+        logger.debug("🛠 ユーザー入力: %s", user_input)
 
-        user = User.query.filter_by(session_id=session["session_id"]).first()
+        # ✅ プロフィール・ログ件数・直近履歴はセッションキャッシュから取得（ミス時のみDBを読む）
+        with chat_stage_seconds.time(stage="user_lookup"):
+            user = get_session_state(session["session_id"], with_history=True)
         if not user:
             return jsonify({"error": "ユーザーが見つかりません"}), 400
 
         if not user.department or not user.age_group:
             return jsonify({"error": "プロフィール（部署・年代）を先に設定してください。"}), 400
 
-        previous_state = user.last_psychological_state
-        mood = analyze_mood(user_input)
+        # ✅ 正規化・ひらがな変換・形態素解析はここで1回だけ行い、以降の判定で使い回す
+        # （同じ文面の解析結果はプロセス内の解析キャッシュから再利用する。NLP_EXECUTOR=process なら子プロセスで解析）
+        try:
+            with chat_stage_seconds.time(stage="analysis"):
+                analysis, mood = analyze_message(user_input)
+        except FuturesTimeoutError:
+            return jsonify({"error": "ただいま混み合っています。しばらくしてから再度お試しください。"}), 503
 
-        user.stress_count = user.stress_count + 1 if mood == "ストレスが高い" else 0
-        user.previous_psychological_state = previous_state
-        user.last_psychological_state = mood
-        db.session.commit()
+        result, stress_count, rows, notices = compose_chat_reply(user, user_input, analysis, mood)
 
-        # ✅ センシティブ発言検出（優先処理）
-        sensitive_flag = detect_sensitive_content(user_input)
-        if sensitive_flag:
-            response_text = (
-                "そのようなお気持ちを打ち明けてくださってありがとうございます。\n"
-                "つらい時には一人で抱えず、誰かに話すことがとても大切です。\n"
-                "必要であれば、以下の相談窓口もご利用ください：\n"
-                "📞 いのちの電話：https://www.find-help.jp/"
-            )
-            support = "https://www.find-help.jp/"
-
-            db.session.add(ChatHistory(
-                session_id=user.session_id,
-                user_message=user_input,
-                bot_response=response_text,
-                department=user.department,
-                age_group=user.age_group,
-                psychological_state=mood,
-                harassment_flag=False,
-                sensitive_flag=True
-            ))
-            db.session.commit()
+        with chat_stage_seconds.time(stage="commit"):
+            save_chat_turn(user, mood, stress_count, rows, notices)
+        user.record_message(mood, stress_count, result["response"], analysis.nouns)
+        count_chat_message(mood, rows[0])
 
-            return jsonify({
-                "response": response_text,
-                "state": mood,
-                "support": support
-            })
-
-        # ✅ 通常応答処理（センシティブでなければこちら）
-        if user.stress_count >= 4:
-            response_text = "ストレスが続いているようですね。無理せず専門家の相談を受けてみませんか？"
-            support = "https://www.mhlw.go.jp/kokoro/soudan.html"
-        elif user.stress_count == 3:
-            response_text = "最近ストレスが続いていますね…大丈夫ですか？"
-            support = None
-        else:
-            response_text = get_response_by_mood(mood, user.preferred_response_type)
-            support = None
-
-        # ✅ 初回セッションは前回との比較をスキップ
-        log_count = ChatHistory.query.filter_by(session_id=user.session_id).count()
-        if log_count > 0 and previous_state != mood:
-            response_text += f"（前回の心理状態「{previous_state}」から変化がありますね）"
-
-        # ✅ 感情傾向チェック
-        recent_responses = get_recent_mood_trend(user.session_id)
-        if len(recent_responses) >= 2:
-            last = recent_responses[-1]
-            second_last = recent_responses[-2]
-            if "ストレス" in second_last and "ストレス" in last and mood == "ストレスが高い":
-                response_text += " 最近ストレスの傾向が続いているようですね。心と体の休息を意識してみてくださいね。"
-            elif "気分が良い" in second_last and mood == "ストレスが高い":
-                response_text += " 少し気分が落ちているようですね。無理しないでください。"
-
-        # ✅ ハラスメント検出
-        harassment_detected = detect_harassment(user_input)
-        if harassment_detected:
-            response_text += " ※ハラスメントの可能性がある内容が確認されました。困ったときは管理統括部に相談してくださいね。"
-            if not support:
-                support = "https://www.mhlw.go.jp/stf/seisakunitsuite/bunya/0000189195.html"
-
-                # ✅ アドバイスと一貫性
-        advice, advice_support = provide_advice(mood)
-
-        # ✅ consistency_score による話題の一貫性チェック（初回セッション時はスキップ）
-        log_count = ChatHistory.query.filter_by(session_id=user.session_id).count()
-        if log_count > 0:
-            consistency_score = analyze_topic_consistency(user_input, user.session_id)
-            if consistency_score is not None:
-                if consistency_score < 0.2:
-                    response_text += "（最近の話題と少しずれているようですね。何かあったのかもしれませんね）"
-                elif consistency_score > 0.7:
-                    response_text += "（最近の会話内容とつながりがありますね）"
-
-        # ✅ ログ保存
-        db.session.add(ChatHistory(
-            session_id=user.session_id,
-            user_message=user_input,
-            bot_response=response_text,
-            department=user.department,
-            age_group=user.age_group,
-            psychological_state=mood,
-            harassment_flag=harassment_detected,
-            sensitive_flag=False
-        ))
-
-        if harassment_detected:
-            db.session.add(ChatHistory(
-                session_id="admin-notice",
-                user_message=f"[通知] セッション {user.session_id} にてハラスメント疑いの発言: {user_input}",
-                bot_response="管理統括部に通知されました。",
-                department=user.department,
-                age_group=user.age_group,
-                psychological_state="ストレスが高い"
-            ))
+        return jsonify(result)
 
-        db.session.commit()
 
-        result = {
-            "response": response_text,
-            "state": mood,
-            "advice": advice
-        }
-        if support or advice_support:
-            result["support"] = support or advice_support
+    except Exception as e:
+        logger.exception("❌ /chat の処理中にエラーが発生しました")
+        db.session.rollback()
+        services().session_cache.invalidate(session["session_id"])
+        return jsonify({"error": f"サーバー内部エラー: {str(e)}"}), 500
 
-        return jsonify(result)
+# ✅ 複数メッセージをまとめて処理する（アンケート回答の一括取り込みなど）
+# items: (session_id, message) のリスト。解析は nlp.pipe でまとめて行い、応答と状態遷移（stress_count など）は
+# セッションごとに items の順に /chat と同じ規則で適用する。ログは全件を1回の一括 INSERT・1回のコミットで書き込む
+# 戻り値は items と同じ順の結果リスト（エラーのメッセージは {"error": ...}、書き込みはしない）
+def process_chat_batch(items):
+    max_size = current_app.config["CHAT_BATCH_MAX_SIZE"]
+    if len(items) > max_size:
+        raise ValueError(f"1回に処理できるメッセージは {max_size} 件までです")
+    flush_pending_chat_logs()  # write-behind のキューに残っているターンより後ろに書く
+
+    states = {}
+    for session_id, _ in items:
+        if session_id not in states:
+            states[session_id] = get_session_state(session_id, with_history=True)
+
+    with chat_stage_seconds.time(stage="batch_analysis"):
+        analyzed = analyze_messages([message for _, message in items])
+
+    results = []
+    turns = []
+    for (session_id, message), (analysis, mood) in zip(items, analyzed):
+        user = states[session_id]
+        if not user:
+            results.append({"session_id": session_id, "error": "ユーザーが見つかりません"})
+            continue
+        if not user.department or not user.age_group:
+            results.append({"session_id": session_id, "error": "プロフィール（部署・年代）を先に設定してください。"})
+            continue
 
+        result, stress_count, rows, notices = compose_chat_reply(user, message, analysis, mood)
+        turns.append(build_chat_turn(user, mood, stress_count, rows, notices))
+        user.record_message(mood, stress_count, result["response"], analysis.nouns)
+        count_chat_message(mood, rows[0])
+        results.append({"session_id": session_id, **result})
 
+    try:
+        with chat_stage_seconds.time(stage="batch_commit"):
+            write_chat_turns(turns)
+    except Exception:
+        db.session.rollback()
+        for session_id in states:
+            services().session_cache.invalidate(session_id)
+        raise
+    return results
+
+@bp.route("/chat_batch", methods=["POST"])
+def chat_batch():
+    data = request.get_json(silent=True) or {}
+    messages = data.get("messages")
+    if not isinstance(messages, list) or not messages:
+        return jsonify({"error": "messages にメッセージの配列を指定してください"}), 400
+    if len(messages) > current_app.config["CHAT_BATCH_MAX_SIZE"]:
+        return jsonify({"error": f"1回に送れるメッセージは {current_app.config['CHAT_BATCH_MAX_SIZE']} 件までです"}), 400
+
+    # 各要素は {"session_id": ..., "message": ...}。session_id を省略した要素はログイン中のセッションとして扱う
+    items = []
+    for item in messages:
+        if isinstance(item, str):
+            item = {"message": item}
+        if not isinstance(item, dict) or not isinstance(item.get("message", ""), str):
+            return jsonify({"error": "messages の要素が不正です"}), 400
+        session_id = item.get("session_id") or session.get("session_id")
+        if not session_id:
+            return jsonify({"error": "セッションがありません"}), 400
+        items.append((session_id, item.get("message", "").strip()))
+
+    try:
+        results = process_chat_batch(items)
     except Exception as e:
-        print(traceback.format_exc())
+        logger.exception("❌ /chat_batch の処理中にエラーが発生しました")
         return jsonify({"error": f"サーバー内部エラー: {str(e)}"}), 500
 
+    errors = sum(1 for result in results if "error" in result)
+    return jsonify({"results": results, "processed": len(results) - errors, "errors": errors})
+
+# ✅ 管理者通知の送信（ADMIN_NOTIFICATION_DISPATCH=thread のとき、リクエスト外のスレッドで送る）
+# 書き込み直後に wake() で起こし、それ以外も interval 秒ごとに送信待ちを拾う（他ワーカーが書いた通知や再送分）
+# 送る前に claimed_at を条件付き UPDATE で埋めてから送り（複数ワーカー・CLI と同時に動いても二重に送らない）、
+# 送り終えてから dispatched_at を埋める。claimed_at は lease 秒で切れるので、送信中にプロセスが落ちても期限後に送り直す
+# 失敗したら max_attempts 回まで再送する。再送は前回失敗した sink（dispatch_error に記録）にだけ行う
+class NotificationDispatcher:
+    def __init__(self, app, sinks, interval=5.0, max_attempts=3, batch_size=50, lease=120.0):
+        self.app = app
+        self.sinks = sinks
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._dispatch_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.sent = 0
+        self.failed = 0
+        self.rounds = 0
+
+    # fork 後のワーカーではスレッドが引き継がれないため、最初に使われたときに起動する
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="admin-notification-dispatcher", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._ensure_started()
+        self._wakeup.set()
+
+    # 送信待ち（未送信で、誰も送信中でないか送信中の印が期限切れ）
+    def _pending(self, now):
+        return (
+            AdminNotification.dispatched_at.is_(None),
+            AdminNotification.dispatch_attempts < self.max_attempts,
+            db.or_(AdminNotification.claimed_at.is_(None),
+                   AdminNotification.claimed_at < now - timedelta(seconds=self.lease))
+        )
+
+    def _claim(self, notification_id):
+        claimed_at = datetime.utcnow()
+        claimed = db.session.execute(
+            db.update(AdminNotification)
+            .where(AdminNotification.id == notification_id, *self._pending(claimed_at))
+            .values(claimed_at=claimed_at)
+        ).rowcount
+        db.session.commit()
+        return claimed_at if claimed == 1 else None
+
+    # dispatch_error は「sink 名: エラー」の行の並び
+    def _send(self, notice):
+        notification = notification_to_dict(notice)
+        names = list(self.sinks)
+        if notice.dispatch_error:
+            failed = {line.split(":", 1)[0] for line in notice.dispatch_error.splitlines()}
+            names = [name for name in names if name in failed]
+        errors = []
+        for name in names:
+            try:
+                self.sinks[name].send(notification)
+                admin_notifications_dispatched.inc(sink=name, result="sent")
+            except Exception as e:
+                admin_notifications_dispatched.inc(sink=name, result="failed")
+                logger.warning("⚠️ 管理者通知 #%s の送信に失敗しました（%s）: %s", notice.id, name, e)
+                errors.append(f"{name}: " + " ".join(str(e).splitlines()))
+        return errors
+
+    # 送信待ちを batch_size 件まで送る（呼び出しはアプリコンテキスト内）。取り出した件数を返す
+    def dispatch_once(self):
+        with self._dispatch_lock:
+            pending = [row.id for row in (
+                db.session.query(AdminNotification.id)
+                .filter(*self._pending(datetime.utcnow()))
+                .order_by(AdminNotification.id.asc())
+                .limit(self.batch_size)
+            )]
+            db.session.commit()
+            sent = failed = 0
+            for notification_id in pending:
+                claimed_at = self._claim(notification_id)
+                if claimed_at is None:
+                    continue  # 他のワーカーが先に取った
+                errors = self._send(db.session.get(AdminNotification, notification_id))
+                # 期限切れで他のワーカーが取り直していたら書き換えない（そちらの結果を残す）
+                db.session.execute(
+                    db.update(AdminNotification)
+                    .where(AdminNotification.id == notification_id, AdminNotification.claimed_at == claimed_at)
+                    .values(dispatched_at=None if errors else datetime.utcnow(), claimed_at=None,
+                            dispatch_attempts=AdminNotification.dispatch_attempts + 1,
+                            dispatch_error="\n".join(errors) or None)
+                )
+                db.session.commit()
+                if errors:
+                    failed += 1
+                else:
+                    sent += 1
+            with self._lock:
+                self.sent += sent
+                self.failed += failed
+                self.rounds += 1
+            return len(pending)
+
+    # 送信待ちがなくなるまで送る（失敗した分は次の呼び出しで再送）
+    def dispatch_pending(self):
+        while self.dispatch_once() >= self.batch_size:
+            pass
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.dispatch_pending()
+            except Exception:
+                logger.exception("❌ 管理者通知の送信スレッドでエラーが発生しました")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sinks": list(self.sinks),
+                "sent": self.sent,
+                "failed": self.failed,
+                "rounds": self.rounds,
+                "interval": self.interval,
+                "max_attempts": self.max_attempts
+            }
+
+def init_notification_dispatcher(app):
+    services(app).notification_waiters = threading.BoundedSemaphore(max(1, app.config["ADMIN_NOTIFICATION_MAX_WAITERS"]))
+    if app.config["ADMIN_NOTIFICATION_DISPATCH"] == "thread":
+        services(app).notification_dispatcher = NotificationDispatcher(
+            app, notification_sinks.build_sinks(app.config),
+            interval=app.config["ADMIN_NOTIFICATION_INTERVAL"],
+            max_attempts=app.config["ADMIN_NOTIFICATION_MAX_ATTEMPTS"],
+            lease=app.config["ADMIN_NOTIFICATION_LEASE"]
+        )
+
+# ✅ 未読通知を待っている long-poll（同じプロセス内）を起こす。他ワーカーの書き込みは POLL_MS ごとの見直しで拾う
+admin_notification_signal = threading.Condition()
+
+def announce_admin_notifications():
+    with admin_notification_signal:
+        admin_notification_signal.notify_all()
+    dispatcher = services().notification_dispatcher
+    if dispatcher is not None:
+        dispatcher.wake()
+
+def notification_to_dict(notice):
+    return {
+        "id": notice.id,
+        "kind": notice.kind,
+        "session_id": notice.session_id,
+        "message": notice.message,
+        "department": notice.department,
+        "age_group": notice.age_group,
+        "created_at": notice.created_at.isoformat() if notice.created_at else None,
+        "created_at_jst": to_jst(notice.created_at),
+        "read_at": notice.read_at.isoformat() if notice.read_at else None
+    }
+
+# ✅ 未読のうち since より新しいものを id 順に limit 件（read_at, id の索引の範囲だけを読む）
+def unread_notifications_query(since, limit):
+    return (
+        AdminNotification.query
+        .filter(AdminNotification.read_at.is_(None), AdminNotification.id > since)
+        .order_by(AdminNotification.id.asc())
+        .limit(limit)
+    )
+
+def count_unread_notifications():
+    return db.session.query(db.func.count(AdminNotification.id)).filter(AdminNotification.read_at.is_(None)).scalar()
+
+# ✅ 未読の管理者通知（long-poll）。since より新しい未読がなければ最大 wait 秒（ADMIN_NOTIFICATION_MAX_WAIT まで）待つ
+# 戻り値の cursor を次の since に渡す。待っている間は DB のトランザクションを開いたままにしない
+# 待てる接続はプロセスごとに ADMIN_NOTIFICATION_MAX_WAITERS まで（超えた分は待たずに limited: true で返し、画面は間隔を空けて取り直す）
+ADMIN_NOTIFICATION_PAGE_SIZE = 100
+
+def wait_unread_notifications(since, limit, wait):
+    deadline = time.monotonic() + wait
+    poll_interval = current_app.config["ADMIN_NOTIFICATION_POLL_MS"] / 1000.0
+    while True:
+        notices = unread_notifications_query(since, limit).all()
+        remaining = deadline - time.monotonic()
+        if notices or remaining <= 0:
+            return notices
+        db.session.rollback()
+        with admin_notification_signal:
+            admin_notification_signal.wait(min(poll_interval, remaining))
+
+@bp.route("/api/admin/notifications")
+def api_admin_notifications():
+    try:
+        since = int(request.args.get("since", 0))
+        wait = float(request.args.get("wait", 0))
+        limit = min(int(request.args.get("limit", ADMIN_NOTIFICATION_PAGE_SIZE)), ADMIN_NOTIFICATION_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "since / wait / limit は数値で指定してください"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit は 1 以上で指定してください"}), 400
+
+    state = services()
+    if state.notification_dispatcher is not None:
+        state.notification_dispatcher.wake()  # 再起動後のワーカーでも送信待ちを拾う
+    wait = max(0.0, min(wait, current_app.config["ADMIN_NOTIFICATION_MAX_WAIT"]))
+    waiting = wait > 0 and state.notification_waiters.acquire(blocking=False)
+    try:
+        notices = wait_unread_notifications(since, limit, wait if waiting else 0)
+    finally:
+        if waiting:
+            state.notification_waiters.release()
+
+    # 未読がなければ最新の通知 id を cursor にする（同じトランザクションで読むので、その後に書かれた通知は次の since より後ろ）
+    if notices:
+        cursor = notices[-1].id
+    else:
+        cursor = max(since, db.session.query(db.func.max(AdminNotification.id)).scalar() or 0)
+    return jsonify({
+        "notifications": [notification_to_dict(notice) for notice in notices],
+        "cursor": cursor,
+        "unread_count": count_unread_notifications(),
+        "limited": wait > 0 and not waiting
+    })
+
+# ✅ 既読にする（{"ids": [...]} で個別に、{"up_to": id} でその id 以前の未読をまとめて）
+@bp.route("/api/admin/notifications/read", methods=["POST"])
+def mark_admin_notifications_read():
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+    up_to = data.get("up_to")
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(i, int) for i in ids)):
+        return jsonify({"error": "ids は整数の配列で指定してください"}), 400
+    if up_to is not None and not isinstance(up_to, int):
+        return jsonify({"error": "up_to は整数で指定してください"}), 400
+    if ids is None and up_to is None:
+        return jsonify({"error": "ids または up_to を指定してください"}), 400
+
+    condition = AdminNotification.id.in_(ids) if ids is not None else AdminNotification.id <= up_to
+    updated = db.session.execute(
+        db.update(AdminNotification)
+        .where(AdminNotification.read_at.is_(None), condition)
+        .values(read_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return jsonify({"updated": updated, "unread_count": count_unread_notifications()})
+
+# ✅ 管理者通知の画面（未読を long-poll で受け取って追加表示する）
+@bp.route("/admin/notifications")
+def view_admin_notifications():
+    return render_template(
+        "admin_notifications.html", max_wait=current_app.config["ADMIN_NOTIFICATION_MAX_WAIT"]
+    )
+
+# ✅ 送信待ちの管理者通知を送る（ADMIN_NOTIFICATION_DISPATCH=off の構成で cron などから実行する）
+@bp.cli.command("dispatch-notifications")
+@click.option("--loop", is_flag=True, help="終了せずに ADMIN_NOTIFICATION_INTERVAL 秒ごとに送り続ける")
+def dispatch_notifications(loop):
+    dispatcher = NotificationDispatcher(
+        current_app._get_current_object(), notification_sinks.build_sinks(current_app.config),
+        interval=current_app.config["ADMIN_NOTIFICATION_INTERVAL"],
+        max_attempts=current_app.config["ADMIN_NOTIFICATION_MAX_ATTEMPTS"],
+        lease=current_app.config["ADMIN_NOTIFICATION_LEASE"]
+    )
+    while True:
+        dispatcher.dispatch_pending()
+        stats = dispatcher.stats()
+        print(f"📨 管理者通知: 送信 {stats['sent']} 件, 失敗 {stats['failed']} 件")
+        if not loop:
+            return
+        time.sleep(dispatcher.interval)
+
+# ✅ 管理者通知の送信状況（ADMIN_NOTIFICATION_DISPATCH=thread のときのみ）
+@bp.route("/admin_notification_stats")
+def admin_notification_stats():
+    dispatcher = services().notification_dispatcher
+    if dispatcher is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **dispatcher.stats()})
+
+# ✅ バッチ解析の達成バッチサイズ（NLP_BATCH_ENABLED=1 のときのみ）
+@bp.route("/nlp_stats")
+def nlp_stats():
+    scheduler = services().nlp_scheduler
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **scheduler.stats()})
+
+# ✅ 解析サーバーの死活確認（NLP_BACKEND=server のときのみ。応答がなければ 503）
+@bp.route("/nlp_server_health")
+def nlp_server_health():
+    client = services().nlp_client
+    if client is None:
+        return jsonify({"enabled": False})
+    try:
+        return jsonify({"enabled": True, "status": "ok", **client.ping()})
+    except NlpServerError as e:
+        return jsonify({"enabled": True, "status": "down", "error": str(e)}), 503
+
+# ✅ 解析プロセスプールの状況（NLP_EXECUTOR=process のときのみ）
+@bp.route("/nlp_executor_stats")
+def nlp_executor_stats():
+    executor = services().analysis_executor
+    if executor is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **executor.stats()})
+
+# ✅ ログの遅延書き込みの状況（CHAT_LOG_WRITE_BEHIND=1 のときのみ）
+@bp.route("/chat_log_stats")
+def chat_log_stats():
+    writer = services().chat_log_writer
+    if writer is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **writer.stats()})
+
+# ✅ 解析キャッシュの状況
+@bp.route("/analysis_cache_stats")
+def analysis_cache_stats():
+    return jsonify(services().analysis_cache.stats())
+
+# ✅ リクエストごとの処理時間（/metrics の http_request_seconds）
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@bp.after_app_request
+def observe_request_time(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        http_request_seconds.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or "unknown", method=request.method, status=response.status_code
+        )
+    return response
+
+# ✅ 他のオブジェクトが持っている統計値（出力時に集める。/metrics を返しているアプリのもの）
+metrics_registry.collected(
+    "session_cache_requests_total", "セッションキャッシュの参照回数", "counter",
+    lambda: [({"result": "hit"}, services().session_cache.hits), ({"result": "miss"}, services().session_cache.misses),
+             ({"result": "stale"}, services().session_cache.stale)]
+)
+metrics_registry.collected(
+    "session_cache_evictions_total", "セッションキャッシュから追い出した件数", "counter",
+    lambda: [({}, services().session_cache.evictions)]
+)
+metrics_registry.collected(
+    "analysis_cache_requests_total", "解析キャッシュの参照回数", "counter",
+    lambda: [({"result": "hit"}, services().analysis_cache.hits), ({"result": "miss"}, services().analysis_cache.misses)]
+)
+metrics_registry.collected(
+    "analysis_cache_evictions_total", "解析キャッシュから追い出した件数", "counter",
+    lambda: [({}, services().analysis_cache.evictions)]
+)
+metrics_registry.collected(
+    "analysis_cache_bytes", "解析キャッシュのおおよそのメモリ量（バイト）", "gauge",
+    lambda: [({}, services().analysis_cache.bytes)]
+)
+metrics_registry.collected(
+    "analysis_executor_requests_total", "解析プロセスプールへの依頼数（結果別）", "counter",
+    lambda: [
+        ({"result": name}, services().analysis_executor.stats()[name])
+        for name in ("completed", "timeouts", "rejected", "restarts")
+    ] if services().analysis_executor is not None else []
+)
+metrics_registry.collected(
+    "chat_log_pending", "遅延書き込み待ちのターン数", "gauge",
+    lambda: [({}, services().chat_log_writer.pending())] if services().chat_log_writer is not None else []
+)
+metrics_registry.collected(
+    "log_feed_streams", "ログのライブ配信で待機中の接続数", "gauge",
+    lambda: [({}, services().log_feed.streams)] if services().log_feed is not None else []
+)
+metrics_registry.collected(
+    "log_feed_reads_total", "ライブ配信の DB 読み取り回数（共有の読み取り・接続ごとの読み直し）", "counter",
+    lambda: [({"source": "poll"}, services().log_feed.polls), ({"source": "fallback"}, services().log_feed.fallbacks)]
+    if services().log_feed is not None else []
+)
+metrics_registry.collected(
+    "nlp_batches_total", "マイクロバッチで解析したバッチ数", "counter",
+    lambda: [({}, services().nlp_scheduler.stats()["batches"])] if services().nlp_scheduler is not None else []
+)
+metrics_registry.collected(
+    "nlp_batch_timeouts_total", "マイクロバッチの結果を待ちきれず直接解析した件数", "counter",
+    lambda: [({}, services().nlp_scheduler.stats()["timeouts"])] if services().nlp_scheduler is not None else []
+)
+
+# ✅ Prometheus 形式のメトリクス（値はワーカープロセスごと）
+@bp.route("/metrics")
+def metrics():
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
 # ✅ ログアウト機能（関数外に置くこと）
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     session.clear()
     return redirect("/login")
 
 
 
+# ✅ ログ一覧のページ取得（id によるキーセット・ページング。before より古い行を新しい順に limit 件）
+LOGS_PAGE_SIZE = 100
+LOGS_MAX_PAGE_SIZE = 500
+
+def fetch_log_page(args):
+    conditions = parse_log_filters(args)
+    flush_pending_chat_logs()
+    try:
+        limit = min(int(args.get("limit", LOGS_PAGE_SIZE)), LOGS_MAX_PAGE_SIZE)
+        before = int(args["before"]) if args.get("before") else None
+    except ValueError:
+        raise ValueError("limit / before は整数で指定してください")
+    if limit < 1:
+        raise ValueError("limit は 1 以上で指定してください")
+
+    rows = log_page_query(conditions, before, limit).all()
+    logs = rows[:limit]
+    next_before = logs[-1].id if len(rows) > limit else None
+
+    # このページに出てくるユーザーだけを取得
+    session_ids = {log.session_id for log in logs}
+    users = {}
+    if session_ids:
+        users = {user.session_id: user for user in User.query.filter(User.session_id.in_(session_ids))}
+    return logs, users, next_before
+
+# 1ページ分（+1件で次ページの有無を判定）のクエリ。check-query-plans でも同じものを使う
+def log_page_query(conditions, before, limit):
+    if before is not None:
+        conditions = [*conditions, ChatHistory.id < before]
+    return ChatHistory.query.filter(*conditions).order_by(ChatHistory.id.desc()).limit(limit + 1)
+
+def log_to_dict(log):
+    return {
+        "id": log.id,
+        "session_id": log.session_id,
+        "department": log.department,
+        "age_group": log.age_group,
+        "user_message": log.user_message,
+        "bot_response": log.bot_response,
+        "psychological_state": log.psychological_state,
+        "harassment_flag": bool(log.harassment_flag),
+        "sensitive_flag": bool(log.sensitive_flag),
+        "timestamp": log.timestamp.isoformat() if log.timestamp else None,
+        "timestamp_jst": to_jst(log.timestamp)
+    }
+
+def user_to_dict(user):
+    return {
+        "department": user.department,
+        "age_group": user.age_group,
+        "preferred_response_type": user.preferred_response_type,
+        "last_psychological_state": user.last_psychological_state,
+        "stress_count": user.stress_count
+    }
+
 # ✅ ログ表示画面（logs.html へのレンダリング）
-@app.route("/logs")
+@bp.route("/logs")
 def view_logs():
-    logs = ChatHistory.query.order_by(ChatHistory.id.desc()).all()
-    users_raw = User.query.all()
-    users = {user.session_id: user for user in users_raw}
-    return render_template("logs.html", logs=logs, users=users)
+    live_since = latest_log_id()  # ライブ更新はここから（ページと重なった行は画面側で除く）
+    try:
+        logs, users, next_before = fetch_log_page(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    next_url = None
+    if next_before is not None:
+        args = request.args.to_dict()
+        args["before"] = next_before
+        next_url = url_for("main.view_logs", **args)
+    return render_template(
+        "logs.html", logs=logs, users=users, filters=request.args, next_url=next_url, live_since=live_since
+    )
 
-# ✅ ここに CSVエクスポート機能を追加
-@app.route("/export_csv")
-def export_csv():
-    logs = ChatHistory.query.order_by(ChatHistory.id.asc()).all()
+# ✅ ログ一覧 JSON API（ダッシュボード用。パラメータは /logs と同じ）
+@bp.route("/api/logs")
+def api_logs():
+    try:
+        logs, users, next_before = fetch_log_page(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "logs": [log_to_dict(log) for log in logs],
+        "users": {session_id: user_to_dict(user) for session_id, user in users.items()},
+        "next_before": next_before
+    })
+
+# ✅ ログ検索条件（/export_csv などのクエリパラメータ → SQLAlchemy の条件リスト）
+# start / end: 日付（YYYY-MM-DD、保存値と同じ UTC 基準、end は当日を含む）
+# session_id / department / age_group / psychological_state: 完全一致、harassment / sensitive: 1 or 0
+def parse_log_filters(args):
+    conditions = []
+    try:
+        if args.get("start"):
+            conditions.append(ChatHistory.timestamp >= datetime.strptime(args["start"], "%Y-%m-%d"))
+        if args.get("end"):
+            end = datetime.strptime(args["end"], "%Y-%m-%d") + timedelta(days=1)
+            conditions.append(ChatHistory.timestamp < end)
+    except ValueError:
+        raise ValueError("日付は YYYY-MM-DD 形式で指定してください")
+
+    for name in ("session_id", "department", "age_group", "psychological_state"):
+        if args.get(name):
+            conditions.append(getattr(ChatHistory, name) == args[name])
+
+    for name, column in (("harassment", ChatHistory.harassment_flag), ("sensitive", ChatHistory.sensitive_flag)):
+        value = args.get(name)
+        if value in (None, ""):
+            continue
+        if value not in ("0", "1"):
+            raise ValueError(f"{name} は 0 または 1 で指定してください")
+        # 0 は「1 以外（NULL を含む）」。ほぼ全件に当たるので、索引の OR で集めて並べ直すより id 順に読む方が速い
+        conditions.append(column.is_(True) if value == "1" else column.isnot(True))
+
+    return conditions
+
+# ✅ ログのライブ配信（/api/logs/stream の SSE と /api/logs/feed の long-poll。ログ一覧の画面が新しい行だけを追加する）
+# プロセスごとに1つのスレッドが新しい ChatHistory を id 順に読み（接続がある間だけ POLL_MS ごと。同じプロセスの
+# 書き込み直後はすぐに）、直近 buffer_size 件をメモリに持つ。各接続はそこから自分の条件に合う行だけを受け取るので、
+# 接続が増えても DB への問い合わせは増えない。接続の cursor がバッファより古いときだけ、その接続の条件で DB から読む
+# 接続がなくなってしばらくすると読むのをやめてバッファを捨てる（再開時は最新の id から読み始める）
+LOG_FEED_FILTERS = ("session_id", "department", "age_group", "psychological_state", "harassment", "sensitive")
+LOG_FEED_IDLE_SECONDS = 30  # 最後の読み取りからこの秒数でバッファを捨てる（/api/logs/feed を wait なしで呼ぶ画面向けの猶予）
+
+class LogFeed:
+    def __init__(self, app, poll_ms=1000, buffer_size=2000, batch_size=500, max_streams=2):
+        self.app = app
+        self.poll_interval = poll_ms / 1000.0
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.max_streams = max_streams
+        self._buffer = deque()
+        self._changed = threading.Condition()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.floor_id = None  # バッファには floor_id より後ろ、last_id までの行がすべて入っている
+        self.last_id = None
+        self.active_until = 0.0
+        self.streams = 0
+        self.polls = 0
+        self.fetched_rows = 0
+        self.fallbacks = 0
+
+    # fork 後のワーカーではスレッドが引き継がれないため、最初の読み取りで起動する
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._reset()
+            self.streams = 0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="log-feed", daemon=True)
+            self._thread.start()
+
+    def _reset(self):
+        with self._changed:
+            self._buffer.clear()
+            self.floor_id = self.last_id = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    # SSE・long-poll で待っている接続の数を max_streams までに抑える（gunicorn のスレッドを /chat に残す）
+    def open_stream(self):
+        self._ensure_started()
+        with self._lock:
+            if self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+        return True
+
+    def close_stream(self):
+        with self._lock:
+            self.streams -= 1
+
+    def _active(self):
+        return self.streams > 0 or time.monotonic() < self.active_until
+
+    # 新しい行をバッファに追加する（呼び出しはアプリコンテキスト内）
+    def poll(self):
+        if self.last_id is None:
+            latest = db.session.query(db.func.max(ChatHistory.id)).scalar() or 0
+            with self._changed:
+                self.floor_id = self.last_id = latest
+                self._changed.notify_all()
+        while True:
+            logs = [log_to_dict(row) for row in (
+                ChatHistory.query
+                .filter(ChatHistory.id > self.last_id)
+                .order_by(ChatHistory.id.asc())
+                .limit(self.batch_size)
+            )]
+            db.session.rollback()
+            with self._lock:
+                self.polls += 1
+                self.fetched_rows += len(logs)
+            if not logs:
+                return
+            with self._changed:
+                for log in logs:
+                    if len(self._buffer) >= self.buffer_size:
+                        self.floor_id = self._buffer.popleft()["id"]
+                    self._buffer.append(log)
+                self.last_id = logs[-1]["id"]
+                self._changed.notify_all()
+            if len(logs) < self.batch_size:
+                return
+
+    def _run(self):
+        active = False
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            if not self._active():
+                if active:
+                    self._reset()
+                active = False
+                continue
+            active = True
+            try:
+                with self.app.app_context():
+                    self.poll()
+            except Exception:
+                logger.exception("❌ ログのライブ配信スレッドでエラーが発生しました")
+
+    # since より新しく matches に合う行を新しい順に集める（バッファで答えられなければ None。_changed を持って呼ぶ）
+    def _collect(self, since, matches):
+        if self.last_id is None or since < self.floor_id:
+            return None
+        logs = []
+        for log in reversed(self._buffer):
+            if log["id"] <= since:
+                break
+            if matches(log):
+                logs.append(log)
+        return logs
+
+    # since より新しく matches に合う行を最大 limit 件返す（なければ timeout 秒まで待つ）→ (logs, cursor)
+    # cursor は条件に合わなかった行も含めて読み終えた位置。バッファで答えられないときは None
+    def read(self, since, matches, limit, timeout=0):
+        self._ensure_started()
+        self.active_until = time.monotonic() + LOG_FEED_IDLE_SECONDS
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            if self.last_id is None:
+                self._wakeup.set()  # 止まっていたら読み始める（最初の読み取りまで待つ）
+            logs = self._collect(since, matches)
+            while (logs == [] or self.last_id is None) and deadline > time.monotonic():
+                self._changed.wait(deadline - time.monotonic())
+                logs = self._collect(since, matches)
+            if logs is not None:
+                logs.reverse()
+                if len(logs) > limit:
+                    return logs[:limit], logs[limit - 1]["id"]
+                return logs, max(since, self.last_id)
+        self._wakeup.set()
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "streams": self.streams,
+                "max_streams": self.max_streams,
+                "polls": self.polls,
+                "fetched_rows": self.fetched_rows,
+                "fallbacks": self.fallbacks,
+                "buffered": len(self._buffer),
+                "last_id": self.last_id,
+                "poll_ms": self.poll_interval * 1000.0
+            }
+
+def init_log_feed(app):
+    services(app).log_feed = LogFeed(
+        app,
+        poll_ms=app.config["LOG_FEED_POLL_MS"],
+        buffer_size=app.config["LOG_FEED_BUFFER_SIZE"],
+        max_streams=app.config["LOG_FEED_MAX_STREAMS"]
+    )
+
+# ライブ配信の条件（LOG_FEED_FILTERS 以外のパラメータ、start / end などは使わない）→ (filters, matches)
+def parse_log_feed_filters(args):
+    filters = {name: args[name] for name in LOG_FEED_FILTERS if args.get(name)}
+    parse_log_filters(filters)  # 値の検証
+    expected = {name: filters[name] for name in LOG_FEED_FILTERS[:4] if name in filters}
+    for name in ("harassment", "sensitive"):
+        if name in filters:
+            expected[name + "_flag"] = filters[name] == "1"
+    return filters, lambda log: all(log[key] == value for key, value in expected.items())
+
+def latest_log_id():
+    latest = db.session.query(db.func.max(ChatHistory.id)).scalar() or 0
+    db.session.rollback()
+    return latest
+
+# バッファより古い cursor の接続は、その接続の条件で DB から読む（同じトランザクションで最大 id も読み、cursor を進める）
+def log_feed_query(filters, since, limit):
+    return ChatHistory.query.filter(*parse_log_filters(filters), ChatHistory.id > since).order_by(ChatHistory.id.asc()).limit(limit)
+
+def fetch_logs_since(filters, since, limit):
+    rows = log_feed_query(filters, since, limit).all()
+    if len(rows) == limit:
+        cursor = rows[-1].id
+    else:
+        cursor = max(since, db.session.query(db.func.max(ChatHistory.id)).scalar() or 0)
+    logs = [log_to_dict(row) for row in rows]
+    db.session.rollback()
+    return logs, cursor
+
+def read_log_feed(filters, matches, since, limit, timeout=0):
+    return services().log_feed.read(since, matches, limit, timeout) or fetch_logs_since(filters, since, limit)
+
+def parse_log_feed_args(args, last_event_id=None):
+    filters, matches = parse_log_feed_filters(args)
+    try:
+        since = last_event_id or args.get("since")
+        since = int(since) if since else None
+        limit = min(int(args.get("limit", LOGS_PAGE_SIZE)), LOGS_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ValueError("since / limit は整数で指定してください")
+    if limit < 1:
+        raise ValueError("limit は 1 以上で指定してください")
+    if since is None:
+        since = latest_log_id()  # 省略時はこれから書かれる行だけ
+    return filters, matches, since, limit
+
+# ✅ 新しいログの SSE（event: logs、data は {"logs": [...], "cursor": id}）。id に cursor を入れるので、
+# 切断後は EventSource が Last-Event-ID で続きから再接続する。LOG_FEED_STREAM_SECONDS ごとに切って再接続させる
+@bp.route("/api/logs/stream")
+def api_logs_stream():
+    try:
+        filters, matches, since, limit = parse_log_feed_args(request.args, request.headers.get("Last-Event-ID"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    feed = services().log_feed
+    if not feed.open_stream():
+        return jsonify({"error": "ライブ更新の接続数が上限に達しています。しばらくしてから再度お試しください。"}), 503
+
+    heartbeat = current_app.config["LOG_FEED_HEARTBEAT"]
+    ends = time.monotonic() + current_app.config["LOG_FEED_STREAM_SECONDS"]
+
+    def generate():
+        cursor = since
+        try:
+            yield "retry: 1000\n\n"
+            while time.monotonic() < ends:
+                logs, next_cursor = read_log_feed(filters, matches, cursor, limit, heartbeat)
+                if logs:
+                    data = json.dumps({"logs": logs, "cursor": next_cursor}, ensure_ascii=False)
+                    yield f"id: {next_cursor}\nevent: logs\ndata: {data}\n\n"
+                elif next_cursor != cursor:
+                    yield f"id: {next_cursor}\n\n"  # 条件に合わない行の分だけ再接続の位置を進める
+                else:
+                    yield ": keepalive\n\n"
+                cursor = next_cursor
+        finally:
+            feed.close_stream()
+
+    return Response(
+        stream_with_context(generate()), mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ✅ 新しいログの JSON（SSE が使えない場合用）。since より新しい行を返し、なければ最大 wait 秒待つ
+# 待てる接続数は SSE と合わせて LOG_FEED_MAX_STREAMS まで（超えた分は待たずに返す）
+@bp.route("/api/logs/feed")
+def api_logs_feed():
+    try:
+        filters, matches, since, limit = parse_log_feed_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        wait = max(0.0, min(float(request.args.get("wait", 0)), current_app.config["LOG_FEED_MAX_WAIT"]))
+    except ValueError:
+        return jsonify({"error": "wait は秒数で指定してください"}), 400
+
+    feed = services().log_feed
+    waiting = wait > 0 and feed.open_stream()
+    try:
+        logs, cursor = read_log_feed(filters, matches, since, limit, wait if waiting else 0)
+    finally:
+        if waiting:
+            feed.close_stream()
+    return jsonify({"logs": logs, "cursor": cursor})
+
+# ✅ CSVエクスポート（yield_per で少しずつ読み、生成しながら送信。?gzip=1 で gzip 圧縮）
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def iter_csv_chunks(rows):
     output = StringIO()
     writer = csv.writer(output)
 
     # ヘッダー行
     writer.writerow(["ID", "セッションID", "部署", "年代", "ユーザー発言", "AI応答", "心理状態", "日時"])
 
-    for log in logs:
+    for log in rows:
         writer.writerow([
             log.id,
             log.session_id,
@@ -630,21 +2553,723 @@ def export_csv():
             log.psychological_state,
             log.timestamp.strftime('%Y-%m-%d %H:%M') if log.timestamp else ""
         ])
+        if output.tell() >= EXPORT_CHUNK_BYTES:
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate()
+
+    if output.tell():
+        yield output.getvalue()
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # wbits=31 → gzip 形式
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_query(conditions):
+    return (
+        db.session.query(
+            ChatHistory.id, ChatHistory.session_id, ChatHistory.department, ChatHistory.age_group,
+            ChatHistory.user_message, ChatHistory.bot_response, ChatHistory.psychological_state,
+            ChatHistory.timestamp
+        )
+        .filter(*conditions)
+        .order_by(ChatHistory.id.asc())
+    )
 
-    response = Response(output.getvalue(), mimetype="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=chat_logs.csv"
+@bp.route("/export_csv")
+def export_csv():
+    try:
+        conditions = parse_log_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    flush_pending_chat_logs()
+    query = export_query(conditions).yield_per(EXPORT_BATCH_SIZE)
+
+    # ?include_archive=1 でアーカイブ済みのログ（月別ファイル）も同じ条件で先頭に含める
+    if request.args.get("include_archive") == "1":
+        start, end, matches = parse_archive_filters(request.args)
+        query = chain((log for log in iter_archived_logs(start, end) if matches(log)), query)
+
+    chunks = iter_csv_chunks(query)
+    if request.args.get("gzip") == "1":
+        response = Response(stream_with_context(gzip_chunks(chunks)), mimetype="application/gzip")
+        response.headers["Content-Disposition"] = "attachment; filename=chat_logs.csv.gz"
+    else:
+        response = Response(stream_with_context(chunks), mimetype="text/csv")
+        response.headers["Content-Disposition"] = "attachment; filename=chat_logs.csv"
     return response
 
-# ✅ JST変換フィルター
-from datetime import timezone, timedelta
+# ✅ ログのアーカイブ（flask archive-logs）
+# 保持期間より古い ChatHistory を月別の圧縮ファイル（ARCHIVE_DIR/chat_history-YYYY-MM.jsonl.gz）へ移し、元の行を削除する
+# 1バッチ = ファイルへの追記 + 行の削除 + ChatArchive の書き込み位置の更新（1トランザクション）。途中で止めても再実行で続きから進む
+ARCHIVE_CURSOR = "archive"
+
+def archive_row_values(row):
+    values = {column.name: getattr(row, column.name) for column in ChatHistory.__table__.columns}
+    values["timestamp"] = row.timestamp.isoformat() if row.timestamp else None
+    return values
+
+def load_archived_log(values):
+    values["timestamp"] = datetime.fromisoformat(values["timestamp"]) if values["timestamp"] else None
+    return SimpleNamespace(**values)
+
+# アーカイブ済みのログを月の古い順に読む（start / end: UTC の datetime、end は含まない。範囲外の月のファイルは開かない）
+def iter_archived_logs(start=None, end=None):
+    directory = current_app.config["ARCHIVE_DIR"]
+    for archive in ChatArchive.query.order_by(ChatArchive.month.asc()).all():
+        if start is not None and archive.month < start.strftime("%Y-%m"):
+            continue
+        if end is not None and archive.month > (end - timedelta(microseconds=1)).strftime("%Y-%m"):
+            continue
+        for values in chat_archive.iter_lines(os.path.join(directory, archive.path), archive.bytes):
+            yield load_archived_log(values)
+
+# parse_log_filters と同じ条件をアーカイブの行（Python のオブジェクト）に当てはめる
+def parse_archive_filters(args):
+    start = datetime.strptime(args["start"], "%Y-%m-%d") if args.get("start") else None
+    end = datetime.strptime(args["end"], "%Y-%m-%d") + timedelta(days=1) if args.get("end") else None
+    equals = {name: args[name] for name in ("session_id", "department", "age_group", "psychological_state") if args.get(name)}
+    flags = {
+        column: args[name] == "1"
+        for name, column in (("harassment", "harassment_flag"), ("sensitive", "sensitive_flag"))
+        if args.get(name) not in (None, "")
+    }
+
+    def matches(log):
+        if start is not None and (log.timestamp is None or log.timestamp < start):
+            return False
+        if end is not None and (log.timestamp is None or log.timestamp >= end):
+            return False
+        if any(getattr(log, name) != value for name, value in equals.items()):
+            return False
+        return all(bool(getattr(log, column)) == value for column, value in flags.items())
+
+    return start, end, matches
+
+def archive_chat_rows(rows):
+    directory = current_app.config["ARCHIVE_DIR"]
+    by_month = {}
+    for row in rows:
+        by_month.setdefault(row.timestamp.strftime("%Y-%m"), []).append(row)
+
+    for month, month_rows in by_month.items():
+        archive = db.session.get(ChatArchive, month)
+        if archive is None:
+            archive = ChatArchive(month=month, path=f"chat_history-{month}.jsonl.gz", bytes=0, row_count=0)
+            db.session.add(archive)
+        archive.bytes = chat_archive.append_lines(
+            os.path.join(directory, archive.path), archive.bytes,
+            [json.dumps(archive_row_values(row), ensure_ascii=False) for row in month_rows]
+        )
+        archive.row_count += len(month_rows)
+        archive.min_id = min(archive.min_id or month_rows[0].id, month_rows[0].id)
+        archive.max_id = max(archive.max_id or 0, month_rows[-1].id)
+        archive.updated_at = datetime.utcnow()
+
+    db.session.execute(db.delete(ChatHistory).where(ChatHistory.id.in_([row.id for row in rows])))
+
+@bp.cli.command("archive-logs")
+@click.option("--older-than-days", type=int, help="この日数より古いログを移す（省略時は ARCHIVE_RETENTION_DAYS）")
+@click.option("--batch-size", default=1000, show_default=True, help="1トランザクションで移す（削除する）行数")
+@click.option("--max-batches", type=int, help="このバッチ数で止める（残りは次回の実行で続きから）")
+@click.option("--pause-ms", default=0, show_default=True, help="バッチ間の待ち時間（アプリの書き込みを先に通す）")
+@click.option("--vacuum/--no-vacuum", default=True, show_default=True, help="終了後に VACUUM でファイルを縮める")
+def archive_logs(older_than_days, batch_size, max_batches, pause_ms, vacuum):
+    days = older_than_days if older_than_days is not None else current_app.config["ARCHIVE_RETENTION_DAYS"]
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    os.makedirs(current_app.config["ARCHIVE_DIR"], exist_ok=True)
+
+    # 日次集計に未反映の行を先に集計する（アーカイブした行は集計の追いつき処理から読めなくなるため）
+    run_mood_rollups(batch_size)
+    rollup_cursor = db.session.get(RollupCursor, MOOD_ROLLUP_CURSOR)
+    rolled_up_id = rollup_cursor.last_id if rollup_cursor else 0
+
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        # 最初にカーソル行を書いて書き込みロックを取る（同時に2つ実行しても同じ行・同じファイル位置を使わない）
+        locked = db.session.execute(
+            db.update(RollupCursor).where(RollupCursor.name == ARCHIVE_CURSOR)
+            .values(last_id=RollupCursor.last_id).execution_options(synchronize_session=False)
+        ).rowcount
+        if not locked:
+            db.session.add(RollupCursor(name=ARCHIVE_CURSOR, last_id=0))
+            db.session.flush()
+        cursor = db.session.get(RollupCursor, ARCHIVE_CURSOR)
+
+        rows = (
+            ChatHistory.query
+            .filter(ChatHistory.id <= rolled_up_id, ChatHistory.timestamp < cutoff)
+            .order_by(ChatHistory.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            db.session.commit()
+            break
+        archive_chat_rows(rows)
+        cursor.last_id = max(cursor.last_id, rows[-1].id)
+        db.session.commit()
+        db.session.expunge_all()
+
+        total += len(rows)
+        batches += 1
+        print(f"🗄 {total} 件をアーカイブしました（id <= {rows[-1].id}）")
+        if pause_ms:
+            time.sleep(pause_ms / 1000.0)
+
+    db.session.execute(db.text("ANALYZE"))
+    db.session.commit()
+    if vacuum and total:
+        print("🧹 VACUUM でデータベースファイルを縮めています")
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+            if conn.dialect.name == "sqlite":
+                conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    print(f"✅ アーカイブ完了: {total} 件（{cutoff:%Y-%m-%d %H:%M} UTC より前）")
+
+# ✅ 既存ログの名詞バックフィル（flask backfill-nouns）
+@bp.cli.command("backfill-nouns")
+@click.option("--batch-size", default=500, show_default=True, help="1回のコミットで処理する行数")
+def backfill_nouns(batch_size):
+    total = 0
+    last_id = 0
+    while True:
+        rows = (
+            ChatHistory.query
+            .filter(ChatHistory.id > last_id, ChatHistory.nouns.is_(None))
+            .order_by(ChatHistory.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+
+        parsed = parse_many([row.user_message for row in rows])
+        for row, (tokens, pos_tags) in zip(rows, parsed):
+            row.nouns = dump_nouns(tok for tok, pos in zip(tokens, pos_tags) if pos == "NOUN")
+        db.session.commit()
 
-@app.template_filter("to_jst")
+        total += len(rows)
+        last_id = rows[-1].id
+        print(f"🧩 名詞バックフィル: {total} 件完了（id <= {last_id}）")
+
+    print(f"✅ 名詞バックフィル終了: 合計 {total} 件")
+
+# ✅ 既存ログの再分類（flask reclassify-logs）
+# キーワードリストを変更したときに、保存済みの psychological_state / harassment_flag / sensitive_flag を
+# /chat と同じ判定で計算し直す。解析はプロセスプールで行い（各プロセスは fork 時に読み込み済みのモデルを共有し、
+# チャンク単位で nlp.pipe にかける）、結果は id 順にチャンクごとの一括 UPDATE で書き戻す
+RECLASSIFY_CURSOR = "reclassify"
+
+def classify_message(analysis):
+    sensitive_flag = detect_sensitive_content(analysis.text, analysis)
+    mood = analyze_mood(analysis.text, analysis)
+    harassment_flag = not sensitive_flag and detect_harassment(analysis.text, analysis)
+    return mood, harassment_flag, sensitive_flag
+
+def reclassify_texts(texts):
+    parsed = parse_many(texts)
+    return [classify_message(MessageAnalysis(text, parsed=fields)) for text, fields in zip(texts, parsed)]
+
+def iter_reclassify_chunks(last_id, batch_size):
+    while True:
+        rows = (
+            db.session.query(
+                ChatHistory.id, ChatHistory.user_message, ChatHistory.psychological_state,
+                ChatHistory.harassment_flag, ChatHistory.sensitive_flag
+            )
+            .filter(ChatHistory.id > last_id)
+            .order_by(ChatHistory.id.asc())
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+@bp.cli.command("reclassify-logs")
+@click.option("--processes", default=os.cpu_count() or 1, show_default=True, help="解析に使うプロセス数")
+@click.option("--batch-size", default=500, show_default=True, help="1チャンク（nlp.pipe 1回・UPDATE 1回）の行数")
+@click.option("--dry-run", is_flag=True, help="書き込まずに変更点だけを報告する")
+@click.option("--restart", is_flag=True, help="前回の途中位置を無視して最初から処理する")
+@click.option("--report", type=click.Path(dir_okay=False), help="変更される行を CSV で書き出すパス")
+@click.option("--samples", default=10, show_default=True, help="画面に表示する変更例の件数")
+def reclassify_logs(processes, batch_size, dry_run, restart, report, samples):
+    checkpoint = db.session.get(RollupCursor, RECLASSIFY_CURSOR)
+    if restart and checkpoint is not None and not dry_run:
+        db.session.delete(checkpoint)
+        db.session.commit()
+        checkpoint = None
+    start_id = checkpoint.last_id if checkpoint is not None and not restart else 0
+    if start_id:
+        print(f"⏩ 前回の続き（id > {start_id}）から再開します")
+
+    # fork 前に読み込んでおき、各プロセスで copy-on-write 共有する
+    preload_nlp_resources(current_app)
+    db.engine.dispose()
+
+    transitions = Counter()
+    shown = 0
+    checked = 0
+    changed = 0
+    report_file = open(report, "w", newline="", encoding="utf-8-sig") if report else None
+    report_writer = csv.writer(report_file) if report_file else None
+    if report_writer:
+        report_writer.writerow(["ID", "ユーザー発言", "心理状態（旧）", "心理状態（新）",
+                                "ハラスメント（旧）", "ハラスメント（新）", "センシティブ（旧）", "センシティブ（新）"])
+
+    def handle(rows, results):
+        nonlocal checked, changed, shown
+        updates = []
+        for row, (mood, harassment_flag, sensitive_flag) in zip(rows, results):
+            old = (row.psychological_state, bool(row.harassment_flag), bool(row.sensitive_flag))
+            new = (mood, bool(harassment_flag), bool(sensitive_flag))
+            if old == new:
+                continue
+            updates.append({"id": row.id, "psychological_state": new[0],
+                            "harassment_flag": new[1], "sensitive_flag": new[2]})
+            if old[0] != new[0]:
+                transitions[f"心理状態 {old[0]} → {new[0]}"] += 1
+            if old[1] != new[1]:
+                transitions[f"ハラスメント {old[1]} → {new[1]}"] += 1
+            if old[2] != new[2]:
+                transitions[f"センシティブ {old[2]} → {new[2]}"] += 1
+            if report_writer:
+                report_writer.writerow([row.id, row.user_message, *[value for pair in zip(old, new) for value in pair]])
+            if shown < samples:
+                print(f"  id={row.id}: {old} → {new}  {row.user_message[:40]}")
+                shown += 1
+
+        checked += len(rows)
+        changed += len(updates)
+        if not dry_run:
+            if updates:
+                db.session.execute(db.update(ChatHistory), updates)
+            position = db.session.get(RollupCursor, RECLASSIFY_CURSOR)
+            if position is None:
+                position = RollupCursor(name=RECLASSIFY_CURSOR, last_id=0)
+                db.session.add(position)
+            position.last_id = rows[-1].id
+            db.session.commit()
+        print(f"🔁 再分類: {checked} 件確認、変更 {changed} 件（id <= {rows[-1].id}）")
+
+    try:
+        if processes <= 1:
+            for rows in iter_reclassify_chunks(start_id, batch_size):
+                handle(rows, reclassify_texts([row.user_message for row in rows]))
+        else:
+            # 解析中のチャンクは最大 processes * 2 個まで（読み込みと書き戻しは id 順を保つ）
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                in_flight = deque()
+                for rows in iter_reclassify_chunks(start_id, batch_size):
+                    in_flight.append((rows, pool.apply_async(reclassify_texts, ([row.user_message for row in rows],))))
+                    if len(in_flight) >= processes * 2:
+                        rows, result = in_flight.popleft()
+                        handle(rows, result.get())
+                while in_flight:
+                    rows, result = in_flight.popleft()
+                    handle(rows, result.get())
+    finally:
+        if report_file:
+            report_file.close()
+
+    for transition, count in transitions.most_common():
+        print(f"  {transition}: {count} 件")
+
+    if dry_run:
+        print(f"📝 ドライラン: {checked} 件中 {changed} 件が変更対象です（書き込みは行っていません）")
+        return
+
+    # 最後まで終わったら途中位置を消す（次回のキーワード変更時は最初から処理する）
+    RollupCursor.query.filter_by(name=RECLASSIFY_CURSOR).delete()
+    db.session.commit()
+    print(f"✅ 再分類完了: {checked} 件中 {changed} 件を更新しました")
+    if changed:
+        print("📊 日次集計を作り直します")
+        run_mood_rollups(1000, rebuild=True, include_archive=True)
+
+# ✅ 主要クエリの実行計画チェック（flask check-query-plans）
+# EXPLAIN QUERY PLAN でテーブル全体の SCAN に落ちていないかを確認し、落ちていれば終了コード 1
+# ログ一覧・ライブ配信・CSV 出力は、画面と同じ parse_log_filters とクエリ関数で条件ごとに組み立てる
+QUERY_PLAN_LOG_FILTERS = [
+    {},
+    {"session_id": "query-plan-check"},
+    {"department": "営業部"},
+    {"age_group": "30代"},
+    {"psychological_state": "ストレスが高い"},
+    {"harassment": "1"},
+    {"harassment": "0"},
+    {"sensitive": "1"},
+    {"sensitive": "0"},
+    {"department": "営業部", "harassment": "0", "sensitive": "0"},
+    {"start": "2025-01-01", "end": "2025-01-31"},
+    {"start": "2025-01-01", "end": "2025-01-31", "department": "営業部", "sensitive": "0"},
+]
+
+def hot_query_statements():
+    sample_session = "query-plan-check"
+    sample_day = datetime(2025, 1, 1)
+    statements = {}
+    for filters in QUERY_PLAN_LOG_FILTERS:
+        label = "[" + "&".join(f"{name}={value}" for name, value in filters.items()) + "]" if filters else ""
+        conditions = parse_log_filters(filters)
+        statements["logs_page" + label] = log_page_query(conditions, 1000, LOGS_PAGE_SIZE).statement
+        # harassment=0 / sensitive=0 だけの CSV 出力はほぼ全件を読むので、テーブルを順に読むのが正しい
+        if conditions and set(filters.items()) - {("harassment", "0"), ("sensitive", "0")}:
+            statements["export_csv" + label] = export_query(conditions).statement
+        if all(name in LOG_FEED_FILTERS for name in filters):
+            statements["log_feed_fallback" + label] = log_feed_query(filters, 1000, LOGS_PAGE_SIZE).statement
+    return statements | {
+        "user_by_session": User.query.filter_by(session_id=sample_session).statement,
+        "history_count": db.select(db.func.count()).select_from(
+            ChatHistory.query.filter_by(session_id=sample_session).subquery()
+        ),
+        "recent_history": db.session.query(ChatHistory.bot_response, ChatHistory.nouns)
+            .filter(ChatHistory.session_id == sample_session)
+            .order_by(ChatHistory.id.desc()).limit(5).statement,
+        "mood_rollup_catch_up": db.session.query(ChatHistory.id)
+            .filter(ChatHistory.id > 1000).order_by(ChatHistory.id.asc()).limit(MOOD_ROLLUP_WRITE_LIMIT).statement,
+        "mood_rollup_backlog": db.session.query(ChatHistory.id)
+            .filter(ChatHistory.id > 1000).order_by(ChatHistory.id.asc())
+            .offset(MOOD_ROLLUP_WRITE_LIMIT).limit(1).statement,
+        "archive_candidates": db.session.query(ChatHistory.id)
+            .filter(ChatHistory.id <= 1000, ChatHistory.timestamp < datetime(2024, 1, 1))
+            .order_by(ChatHistory.id.asc()).limit(1000).statement,
+        "log_feed_poll": db.session.query(ChatHistory)
+            .filter(ChatHistory.id > 1000).order_by(ChatHistory.id.asc()).limit(500).statement,
+        "notifications_unread": unread_notifications_query(1000, ADMIN_NOTIFICATION_PAGE_SIZE).statement,
+        "notifications_unread_count": db.select(db.func.count(AdminNotification.id))
+            .where(AdminNotification.read_at.is_(None)),
+        "notifications_pending": db.session.query(AdminNotification.id)
+            .filter(AdminNotification.dispatched_at.is_(None), AdminNotification.dispatch_attempts < 3,
+                    db.or_(AdminNotification.claimed_at.is_(None), AdminNotification.claimed_at < sample_day))
+            .order_by(AdminNotification.id.asc()).limit(50).statement
+    }
+
+# ✅ 心理状態の日次集計（MoodRollup）の更新
+# ChatHistory を集計済み位置（RollupCursor）より後ろから id 順に読み、バケットごとの件数を加算する
+# 書き込み時（MOOD_ROLLUP_ON_WRITE=1）と flask rollup-moods の両方から呼ぶ。commit は呼び出し側で行う
+MOOD_ROLLUP_CURSOR = "mood_rollup"
+MOOD_ROLLUP_WRITE_LIMIT = 500  # 書き込み時に追いつく最大件数（残りは flask rollup-moods で処理）
+JST = timezone(timedelta(hours=9))
+
+def rollup_day(utc_dt):
+    return utc_dt.replace(tzinfo=timezone.utc).astimezone(JST).date()
+
+_mood_rollup_backlog_warned = False
+
+# 集計済み位置より後ろのログが limit 件を超えているか（主キーの範囲を limit 件読み飛ばすだけで判定する）
+def mood_rollup_behind(limit):
+    global _mood_rollup_backlog_warned
+    cursor = db.session.get(RollupCursor, MOOD_ROLLUP_CURSOR)
+    behind = (
+        db.session.query(ChatHistory.id)
+        .filter(ChatHistory.id > (cursor.last_id if cursor else 0))
+        .order_by(ChatHistory.id.asc())
+        .offset(limit).limit(1).first()
+    ) is not None
+    if behind and not _mood_rollup_backlog_warned:
+        _mood_rollup_backlog_warned = True
+        logger.warning("⚠️ 未集計のログが %d 件を超えているため、書き込み時の日次集計を止めています（flask rollup-moods で追いついてください）", limit)
+    return behind
+
+def apply_mood_rollups(limit=None):
+    cursor = db.session.get(RollupCursor, MOOD_ROLLUP_CURSOR, with_for_update=True)
+    if cursor is None:
+        cursor = RollupCursor(name=MOOD_ROLLUP_CURSOR, last_id=0)
+        db.session.add(cursor)
+
+    query = (
+        db.session.query(
+            ChatHistory.id, ChatHistory.session_id, ChatHistory.timestamp, ChatHistory.department,
+            ChatHistory.age_group, ChatHistory.psychological_state,
+            ChatHistory.harassment_flag, ChatHistory.sensitive_flag
+        )
+        .filter(ChatHistory.id > cursor.last_id)
+        .order_by(ChatHistory.id.asc())
+    )
+    if limit:
+        query = query.limit(limit)
+    rows = query.all()
+    if not rows:
+        return 0
+
+    merge_mood_rollups(count_mood_rollups(rows))
+    cursor.last_id = rows[-1].id
+    return len(rows)
+
+# ログ行（ChatHistory またはアーカイブの行）をバケットごとに数える
+def count_mood_rollups(rows, buckets=None):
+    buckets = {} if buckets is None else buckets
+    for row in rows:
+        # 管理者通知の行は利用者の発言ではないので数えない（AdminNotification に移す前にアーカイブした分が残っている）
+        if row.session_id == "admin-notice":
+            continue
+        key = (
+            rollup_day(row.timestamp or datetime.utcnow()),
+            row.department or "", row.age_group or "", row.psychological_state or ""
+        )
+        counts = buckets.setdefault(key, [0, 0, 0])
+        counts[0] += 1
+        counts[1] += 1 if row.harassment_flag else 0
+        counts[2] += 1 if row.sensitive_flag else 0
+    return buckets
+
+def merge_mood_rollups(buckets):
+    for (day, department, age_group, state), (messages, harassment, sensitive) in buckets.items():
+        rollup = MoodRollup.query.filter_by(
+            day=day, department=department, age_group=age_group, psychological_state=state
+        ).first()
+        if rollup is None:
+            rollup = MoodRollup(
+                day=day, department=department, age_group=age_group, psychological_state=state,
+                message_count=0, harassment_count=0, sensitive_count=0
+            )
+            db.session.add(rollup)
+        rollup.message_count += messages
+        rollup.harassment_count += harassment
+        rollup.sensitive_count += sensitive
+
+# ✅ メッセージの一括取り込み（/chat_batch の CLI 版。週次アンケートの回答などを JSON Lines から読み込む）
+# 1行1件: {"session_id": "...", "message": "..."}。batch-size 件ごとに解析・書き込みを行う
+# 読めない行（JSON でない・項目が足りない）は行番号つきでエラーに数え、残りの取り込みは続ける
+def read_import_lines(f):
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            yield number, (str(record["session_id"]), str(record["message"]).strip()), None
+        except json.JSONDecodeError as e:
+            yield number, None, f"JSON として読めません（{e.msg}）"
+        except (KeyError, TypeError):
+            yield number, None, "session_id と message を指定してください"
+
+@bp.cli.command("import-chat")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=500, show_default=True, help="1回の解析・書き込みで処理する件数（CHAT_BATCH_MAX_SIZE まで）")
+@click.option("--output", type=click.Path(dir_okay=False), help="メッセージごとの結果を JSON Lines で保存するパス")
+def import_chat(path, batch_size, output):
+    max_size = current_app.config["CHAT_BATCH_MAX_SIZE"]
+    if not 1 <= batch_size <= max_size:
+        raise click.BadParameter(f"1 から {max_size} までで指定してください", param_hint="--batch-size")
+
+    started = time.perf_counter()
+    processed = errors = 0
+    out = open(output, "w", encoding="utf-8") if output else None
+    try:
+        with open(path, encoding="utf-8") as f:
+            lines = read_import_lines(f)
+            while True:
+                chunk = list(islice(lines, batch_size))
+                if not chunk:
+                    break
+                items = [(number, item) for number, item, _ in chunk if item is not None]
+                results = process_chat_batch([item for _, item in items]) if items else []
+                results = chain(
+                    ({"line": number, "error": error} for number, _, error in chunk if error),
+                    ({"line": number, **result} for (number, _), result in zip(items, results))
+                )
+                for result in sorted(results, key=lambda result: result["line"]):
+                    if "error" in result:
+                        errors += 1
+                        print(f"⚠️ {result['line']} 行目: {result['error']}")
+                    else:
+                        processed += 1
+                    if out:
+                        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                print(f"📥 {processed + errors} 件を処理しました")
+    finally:
+        if out:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"✅ 取り込み完了: {processed} 件（エラー {errors} 件）, {elapsed:.1f}s, {rate:.1f} 件/秒")
+
+# ✅ 期限切れのサーバー側セッションを削除（SESSION_BACKEND=database / filesystem。cron などで定期実行する）
+@bp.cli.command("cleanup-sessions")
+def cleanup_sessions():
+    interface = current_app.session_interface
+    if not hasattr(interface, "store"):
+        print("ℹ️ SESSION_BACKEND=cookie のため削除するセッションはありません")
+        return
+    removed = interface.store.cleanup()
+    print(f"🧹 期限切れのセッションを {removed} 件削除しました")
+
+# ✅ 集計の追いつき処理（書き込み時の集計を無効にしている場合や、既存データの初回集計に使う）
+@bp.cli.command("rollup-moods")
+@click.option("--batch-size", default=1000, show_default=True, help="1トランザクションで集計する件数")
+@click.option("--rebuild", is_flag=True, help="集計をすべて削除して最初から作り直す")
+@click.option("--include-archive", is_flag=True, help="作り直すときにアーカイブ済みのログも集計する")
+def rollup_moods(batch_size, rebuild, include_archive):
+    if rebuild and not include_archive and ChatArchive.query.count():
+        print("⚠️ アーカイブ済みのログは集計に含まれません（含めるには --include-archive を指定）")
+    run_mood_rollups(batch_size, rebuild, include_archive)
+
+def run_mood_rollups(batch_size, rebuild=False, include_archive=False):
+    if rebuild:
+        MoodRollup.query.delete()
+        RollupCursor.query.filter_by(name=MOOD_ROLLUP_CURSOR).delete()
+        if include_archive:
+            buckets = count_mood_rollups(iter_archived_logs())
+            merge_mood_rollups(buckets)
+            print(f"🗄 アーカイブ済みの {sum(counts[0] for counts in buckets.values())} 件を集計しました")
+        db.session.commit()
+
+    total = 0
+    while True:
+        processed = apply_mood_rollups(limit=batch_size)
+        db.session.commit()
+        if not processed:
+            break
+        total += processed
+        print(f"📊 {total} 件を集計しました")
+
+    cursor = db.session.get(RollupCursor, MOOD_ROLLUP_CURSOR)
+    print(f"✅ 集計完了（処理済み id: {cursor.last_id if cursor else 0}）")
+
+# ✅ 心理状態の日次集計 API（集計テーブルだけを読むので、件数はバケット数に比例）
+# start / end: 日付（YYYY-MM-DD、JST、end は当日を含む）、department / age_group / psychological_state: 完全一致
+# group_by: day, department, age_group, psychological_state のカンマ区切り（省略時はすべて）
+MOOD_STATS_DIMENSIONS = ("day", "department", "age_group", "psychological_state")
+
+@bp.route("/api/mood_stats")
+def api_mood_stats():
+    conditions = []
+    try:
+        if request.args.get("start"):
+            conditions.append(MoodRollup.day >= datetime.strptime(request.args["start"], "%Y-%m-%d").date())
+        if request.args.get("end"):
+            conditions.append(MoodRollup.day <= datetime.strptime(request.args["end"], "%Y-%m-%d").date())
+    except ValueError:
+        return jsonify({"error": "日付は YYYY-MM-DD 形式で指定してください"}), 400
+
+    for name in ("department", "age_group", "psychological_state"):
+        if request.args.get(name):
+            conditions.append(getattr(MoodRollup, name) == request.args[name])
+
+    group_by = [name for name in request.args.get("group_by", ",".join(MOOD_STATS_DIMENSIONS)).split(",") if name]
+    unknown = [name for name in group_by if name not in MOOD_STATS_DIMENSIONS]
+    if unknown:
+        return jsonify({"error": f"group_by に指定できるのは {', '.join(MOOD_STATS_DIMENSIONS)} です"}), 400
+
+    columns = [getattr(MoodRollup, name) for name in group_by]
+    rows = (
+        db.session.query(
+            *columns,
+            db.func.sum(MoodRollup.message_count).label("message_count"),
+            db.func.sum(MoodRollup.harassment_count).label("harassment_count"),
+            db.func.sum(MoodRollup.sensitive_count).label("sensitive_count")
+        )
+        .filter(*conditions)
+        .group_by(*columns)
+        .order_by(*columns)
+        .all()
+    )
+
+    buckets = []
+    for row in rows:
+        bucket = {name: getattr(row, name) for name in group_by}
+        if "day" in bucket:
+            bucket["day"] = bucket["day"].isoformat()
+        bucket.update({
+            "message_count": int(row.message_count or 0),
+            "harassment_count": int(row.harassment_count or 0),
+            "sensitive_count": int(row.sensitive_count or 0)
+        })
+        buckets.append(bucket)
+
+    cursor = db.session.get(RollupCursor, MOOD_ROLLUP_CURSOR)
+    return jsonify({"buckets": buckets, "last_id": cursor.last_id if cursor else 0})
+
+FULL_SCAN_PATTERN = re.compile(r"^SCAN (chat_history|user|admin_notification)\b")
+
+@bp.cli.command("check-query-plans")
+def check_query_plans():
+    failures = []
+    with db.engine.connect() as conn:
+        for name, statement in hot_query_statements().items():
+            sql = str(statement.compile(conn, compile_kwargs={"literal_binds": True}))
+            plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+            scans = [detail for detail in plan if FULL_SCAN_PATTERN.match(detail)]
+            print(f"{'❌' if scans else '✅'} {name}: {' / '.join(plan)}")
+            if scans:
+                failures.append(name)
+
+    if failures:
+        raise click.ClickException(f"テーブル全体を走査するクエリがあります: {', '.join(failures)}")
+
+# ✅ JST変換フィルター
+@bp.app_template_filter("to_jst")
 def to_jst(utc_dt):
     if utc_dt is None:
         return "N/A"
     jst = timezone(timedelta(hours=9))
     return utc_dt.replace(tzinfo=timezone.utc).astimezone(jst).strftime('%Y-%m-%d %H:%M')
 
+# ✅ アプリケーションファクトリ
+def create_app(config=None):
+    app = Flask(__name__, static_folder="static", template_folder="templates")
+    with startup_phase(app, "config"):
+        load_config(app, config)
+        logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+        logger.setLevel(app.config["LOG_LEVEL"])
+        if not app.config["SECRET_KEY"]:
+            app.config["SECRET_KEY"] = load_or_create_secret_key(app.config["SECRET_KEY_FILE"])
+            logger.warning(
+                "🔑 SECRET_KEY が未設定のため %s の鍵を使います（複数ノードで動かす場合は .env に同じ SECRET_KEY を設定してください）",
+                app.config["SECRET_KEY_FILE"]
+            )
+    with startup_phase(app, "database"):
+        db.init_app(app)
+        migrate.init_app(app, db)
+        with app.app_context():
+            apply_sqlite_pragmas(app)
+        session_interface = create_session_interface(app, db, ServerSession)
+        if session_interface is not None:
+            app.session_interface = session_interface
+    with startup_phase(app, "nlp_backend"):
+        state = app.extensions["chat_services"] = ChatServices()
+        init_nlp(app)
+        state.session_cache = SessionStateCache(app.config["SESSION_CACHE_SIZE"], app.config["SESSION_CACHE_TTL"])
+        state.analysis_cache = AnalysisCache(
+            app.config["ANALYSIS_CACHE_SIZE"], app.config["ANALYSIS_CACHE_MAX_BYTES"],
+            app.config["ANALYSIS_CACHE_MAX_TEXT_LENGTH"]
+        )
+        init_chat_log_writer(app)
+        init_notification_dispatcher(app)
+        init_log_feed(app)
+    app.register_blueprint(bp)
+
+    if app.config["NLP_PRELOAD"]:
+        preload_nlp_resources(app)
+
+    timings = app.extensions["startup_timings"]
+    logger.info("⏱ 起動時間: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items()))
+    return app
+
+# ✅ gunicorn の入口（gunicorn app:app）。最初に app を参照したときに作る
+# import しただけではアプリを作らない（instance/secret_key の作成や解析バックエンドの準備をしない）
+_default_app = None
+
+def __getattr__(name):
+    global _default_app
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _resource_lock:
+        if _default_app is None:
+            _default_app = create_app()
+    return _default_app
+
 # ✅ メイン起動
 if __name__ == "__main__":
+    app = create_app()
+    preload_nlp_resources(app)
     app.run(debug=True)
@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks import app_factory
+
+
+# ✅ 管理者通知（AdminNotification）の確認（一時 DB・ローカルの SMTP 受信サーバー）
+#   - /chat でハラスメント疑いを検出すると、待機中の long-poll がすぐに返り（local_wakeup_ms は /chat の処理時間込み）、SMTP に1通届くこと
+#   - 別プロセス（別ワーカー）が書いた通知も POLL_MS 以内に long-poll で拾えること
+#   - 送信に失敗した sink は再送されること（1回目だけ失敗する sink を登録して確認）
+#   - 既読の通知・ログが大量にあっても、未読の確認にかかる時間が変わらないこと
+# 実行例: python -m benchmarks.admin_notifications --history 50000
+# 条件を満たさなければ終了コード 1
+
+class SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        self.reply("220 localhost debug smtp")
+        while True:
+            line = self.rfile.readline().decode("utf-8", "replace").rstrip("\r\n")
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command == "EHLO":
+                self.reply("250 localhost")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                lines = []
+                while True:
+                    data = self.rfile.readline().decode("utf-8", "replace").rstrip("\r\n")
+                    if data == ".":
+                        break
+                    lines.append(data)
+                self.server.messages.append("\n".join(lines))
+                self.reply("250 queued")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class SmtpServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SmtpHandler)
+        self.messages = []
+
+
+class FlakySink:
+    def __init__(self, config):
+        self.calls = 0
+
+    def send(self, notification):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("simulated failure")
+
+
+def build_app(workdir, smtp_port):
+    import notification_sinks
+    notification_sinks.register_sink("flaky", FlakySink)
+    return app_factory.build_app(os.path.join(workdir, "chat.db"), {
+        "CHAT_LOG_WRITE_BEHIND": False,
+        "NLP_BATCH_ENABLED": False,
+        "ADMIN_NOTIFICATION_SINKS": "smtp,flaky",
+        "ADMIN_NOTIFICATION_INTERVAL": 0.2,
+        "ADMIN_NOTIFICATION_POLL_MS": 200,
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": smtp_port
+    }, stub=True, preload=True)
+
+
+def long_poll(flask_app, since, wait, started_box, result_box):
+    client = flask_app.test_client()
+    started_box.append(time.perf_counter())
+    response = client.get("/api/admin/notifications", query_string={"since": since, "wait": wait})
+    result_box.append((time.perf_counter(), response.get_json()))
+
+
+def wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def pending_count(appmod):
+    appmod.db.session.rollback()
+    return appmod.AdminNotification.query.filter(appmod.AdminNotification.dispatched_at.is_(None)).count()
+
+
+def unread_check_ms(client, since, repeat=50):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        client.get("/api/admin/notifications", query_string={"since": since})
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="管理者通知の確認")
+    parser.add_argument("--history", type=int, default=50000, help="既読の通知・ログを何件入れて未読確認の時間を比べるか")
+    args = parser.parse_args()
+
+    smtp = SmtpServer()
+    threading.Thread(target=smtp.serve_forever, daemon=True).start()
+    workdir = tempfile.mkdtemp(prefix="admin-notifications-")
+    report = {}
+    try:
+        appmod, flask_app = build_app(workdir, smtp.server_address[1])
+        client = flask_app.test_client()
+        client.post("/login", data={"session_id": "notice-check"})
+        client.post("/set_profile", json={"department": "営業部", "age_group": "30代", "preferred_response_type": "共感"})
+
+        # 1. 同じプロセス内の書き込みで long-poll が起きる
+        started, result = [], []
+        poller = threading.Thread(target=long_poll, args=(flask_app, 0, 10, started, result))
+        poller.start()
+        time.sleep(0.5)
+        posted = time.perf_counter()
+        client.post("/chat", json={"message": "職場でいじめを受けています"})
+        poller.join()
+        returned, body = result[0]
+        report["local_wakeup_ms"] = round((returned - posted) * 1000, 1)
+        report["local_notifications"] = len(body["notifications"])
+        cursor = body["cursor"]
+
+        # 2. 別の接続（別ワーカー相当）の書き込みは POLL_MS ごとの見直しで拾う
+        started, result = [], []
+        poller = threading.Thread(target=long_poll, args=(flask_app, cursor, 10, started, result))
+        poller.start()
+        time.sleep(0.5)
+        with flask_app.app_context():
+            with appmod.db.engine.begin() as conn:
+                conn.execute(appmod.db.insert(appmod.AdminNotification), {
+                    "kind": "harassment", "session_id": "other-worker", "message": "別ワーカーからの通知",
+                    "department": "設計部", "age_group": "20代", "created_at": datetime.utcnow()
+                })
+            posted = time.perf_counter()
+        poller.join()
+        returned, body = result[0]
+        report["cross_worker_wakeup_ms"] = round((returned - posted) * 1000, 1)
+        report["cross_worker_notifications"] = len(body["notifications"])
+        cursor = body["cursor"]
+
+        # 3. ディスパッチャー（SMTP＋1回目だけ失敗する sink）
+        delivered = wait_for(lambda: len(smtp.messages) >= 2, 10)
+        with flask_app.app_context():
+            wait_for(lambda: pending_count(appmod) == 0, 10)
+            rows = appmod.AdminNotification.query.order_by(appmod.AdminNotification.id).all()
+            report["dispatch"] = [
+                {"id": row.id, "attempts": row.dispatch_attempts, "dispatched": row.dispatched_at is not None,
+                 "error": row.dispatch_error}
+                for row in rows
+            ]
+        report["smtp_messages"] = len(smtp.messages) if delivered else 0
+        report["smtp_subject"] = next(
+            (line for line in smtp.messages[0].splitlines() if line.startswith("Subject:")), None
+        ) if smtp.messages else None
+
+        # 4. 既読にする
+        response = client.post("/api/admin/notifications/read", json={"up_to": cursor})
+        report["marked_read"] = response.get_json()
+
+        # 5. 既読の通知・ログが大量にあっても未読の確認は同じ時間で済む
+        report["unread_check_ms_small"] = round(unread_check_ms(client, cursor), 3)
+        with flask_app.app_context():
+            now = datetime.utcnow()
+            appmod.db.session.execute(appmod.db.insert(appmod.AdminNotification), [{
+                "kind": "harassment", "session_id": f"old-{n}", "message": "既読の通知", "created_at": now,
+                "read_at": now, "dispatched_at": now
+            } for n in range(args.history)])
+            appmod.db.session.execute(appmod.db.insert(appmod.ChatHistory), [{
+                "session_id": "notice-check", "user_message": "ログ", "bot_response": "応答", "timestamp": now,
+                "harassment_flag": n % 20 == 0, "sensitive_flag": False
+            } for n in range(args.history)])
+            appmod.db.session.commit()
+        report["unread_check_ms_large"] = round(unread_check_ms(client, cursor), 3)
+        report["unread_after_history"] = client.get("/api/admin/notifications").get_json()["unread_count"]
+        with flask_app.app_context():
+            appmod.db.engine.dispose()
+    finally:
+        smtp.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    ok = (
+        report["local_notifications"] == 1
+        and report["cross_worker_notifications"] == 1
+        and report["cross_worker_wakeup_ms"] < 1000
+        and report["smtp_messages"] == 2
+        and all(item["dispatched"] for item in report["dispatch"])
+        and report["dispatch"][0]["attempts"] == 2
+        and report["marked_read"]["unread_count"] == 0
+        and report["unread_after_history"] == 0
+        and report["unread_check_ms_large"] < report["unread_check_ms_small"] * 3
+    )
+    if not ok:
+        print("❌ 管理者通知の確認に失敗しました", file=sys.stderr)
+        sys.exit(1)
+    print("✅ 管理者通知の確認に成功しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+import contextlib
+import io
+import os
+import secrets
+
+from benchmarks.stub_nlp import StubNlp
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+
+# ✅ ベンチマーク共通: 一時 SQLite DB でアプリを作る
+# stub=True なら GiNZA の代わりに StubNlp を使い、migrate=True ならマイグレーションを当て、
+# preload=True なら NLP・キーワード辞書を先に読み込む。最後に接続を閉じるので fork してもよい
+def build_app(db_path, config=None, stub=False, migrate=True, preload=False):
+    os.environ.setdefault("SECRET_KEY", secrets.token_hex(32))  # create_app で instance/secret_key を作らない
+    import flask_migrate
+    import app as appmod
+    flask_app = appmod.create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}", **(config or {})})
+    if stub:
+        appmod._nlp_models[flask_app.config["NLP_PIPELINE_PROFILE"]] = StubNlp()
+    with flask_app.app_context():
+        if migrate:
+            # alembic の INFO ログ（stderr）は結果の表示に混ぜない
+            with contextlib.redirect_stderr(io.StringIO()):
+                flask_migrate.upgrade(directory=MIGRATIONS_DIR)
+        if preload:
+            appmod.preload_nlp_resources(flask_app)
+        appmod.db.engine.dispose()
+    return appmod, flask_app
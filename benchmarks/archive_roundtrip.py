@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks import app_factory
+
+
+# ✅ flask archive-logs の確認（一時 DB・一時アーカイブディレクトリ）
+# 過去 N か月分の合成ログを入れ、アーカイブの前後で次が一致することを確かめる
+#   - /export_csv?include_archive=1 の出力（条件なし・部署や日付で絞った場合）
+#   - flask rollup-moods --rebuild --include-archive で作り直した日次集計
+# 途中のバッチで強制的に失敗させ（ファイル追記後・コミット前）、再実行で重複・欠落が出ないことも確かめる
+# 実行例: python -m benchmarks.archive_roundtrip --rows 20000 --months 14 --older-than-days 180
+# 一致しなければ終了コード 1
+
+
+def build_app(workdir):
+    return app_factory.build_app(os.path.join(workdir, "chat.db"), {
+        "ARCHIVE_DIR": os.path.join(workdir, "archive"),
+        "CHAT_LOG_WRITE_BEHIND": False
+    })
+
+
+def insert_rows(appmod, flask_app, rows, months):
+    rng = random.Random(0)
+    departments = ["営業部", "設計部", "工事部", "管理統括部"]
+    states = ["ストレスが高い", "普通", "気分が良い"]
+    now = datetime.utcnow()
+    start = now - timedelta(days=30 * months)
+    step = (now - start) / rows
+    sessions = [f"archive-{n}" for n in range(50)]
+    values = []
+    for n in range(rows):
+        harassment = rng.random() < 0.05
+        values.append({
+            "session_id": "admin-notice" if harassment and rng.random() < 0.5 else rng.choice(sessions),
+            "user_message": f"メッセージ {n}",
+            "bot_response": f"応答 {n}",
+            "department": rng.choice(departments),
+            "age_group": rng.choice(["20代", "30代", "40代"]),
+            "timestamp": start + step * n,
+            "psychological_state": rng.choice(states),
+            "harassment_flag": harassment,
+            "sensitive_flag": rng.random() < 0.03,
+            "nouns": "[]"
+        })
+    with flask_app.app_context():
+        appmod.db.session.execute(appmod.db.insert(appmod.User), [{"session_id": s} for s in sessions])
+        appmod.db.session.execute(appmod.db.insert(appmod.ChatHistory), values)
+        appmod.db.session.commit()
+
+
+def exports(client, filters):
+    return {name: client.get("/export_csv", query_string={**params, "include_archive": "1"}).data
+            for name, params in filters.items()}
+
+
+def rollups(appmod, flask_app):
+    with flask_app.app_context():
+        return sorted(
+            (str(r.day), r.department, r.age_group, r.psychological_state, r.message_count, r.harassment_count, r.sensitive_count)
+            for r in appmod.MoodRollup.query.all()
+        )
+
+
+def invoke(flask_app, args):
+    result = flask_app.test_cli_runner().invoke(args=args)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ログのアーカイブの確認")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--months", type=int, default=14)
+    parser.add_argument("--older-than-days", type=int, default=180)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="archive-roundtrip-")
+    try:
+        appmod, flask_app = build_app(workdir)
+        insert_rows(appmod, flask_app, args.rows, args.months)
+        invoke(flask_app, ["rollup-moods"])
+
+        since = (datetime.utcnow() - timedelta(days=args.older_than_days + 30)).strftime("%Y-%m-%d")
+        filters = {
+            "all": {},
+            "department": {"department": "設計部"},
+            "date_range": {"start": since},
+            "harassment": {"harassment": "1", "end": since}
+        }
+        client = flask_app.test_client()
+        before_exports = exports(client, filters)
+        before_rollups = rollups(appmod, flask_app)
+        db_path = os.path.join(workdir, "chat.db")
+        with flask_app.app_context():
+            appmod.db.session.execute(appmod.db.text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        size_before = os.path.getsize(db_path)
+
+        # 3バッチ目でファイル追記後に失敗させる
+        original = appmod.archive_chat_rows
+        calls = [0]
+
+        def failing(rows):
+            original(rows)
+            calls[0] += 1
+            if calls[0] == 3:
+                raise RuntimeError("simulated crash")
+
+        appmod.archive_chat_rows = failing
+        crashed = invoke(flask_app, ["archive-logs", "--older-than-days", str(args.older_than_days),
+                                     "--batch-size", str(args.batch_size), "--no-vacuum"])
+        appmod.archive_chat_rows = original
+        with flask_app.app_context():
+            appmod.db.session.rollback()
+
+        started = time.perf_counter()
+        resumed = invoke(flask_app, ["archive-logs", "--older-than-days", str(args.older_than_days),
+                                     "--batch-size", str(args.batch_size)])
+        elapsed = time.perf_counter() - started
+        if resumed.exception:
+            raise resumed.exception
+        size_after = os.path.getsize(db_path)
+
+        with flask_app.app_context():
+            hot_rows = appmod.ChatHistory.query.count()
+            archived = {a.month: a.row_count for a in appmod.ChatArchive.query.order_by(appmod.ChatArchive.month)}
+        after_exports = exports(client, filters)
+        invoke(flask_app, ["rollup-moods", "--rebuild", "--include-archive"])
+        after_rollups = rollups(appmod, flask_app)
+        archive_bytes = sum(
+            os.path.getsize(os.path.join(workdir, "archive", name)) for name in os.listdir(os.path.join(workdir, "archive"))
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "rows": args.rows,
+        "crash_simulated": isinstance(crashed.exception, RuntimeError),
+        "hot_rows_after": hot_rows,
+        "archived_rows": sum(archived.values()),
+        "archive_months": len(archived),
+        "archive_seconds": round(elapsed, 2),
+        "db_bytes_before": size_before,
+        "db_bytes_after": size_after,
+        "archive_bytes": archive_bytes,
+        "exports_identical": {name: before_exports[name] == after_exports[name] for name in filters},
+        "rollups_identical": before_rollups == after_rollups
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    ok = (
+        report["crash_simulated"]
+        and hot_rows + report["archived_rows"] == args.rows
+        and all(report["exports_identical"].values())
+        and report["rollups_identical"]
+    )
+    if not ok:
+        print("❌ アーカイブの前後で結果が一致しません", file=sys.stderr)
+        sys.exit(1)
+    print("✅ アーカイブの前後で出力・集計が一致しました")
+
+
+if __name__ == "__main__":
+    main()
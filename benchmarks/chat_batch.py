@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import app_factory
+from benchmarks.corpus import all_messages
+
+
+# ✅ アンケート回答の取り込みを想定し、/chat を1件ずつ呼ぶ場合と /chat_batch でまとめて送る場合を比べる
+# それぞれ別の一時 DB で同じメッセージ列（複数セッションが交互に並ぶ）を処理し、
+# 件/秒と、保存結果（ユーザー状態・ログの内容と順序）が一致することを確認する。一致しなければ終了コード 1
+# 実行例: python -m benchmarks.chat_batch --sessions 20 --messages 1000 --batch-size 500
+#         python -m benchmarks.chat_batch --model stub
+
+
+def build_app(db_path, model):
+    return app_factory.build_app(db_path, {
+        "NLP_BATCH_ENABLED": False,
+        "CHAT_LOG_WRITE_BEHIND": False,
+        "ANALYSIS_CACHE_SIZE": 0  # 1件ずつの方もキャッシュなしで比べる（バッチ内の重複除去はそのまま）
+    }, stub=model == "stub", preload=True)
+
+
+def create_sessions(flask_app, sessions):
+    clients = {}
+    for n in range(sessions):
+        session_id = f"batch-{n}"
+        client = flask_app.test_client()
+        client.post("/login", data={"session_id": session_id})
+        client.post("/set_profile", json={
+            "department": "営業部", "age_group": "30代", "preferred_response_type": "共感" if n % 2 else "アドバイス"
+        })
+        clients[session_id] = client
+    return clients
+
+
+def run_single(flask_app, items, sessions):
+    clients = create_sessions(flask_app, sessions)
+    random.seed(0)
+    started = time.perf_counter()
+    for session_id, message in items:
+        response = clients[session_id].post("/chat", json={"message": message})
+        if response.status_code != 200:
+            raise RuntimeError(f"/chat が失敗しました: {response.status_code} {response.get_json()}")
+    return time.perf_counter() - started
+
+
+def run_batch(flask_app, items, sessions, batch_size):
+    create_sessions(flask_app, sessions)
+    client = flask_app.test_client()
+    random.seed(0)
+    started = time.perf_counter()
+    for offset in range(0, len(items), batch_size):
+        chunk = items[offset:offset + batch_size]
+        response = client.post("/chat_batch", json={
+            "messages": [{"session_id": session_id, "message": message} for session_id, message in chunk]
+        })
+        body = response.get_json()
+        if response.status_code != 200 or body["errors"]:
+            raise RuntimeError(f"/chat_batch が失敗しました: {response.status_code} {body}")
+    return time.perf_counter() - started
+
+
+# 比較用のスナップショット（ユーザー状態と、セッションごとのログの並び）
+def snapshot(appmod, flask_app):
+    with flask_app.app_context():
+        users = {
+            user.session_id: [user.stress_count, user.last_psychological_state,
+                              user.previous_psychological_state, user.state_version]
+            for user in appmod.User.query.all()
+        }
+        logs = {}
+        for row in appmod.ChatHistory.query.order_by(appmod.ChatHistory.id).all():
+            logs.setdefault(row.session_id, []).append([
+                row.user_message, row.bot_response, row.psychological_state,
+                bool(row.harassment_flag), bool(row.sensitive_flag), row.nouns
+            ])
+        appmod.db.engine.dispose()
+    return {"users": users, "logs": logs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/chat と /chat_batch の取り込み速度の比較")
+    parser.add_argument("--model", choices=["ginza", "stub"], default="ginza")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--output", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    corpus = all_messages()
+    rng = random.Random(0)
+    items = [(f"batch-{rng.randrange(args.sessions)}", rng.choice(corpus)) for _ in range(args.messages)]
+
+    workdir = tempfile.mkdtemp(prefix="chat-batch-")
+    try:
+        appmod, flask_app = build_app(os.path.join(workdir, "single.db"), args.model)
+        single_seconds = run_single(flask_app, items, args.sessions)
+        single = snapshot(appmod, flask_app)
+
+        appmod, flask_app = build_app(os.path.join(workdir, "batch.db"), args.model)
+        batch_seconds = run_batch(flask_app, items, args.sessions, args.batch_size)
+        batch = snapshot(appmod, flask_app)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "model": args.model,
+        "sessions": args.sessions,
+        "messages": args.messages,
+        "batch_size": args.batch_size,
+        "single_per_sec": round(args.messages / single_seconds, 2),
+        "batch_per_sec": round(args.messages / batch_seconds, 2),
+        "speedup": round(single_seconds / batch_seconds, 2),
+        "identical": single == batch
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if not report["identical"]:
+        print("❌ /chat と /chat_batch で保存結果が一致しません", file=sys.stderr)
+        sys.exit(1)
+    print("✅ 保存結果は一致しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# ✅ ベンチマーク・負荷試験用の代表的なメッセージ（分類ごと）
+MESSAGES = {
+    "stress": [
+        "今日は会社で上司に怒鳴られて疲れた",
+        "仕事が忙しくてもう限界かもしれない",
+        "眠いしだるい",
+        "最近ずっと不安で気が重い",
+        "締め切りに追われてストレスがたまる",
+        "朝からイライラしている",
+        "残業続きでへとへとです",
+        "誰にも相談できなくて孤独を感じる"
+    ],
+    "positive": [
+        "ありがとう、楽しい一日だった",
+        "宿題終わった",
+        "プレゼンがうまくいった",
+        "先輩に褒められてうれしい",
+        "今日は気分がいい",
+        "目標を達成できた",
+        "終わった！",
+        "大丈夫です"
+    ],
+    "neutral": [
+        "普通の日",
+        "会社の上司と会議",
+        "今日は雨が降っている",
+        "昼ごはんにカレーを食べた",
+        "明日は現場の打ち合わせがある",
+        "週末は家で過ごした",
+        "新しい図面を確認しています",
+        "電車が少し遅れていた"
+    ],
+    "harassment": [
+        "パワハラを受けた",
+        "職場でいじめられている",
+        "会議で無視された",
+        "先輩にセクハラされて困っている",
+        "上司から圧力をかけられた",
+        "同僚に暴言を吐かれた"
+    ],
+    "sensitive": [
+        "もう無理",
+        "消えたい",
+        "仕事をやめたい",
+        "限界です",
+        "終わりにしたいと思うことがある",
+        "つらい"
+    ]
+}
+
+
+def all_messages():
+    return [text for texts in MESSAGES.values() for text in texts]
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from importlib import metadata
+
+from benchmarks import app_factory
+from benchmarks.corpus import all_messages
+from benchmarks.timing import summarize
+
+
+# ✅ /chat の解析処理（ホットパス）のマイクロベンチマーク
+# 一時 SQLite DB 上のアプリで、関数ごと・/chat 全体の ops/s と p50/p95/p99 を計測する
+# --model stub は GiNZA の代わりに軽量トークナイザを使う（ja_ginza のない環境向け。ginza とは別に比較する）
+# 実行例:
+#   python -m benchmarks.hot_path --model ginza --output benchmarks/baseline_ginza.json
+#   python -m benchmarks.hot_path --model stub --compare benchmarks/baseline_stub.json --max-regression 20
+
+
+def build_app(db_path, model):
+    return app_factory.build_app(db_path, {
+        "NLP_BACKEND": "local",
+        "NLP_BATCH_ENABLED": False,
+        "CHAT_LOG_WRITE_BEHIND": False,
+        "ANALYSIS_CACHE_SIZE": 0  # 解析キャッシュは analysis_cache の計測でだけ有効にする
+    }, stub=model == "stub", preload=True)
+
+
+# 1回の呼び出しごとの所要時間を測る（最初の1周はウォームアップ）
+def measure(func, inputs, iterations):
+    for item in inputs:
+        func(item)
+    latencies = []
+    for _ in range(iterations):
+        for item in inputs:
+            started = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def run_cases(appmod, flask_app, iterations):
+    texts = all_messages()
+    results = {}
+
+    with flask_app.app_context():
+        analyses = {text: appmod.MessageAnalysis(text) for text in texts}
+        results["to_hiragana"] = measure(appmod.to_hiragana, texts, iterations)
+        results["message_analysis"] = measure(appmod.MessageAnalysis, texts, iterations)
+        results["analyze_mood"] = measure(lambda text: appmod.analyze_mood(text, analyses[text]), texts, iterations)
+        results["detect_harassment"] = measure(
+            lambda text: appmod.detect_harassment(text, analyses[text]), texts, iterations
+        )
+        results["detect_sensitive_content"] = measure(
+            lambda text: appmod.detect_sensitive_content(text, analyses[text]), texts, iterations
+        )
+        moods = [(mood, response_type) for mood in ("ストレスが高い", "普通", "気分が良い") for response_type in ("共感", "アドバイス")]
+        results["get_response_by_mood"] = measure(lambda args: appmod.get_response_by_mood(*args), moods, iterations * 10)
+
+    # /chat 全体（セッションの履歴がたまった状態で計測する）
+    with flask_app.test_client() as client:
+        client.post("/login", data={"session_id": "benchmark"})
+        client.post("/set_profile", json={"department": "営業部", "age_group": "30代", "preferred_response_type": "共感"})
+        results["chat_e2e"] = measure(lambda text: client.post("/chat", json={"message": text}), texts, iterations)
+
+    with flask_app.app_context():
+        state = appmod.get_session_state("benchmark", with_history=True)
+        results["analyze_topic_consistency"] = measure(
+            lambda text: appmod.analyze_topic_consistency(text, "benchmark", analysis=analyses[text], state=state),
+            texts, iterations
+        )
+        results["analyze_topic_consistency_db"] = measure(
+            lambda text: appmod.analyze_topic_consistency(text, "benchmark", analysis=analyses[text]),
+            texts, iterations
+        )
+
+        # 解析キャッシュ（同じ文面の繰り返し）。ヒット時の ops/s と /chat 全体
+        appmod.services(flask_app).analysis_cache.configure(len(texts), 64 * 1024 * 1024, 1000)
+        results["analyze_message_cached"] = measure(appmod.analyze_message, texts, iterations)
+
+    with flask_app.test_client() as client:
+        client.post("/login", data={"session_id": "benchmark-cached"})
+        client.post("/set_profile", json={"department": "営業部", "age_group": "30代", "preferred_response_type": "共感"})
+        results["chat_e2e_cached"] = measure(lambda text: client.post("/chat", json={"message": text}), texts, iterations)
+    return results
+
+
+def package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+# 保存済みのベースラインと比べ、p50 の悪化率（%）を表示する
+def compare(results, baseline, max_regression):
+    print(f"\n{'case':<30}{'base p50':>10}{'p50':>10}{'change':>9}")
+    regressions = []
+    for name, current in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            print(f"{name:<30}{'-':>10}{current['p50_ms']:>10}{'new':>9}")
+            continue
+        if not previous["p50_ms"]:
+            print(f"{name:<30}{previous['p50_ms']:>10}{current['p50_ms']:>10}{'-':>9}")
+            continue
+        change = (current["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"] * 100
+        print(f"{name:<30}{previous['p50_ms']:>10}{current['p50_ms']:>10}{change:>+8.1f}%")
+        if max_regression is not None and change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="解析ホットパスのマイクロベンチマーク")
+    parser.add_argument("--model", choices=["ginza", "stub"], default="ginza")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", help="結果を JSON（ベースライン）で保存するパス")
+    parser.add_argument("--compare", help="比較するベースライン JSON のパス")
+    parser.add_argument("--max-regression", type=float, help="p50 がこの割合（%%）を超えて悪化したら終了コード 1")
+    args = parser.parse_args()
+
+    random.seed(0)
+    workdir = tempfile.mkdtemp(prefix="hot-path-")
+    try:
+        appmod, flask_app = build_app(os.path.join(workdir, "chat.db"), args.model)
+        results = run_cases(appmod, flask_app, args.iterations)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "model": args.model,
+            "pipeline": appmod.get_nlp(flask_app.config["NLP_PIPELINE_PROFILE"]).pipe_names,
+            "iterations": args.iterations,
+            "messages": len(all_messages()),
+            "python": platform.python_version(),
+            "pykakasi": package_version("pykakasi"),
+            "ginza": package_version("ginza"),
+            "created_at": datetime.now().isoformat(timespec="seconds")
+        },
+        "results": results
+    }
+
+    print(f"{'case':<30}{'ops/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<30}{r['ops_per_sec']:>11}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("model") != args.model:
+            print(f"⚠️ ベースラインのモデル（{baseline['meta'].get('model')}）と今回（{args.model}）が異なります")
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"❌ p50 が {args.max_regression}% を超えて悪化: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
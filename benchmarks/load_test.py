@@ -0,0 +1,364 @@
+import argparse
+import contextlib
+import json
+import os
+import queue
+import random
+import secrets
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+from benchmarks import app_factory
+from benchmarks.corpus import MESSAGES
+from benchmarks.timing import summarize
+
+
+# ✅ 負荷試験（1ノードで何人の同時利用に耐えられるかの見積もり用）
+# 一時 SQLite DB でサーバー（gunicorn または werkzeug）を起動し、/login・/set_profile で利用者を作ってから
+# 分類（ストレス・ポジティブ・普通・ハラスメント・センシティブ）の比率に従って /chat を送り続ける
+# 同時実行数（--concurrency、クローズドループ）または到着率（--rate 件/秒、オープンループ）で負荷をかけ、
+# 分類ごとのスループット・p50/p95/p99・エラー率を表示する。instance/chat.db は変更しない
+# 実行例:
+#   python -m benchmarks.load_test --users 200 --concurrency 20 --duration 60 --workers 4
+#   python -m benchmarks.load_test --users 200 --rate 30 --duration 60 --mix stress=50,neutral=30,sensitive=20
+#   python -m benchmarks.load_test --url http://127.0.0.1:8000 ...（起動済みのサーバーに送る。その DB に書き込まれる）
+# --max-error-rate を超えたら終了コード 1
+DEFAULT_MIX = "stress=35,positive=25,neutral=25,harassment=10,sensitive=5"
+DEPARTMENTS = ["営業部", "設計部", "IC部", "積算部", "工事部", "木材部", "Re:eiwa", "走る大工", "不動産部", "管理統括部"]
+AGE_GROUPS = ["20代", "30代", "40代", "50代", "60代以上"]
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in MESSAGES:
+            raise argparse.ArgumentTypeError(f"不明な分類です: {name}（{', '.join(MESSAGES)}）")
+        mix[name] = float(weight)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("比率の合計が 0 です")
+    return mix
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# 子プロセス側（--server werkzeug）: 環境変数の設定でアプリを起動する
+def serve(port):
+    from werkzeug.serving import make_server
+    import app as appmod
+    appmod.preload_nlp_resources(appmod.app)
+    make_server("127.0.0.1", port, appmod.app, threaded=True).serve_forever()
+
+
+def start_server(args, workdir):
+    db_path = os.path.join(workdir, "chat.db")
+    app_factory.build_app(db_path)
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{db_path}",
+        SECRET_KEY=os.environ["SECRET_KEY"],
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        LOG_LEVEL="WARNING"
+    )
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    else:
+        command = [sys.executable, "-m", "benchmarks.load_test", "--serve", str(port)]
+    log = open(os.path.join(workdir, "server.log"), "w")
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 180
+    while True:
+        if process.poll() is not None or time.time() > deadline:
+            process.kill()
+            log.close()
+            with open(os.path.join(workdir, "server.log"), encoding="utf-8", errors="replace") as f:
+                print(f.read()[-3000:], file=sys.stderr)
+            raise RuntimeError("サーバーを起動できませんでした")
+        try:
+            urllib.request.urlopen(url + "/login", timeout=1).read()
+            break
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    return url, process, log, db_path
+
+
+def stop_server(process, log):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    log.close()
+
+
+class VirtualUser:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def send(self, url, form=None, payload=None, timeout=30):
+        data = urllib.parse.urlencode(form).encode() if form is not None else json.dumps(payload).encode()
+        headers = {} if form is not None else {"Content-Type": "application/json"}
+        try:
+            with self.opener.open(urllib.request.Request(url, data=data, headers=headers), timeout=timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            return None, b""
+
+
+# 分類ごとの計測値（複数スレッドから記録する）
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = Counter()
+        self.error_samples = []
+
+    def record(self, name, latency, ok, status, body=b""):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(latency)
+            self.statuses.setdefault(name, Counter())[str(status)] += 1
+            if not ok:
+                self.errors[name] += 1
+                if len(self.error_samples) < 10:
+                    self.error_samples.append({"class": name, "status": status, "body": body[:300].decode(errors="replace")})
+
+
+def setup_users(url, count, concurrency, seed, recorder):
+    rng = random.Random(seed)
+    run_id = secrets.token_hex(3)
+    profiles = [
+        {"department": rng.choice(DEPARTMENTS), "age_group": rng.choice(AGE_GROUPS),
+         "preferred_response_type": rng.choice(["共感", "アドバイス"])}
+        for _ in range(count)
+    ]
+
+    def create(n):
+        user = VirtualUser(f"load-{run_id}-{n}")
+        started = time.perf_counter()
+        status, _ = user.send(url + "/login", form={"session_id": user.session_id})
+        login_ok = status == 200
+        status, body = user.send(url + "/set_profile", payload=profiles[n])
+        recorder.record("setup", time.perf_counter() - started, login_ok and status == 200, status, body)
+        return user
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(create, range(count)))
+
+
+def send_chat(url, user, rng, mix, recorder, scheduled_at=None, timeout=30):
+    name = rng.choices(list(mix), weights=list(mix.values()))[0]
+    message = rng.choice(MESSAGES[name])
+    started = time.perf_counter()
+    status, body = user.send(url + "/chat", payload={"message": message}, timeout=timeout)
+    ok = status == 200 and b"response" in body
+    # オープンループでは予定時刻からの時間を計る（サーバーが遅れて送信が詰まった分も遅延に含める）
+    recorder.record(name, time.perf_counter() - (scheduled_at or started), ok, status, body)
+
+
+# クローズドループ: concurrency 個のスレッドが応答を待ってから次を送る（同じ利用者が同時に2件送らないよう空き利用者を使う）
+def run_closed(url, users, args, recorder, deadline):
+    idle = queue.Queue()
+    for user in users:
+        idle.put(user)
+    remaining = [args.requests]
+    lock = threading.Lock()
+
+    def worker(i):
+        rng = random.Random(args.seed + i)
+        while time.perf_counter() < deadline:
+            with lock:
+                if remaining[0] is not None:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+            user = idle.get()
+            try:
+                send_chat(url, user, rng, args.mix, recorder, timeout=args.timeout)
+            finally:
+                idle.put(user)
+            if args.think_time:
+                time.sleep(rng.expovariate(1.0 / args.think_time))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+# オープンループ: 平均 rate 件/秒のポアソン到着で送る（応答を待たずに次の到着が来る）
+def run_open(url, users, args, recorder, deadline):
+    idle = queue.Queue()
+    for user in users:
+        idle.put(user)
+    rng = random.Random(args.seed)
+
+    def task(scheduled_at, seed):
+        user = idle.get()
+        try:
+            send_chat(url, user, random.Random(seed), args.mix, recorder, scheduled_at, timeout=args.timeout)
+        finally:
+            idle.put(user)
+
+    with ThreadPoolExecutor(args.max_in_flight) as pool:
+        next_at = time.perf_counter()
+        sent = 0
+        while next_at < deadline and (args.requests is None or sent < args.requests):
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, next_at, rng.random())
+            sent += 1
+            next_at += rng.expovariate(args.rate)
+
+
+def class_report(latencies, errors, statuses, elapsed):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": round(errors / len(latencies), 4) if latencies else 0.0,
+        "throughput_per_sec": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+        **{key: value for key, value in summarize(latencies).items() if key not in ("count", "ops_per_sec")}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/chat の負荷試験（一時 DB・ローカル実行）")
+    parser.add_argument("--users", type=int, default=100, help="作成する利用者（セッション）数")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", type=int, default=10, help="同時に送信中にする件数（クローズドループ）")
+    load.add_argument("--rate", type=float, help="平均到着率 件/秒（オープンループ）")
+    parser.add_argument("--duration", type=float, default=30, help="計測時間（秒）")
+    parser.add_argument("--requests", type=int, help="送る /chat の件数の上限")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"分類の比率（既定: {DEFAULT_MIX}）")
+    parser.add_argument("--think-time", type=float, default=0.0, help="クローズドループで送信後に待つ平均秒数")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="オープンループで同時に待てる件数の上限")
+    parser.add_argument("--timeout", type=float, default=30, help="1リクエストのタイムアウト（秒）")
+    parser.add_argument("--server", choices=["gunicorn", "werkzeug"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn のワーカー数")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn のワーカーあたりのスレッド数")
+    parser.add_argument("--url", help="起動済みのサーバーに送る（一時 DB は使わない）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-error-rate", type=float, help="全体のエラー率がこれを超えたら終了コード 1（例: 0.01）")
+    parser.add_argument("--output", help="結果を JSON で保存するパス")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    os.environ.setdefault("SECRET_KEY", secrets.token_hex(32))  # 親プロセスの create_app で instance/secret_key を作らない
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    process = log = db_path = None
+    recorder = Recorder()
+    try:
+        if args.url:
+            url = args.url.rstrip("/")
+        else:
+            url, process, log, db_path = start_server(args, workdir)
+
+        users = setup_users(url, args.users, args.concurrency if args.rate is None else 16, args.seed, recorder)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        if args.rate is None:
+            run_closed(url, users, args, recorder, deadline)
+        else:
+            run_open(url, users, args, recorder, deadline)
+        elapsed = time.perf_counter() - started
+
+        logged_rows = None
+        if process is not None:
+            stop_server(process, log)  # write-behind の残りを書き出させてから数える
+            process = None
+            with contextlib.closing(sqlite3.connect(db_path)) as conn:
+                logged_rows = conn.execute(
+                    "SELECT COUNT(*) FROM chat_history WHERE session_id LIKE 'load-%'"
+                ).fetchone()[0]
+    finally:
+        if process is not None:
+            stop_server(process, log)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    setup = recorder.latencies.pop("setup", [])
+    setup_errors = recorder.errors.pop("setup", 0)
+    setup_statuses = recorder.statuses.pop("setup", Counter())
+    classes = {
+        name: class_report(recorder.latencies[name], recorder.errors[name], recorder.statuses[name], elapsed)
+        for name in args.mix if name in recorder.latencies
+    }
+    all_latencies = [latency for name in classes for latency in recorder.latencies[name]]
+    all_statuses = sum((recorder.statuses[name] for name in classes), Counter())
+    overall = class_report(all_latencies, sum(recorder.errors.values()), all_statuses, elapsed)
+    successes = overall["requests"] - overall["errors"]
+    setup_report = class_report(setup, setup_errors, setup_statuses, elapsed)
+    del setup_report["throughput_per_sec"]
+
+    report = {
+        "config": {
+            "mode": "closed" if args.rate is None else "open",
+            "concurrency": args.concurrency if args.rate is None else None,
+            "rate": args.rate,
+            "users": args.users,
+            "duration_sec": round(elapsed, 2),
+            "mix": args.mix,
+            "server": "external" if args.url else args.server,
+            "workers": None if args.url else args.workers,
+            "threads": None if args.url or args.server != "gunicorn" else args.threads
+        },
+        "setup": setup_report,
+        "overall": overall,
+        "classes": classes,
+        "logged_rows": logged_rows,
+        "error_samples": recorder.error_samples
+    }
+
+    print(f"{'class':<12}{'req':>7}{'err%':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in list(classes.items()) + [("overall", overall)]:
+        print(f"{name:<12}{r['requests']:>7}{r['error_rate'] * 100:>7.2f}%{r['throughput_per_sec']:>9}"
+              f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+    if logged_rows is not None and logged_rows != successes:
+        print(f"⚠️ 成功した /chat {successes} 件に対し、保存されたログは {logged_rows} 件です")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if setup_errors:
+        print(f"⚠️ 利用者の作成で {setup_errors} 件のエラーがありました", file=sys.stderr)
+    if args.max_error_rate is not None and overall["error_rate"] > args.max_error_rate:
+        print(f"❌ エラー率 {overall['error_rate']:.2%} が上限 {args.max_error_rate:.2%} を超えました", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, text
+
+from benchmarks import app_factory
+
+
+# ✅ ログのライブ配信（/api/logs/stream）の確認（一時 DB・プロセス内の werkzeug サーバー）
+# 条件の異なる SSE クライアントを多数つなぎ、別の接続（他のワーカー相当）からログを書き込んで次を確かめる
+#   - 各クライアントが条件に合う行だけを、重複・欠落なく id 順に受け取ること
+#     （LOG_FEED_STREAM_SECONDS ごとの切断後も Last-Event-ID で続きから受け取る）
+#   - バッファより古い位置から始めたクライアントも DB からの読み直しで追いつくこと
+#   - 接続数によらず、chat_history への問い合わせが POLL_MS ごとの1回で済むこと（idle_selects）
+# 実行例: python -m benchmarks.log_feed --clients 40 --rows 2000 --seconds 10
+# 条件を満たさなければ終了コード 1
+
+FILTERS = [
+    {},
+    {"department": "営業部"},
+    {"harassment": "1"},
+    {"department": "設計部", "sensitive": "0"},
+]
+DEPARTMENTS = ["営業部", "設計部", "工事部", "管理統括部"]
+
+
+def build_app(workdir, args):
+    return app_factory.build_app(os.path.join(workdir, "chat.db"), {
+        "LOG_LEVEL": "WARNING",
+        "LOG_FEED_POLL_MS": args.poll_ms,
+        "LOG_FEED_BUFFER_SIZE": args.buffer_size,
+        "LOG_FEED_MAX_STREAMS": args.clients + len(FILTERS),
+        "LOG_FEED_HEARTBEAT": 1,
+        "LOG_FEED_STREAM_SECONDS": args.stream_seconds
+    })
+
+
+def row_values(rng, n):
+    return {
+        "session_id": f"feed-{rng.randrange(20)}",
+        "user_message": f"メッセージ {n}",
+        "bot_response": f"応答 {n}",
+        "department": rng.choice(DEPARTMENTS),
+        "age_group": "30代",
+        "timestamp": datetime.utcnow(),
+        "psychological_state": "普通",
+        "harassment_flag": rng.random() < 0.1,
+        "sensitive_flag": rng.random() < 0.1,
+        "nouns": "[]"
+    }
+
+
+class SseClient(threading.Thread):
+    def __init__(self, port, filters, since, stop):
+        super().__init__(daemon=True)
+        self.port = port
+        self.filters = filters
+        self.since = since
+        self.stop = stop
+        self.received = []
+        self.received_at = {}
+        self.cursor = since
+        self.connections = 0
+        self.error = None
+
+    def run(self):
+        query = urllib.parse.urlencode({**self.filters, "since": self.since})
+        try:
+            while not self.stop.is_set():
+                self.listen("/api/logs/stream?" + query)
+        except Exception as e:
+            self.error = repr(e)
+
+    # 1回の接続（サーバーが LOG_FEED_STREAM_SECONDS で切るまで）。再接続時は Last-Event-ID を送る
+    def listen(self, path):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+        headers = {"Last-Event-ID": str(self.cursor)} if self.connections else {}
+        conn.request("GET", path, headers=headers)
+        response = conn.getresponse()
+        if response.status != 200:
+            raise RuntimeError(f"status {response.status}: {response.read()[:200]}")
+        self.connections += 1
+        data = None
+        try:
+            while not self.stop.is_set():
+                line = response.readline().decode("utf-8")
+                if not line:
+                    return
+                line = line.rstrip("\n")
+                if line.startswith("id: "):
+                    self.cursor = int(line[4:])
+                elif line.startswith("data: "):
+                    data = json.loads(line[6:])
+                elif line == "" and data is not None:
+                    now = time.perf_counter()
+                    for log in data["logs"]:
+                        self.received.append(log["id"])
+                        self.received_at[log["id"]] = now
+                    data = None
+        finally:
+            conn.close()
+
+
+def expected_ids(engine, filters, since):
+    conditions = ["id > :since"]
+    params = {"since": since}
+    if "department" in filters:
+        conditions.append("department = :department")
+        params["department"] = filters["department"]
+    for name in ("harassment", "sensitive"):
+        if name in filters:
+            conditions.append(f"{name}_flag = :{name}")
+            params[name] = filters[name] == "1"
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(
+            text(f"SELECT id FROM chat_history WHERE {' AND '.join(conditions)} ORDER BY id"), params
+        )]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ログのライブ配信の確認")
+    parser.add_argument("--clients", type=int, default=40)
+    parser.add_argument("--rows", type=int, default=2000, help="配信中に書き込む行数")
+    parser.add_argument("--seconds", type=float, default=10, help="書き込みにかける秒数")
+    parser.add_argument("--idle-seconds", type=float, default=3, help="書き込みなしで接続だけを続ける秒数")
+    parser.add_argument("--existing", type=int, default=3000, help="配信前からある行数（遅れて始めるクライアント用）")
+    parser.add_argument("--poll-ms", type=int, default=200)
+    parser.add_argument("--buffer-size", type=int, default=500)
+    parser.add_argument("--stream-seconds", type=float, default=4)
+    args = parser.parse_args()
+
+    from werkzeug.serving import make_server
+
+    workdir = tempfile.mkdtemp(prefix="log-feed-")
+    rng = random.Random(0)
+    try:
+        appmod, flask_app = build_app(workdir, args)
+        writer = create_engine(f"sqlite:///{os.path.join(workdir, 'chat.db')}")
+        chat_history = appmod.ChatHistory.__table__
+        with writer.begin() as conn:
+            conn.execute(chat_history.insert(), [row_values(rng, n) for n in range(args.existing)])
+        start_id = args.existing
+
+        selects = [0]
+
+        with flask_app.app_context():
+            engine = appmod.db.engine
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def count_selects(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and "FROM chat_history" in statement:
+                selects[0] += 1
+
+        server = make_server("127.0.0.1", 0, flask_app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+
+        stop = threading.Event()
+        clients = [SseClient(port, FILTERS[n % len(FILTERS)], start_id, stop) for n in range(args.clients)]
+        # バッファより古い位置（最初の行）から始めるクライアント
+        late = [SseClient(port, filters, 0, stop) for filters in FILTERS]
+        for client in clients + late:
+            client.start()
+        time.sleep(1.0)
+
+        idle_before = selects[0]
+        time.sleep(args.idle_seconds)
+        idle_selects = selects[0] - idle_before
+
+        committed_at = {}
+        write_before = selects[0]
+        batch = max(1, args.rows // max(1, int(args.seconds * 10)))
+        written = 0
+        while written < args.rows:
+            values = [row_values(rng, args.existing + written + n) for n in range(min(batch, args.rows - written))]
+            with writer.begin() as conn:
+                result = conn.execute(chat_history.insert().returning(chat_history.c.id), values)
+                ids = [row[0] for row in result]
+            now = time.perf_counter()
+            for row_id in ids:
+                committed_at[row_id] = now
+            written += len(values)
+            time.sleep(args.seconds / max(1, args.rows / batch))
+        last_id = max(committed_at)
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline and any(c.cursor < last_id and not c.error for c in clients + late):
+            time.sleep(0.1)
+        write_selects = selects[0] - write_before
+        stop.set()
+        for client in clients + late:
+            client.join(timeout=5)
+        server.shutdown()
+
+        mismatches = []
+        for client in clients + late:
+            expected = expected_ids(writer, client.filters, client.since)
+            if client.error or client.received != expected:
+                mismatches.append({
+                    "filters": client.filters, "since": client.since, "error": client.error,
+                    "received": len(client.received), "expected": len(expected),
+                    "duplicates": len(client.received) - len(set(client.received))
+                })
+        latencies = [
+            (client.received_at[row_id] - committed_at[row_id]) * 1000
+            for client in clients if not client.filters
+            for row_id in client.received if row_id in committed_at
+        ]
+        stats = flask_app.test_client().get("/metrics").data.decode("utf-8")
+        writer.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "clients": args.clients + len(late),
+        "rows_written": args.rows,
+        "poll_ms": args.poll_ms,
+        "idle_seconds": args.idle_seconds,
+        "idle_selects": idle_selects,
+        "idle_selects_if_each_client_polled": int(args.idle_seconds * 1000 / args.poll_ms) * (args.clients + len(late)),
+        "write_phase_selects": write_selects,
+        "reconnects": sum(client.connections - 1 for client in clients + late),
+        "latency_ms_p50": round(statistics.median(latencies), 1) if latencies else None,
+        "latency_ms_max": round(max(latencies), 1) if latencies else None,
+        "feed_reads": [line for line in stats.splitlines() if line.startswith("log_feed_reads_total")],
+        "mismatches": mismatches
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    ok = not mismatches and report["idle_selects"] <= report["idle_seconds"] * 1000 / args.poll_ms + 2
+    if not ok:
+        print("❌ ライブ配信の確認に失敗しました", file=sys.stderr)
+        sys.exit(1)
+    print("✅ すべてのクライアントが条件に合う行を重複・欠落なく受け取りました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.corpus import all_messages
+from benchmarks.timing import summarize
+from nlp_backend import PIPELINE_PROFILES, load_model
+
+
+# ✅ GiNZA パイプライン構成ごとの 1メッセージあたりの解析時間とメモリ使用量を比較する
+# 実行例: python -m benchmarks.pipeline_profiles --iterations 20 --output instance/pipeline_profiles.json
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+# 構成ごとに別プロセスで計測する（読み込み済みモデルの影響を受けないように）
+def measure(profile, model, iterations):
+    texts = all_messages()
+    before = rss_mb()
+    started = time.perf_counter()
+    nlp = load_model(model, profile)
+    load_seconds = time.perf_counter() - started
+    after_load = rss_mb()
+
+    for text in texts:
+        nlp(text)
+
+    latencies = []
+    for _ in range(iterations):
+        for text in texts:
+            started = time.perf_counter()
+            nlp(text)
+            latencies.append(time.perf_counter() - started)
+
+    return {
+        "profile": profile,
+        "pipeline": nlp.pipe_names,
+        "load_seconds": round(load_seconds, 3),
+        "model_rss_mb": round(after_load - before, 1),
+        "rss_mb": round(rss_mb(), 1),
+        **summarize(latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GiNZA パイプライン構成のベンチマーク")
+    parser.add_argument("--model", default="ja_ginza")
+    parser.add_argument("--profiles", nargs="+", default=sorted(PIPELINE_PROFILES))
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--output", help="結果を JSON で保存するパス")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child, args.model, args.iterations), ensure_ascii=False))
+        return
+
+    results = []
+    for profile in args.profiles:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.pipeline_profiles", "--child", profile,
+             "--model", args.model, "--iterations", str(args.iterations)],
+            check=True, capture_output=True, text=True, cwd=os.getcwd()
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'profile':<10}{'load(s)':>9}{'model MB':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ops/s':>9}  pipeline")
+    for r in results:
+        print(f"{r['profile']:<10}{r['load_seconds']:>9}{r['model_rss_mb']:>10}{r['p50_ms']:>9}"
+              f"{r['p95_ms']:>9}{r['p99_ms']:>9}{r['ops_per_sec']:>9}  {','.join(r['pipeline'])}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
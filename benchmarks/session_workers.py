@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+
+from benchmarks import app_factory
+
+
+# ✅ 別々のプロセス（別々の create_app）で動かしたワーカー間でセッションが引き継がれるか確認する
+# （ロードバランサーがリクエストごとに別のワーカー・ノードへ振り分ける状況。スティッキーセッションなし）
+# ログインしたワーカーとは別のワーカーで /set_profile・/chat・/get_profile・/logout を行う
+# 実行例: python -m benchmarks.session_workers --workers 3 --backend cookie database filesystem
+#   --control を付けるとワーカーごとに別の SECRET_KEY で起動し、引き継げない（失敗する）ことを確認する
+# 一時 DB・一時ディレクトリを使うので instance/ は変更しない。引き継げなければ終了コード 1
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# 子プロセス側: 1ワーカーとしてアプリを起動する
+def serve(port, db_path):
+    from werkzeug.serving import make_server
+    _, flask_app = app_factory.build_app(db_path, {
+        "NLP_BATCH_ENABLED": False,
+        "CHAT_LOG_WRITE_BEHIND": False
+    }, migrate=False, preload=True)
+    make_server("127.0.0.1", port, flask_app, threaded=True).serve_forever()
+
+
+def start_workers(count, db_path, backend, session_dir, control):
+    shared_key = secrets.token_hex(32)
+    workers = []
+    for _ in range(count):
+        port = free_port()
+        env = dict(
+            os.environ,
+            SECRET_KEY=secrets.token_hex(32) if control else shared_key,
+            SESSION_BACKEND=backend,
+            SESSION_FILE_DIR=session_dir,
+            LOG_LEVEL="ERROR"
+        )
+        process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.session_workers", "--serve", str(port), "--db", db_path],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        workers.append((f"http://127.0.0.1:{port}", process))
+
+    deadline = time.time() + 120
+    for url, process in workers:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"ワーカーが起動できませんでした: {url}")
+            try:
+                urllib.request.urlopen(url + "/login", timeout=1).read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if time.time() > deadline:
+                    raise RuntimeError(f"ワーカーの起動待ちがタイムアウトしました: {url}")
+                time.sleep(0.2)
+    return workers
+
+
+def request(opener, url, method="GET", form=None, payload=None):
+    data = None
+    headers = {}
+    if form is not None:
+        data = urllib.parse.urlencode(form).encode()
+    if payload is not None:
+        data = json.dumps(payload).encode()
+        headers["Content-Type"] = "application/json"
+    try:
+        with opener.open(urllib.request.Request(url, data=data, headers=headers, method=method), timeout=30) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+
+# ワーカーを順番に切り替えながら1セッション分の操作を行い、各ステップの結果を返す
+def run_scenario(urls, session_id):
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def worker(i):
+        return urls[i % len(urls)]
+
+    profile = {"department": "営業部", "age_group": "30代", "preferred_response_type": "共感"}
+    steps = []
+
+    status, _ = request(opener, worker(0) + "/login", "POST", form={"session_id": session_id})
+    steps.append(("login", 0, status == 200))
+    status, _ = request(opener, worker(1) + "/set_profile", "POST", payload=profile)
+    steps.append(("set_profile", 1, status == 200))
+    status, body = request(opener, worker(2) + "/chat", "POST", payload={"message": "最近仕事が忙しくて疲れています"})
+    steps.append(("chat", 2, status == 200 and "response" in body))
+    status, body = request(opener, worker(3) + "/get_profile")
+    steps.append(("get_profile", 3, status == 200 and json.loads(body).get("department") == profile["department"]))
+    request(opener, worker(4) + "/logout")
+    status, _ = request(opener, worker(5) + "/get_profile")
+    steps.append(("logout", 5, status == 400))
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ワーカー間のセッション引き継ぎテスト（複数プロセス）")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--backend", nargs="+", default=["cookie", "database", "filesystem"],
+                        choices=["cookie", "database", "filesystem"])
+    parser.add_argument("--sessions", type=int, default=3, help="バックエンドごとに試すセッション数")
+    parser.add_argument("--control", action="store_true", help="ワーカーごとに別の SECRET_KEY で起動する（失敗するのが正しい）")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.db)
+        return
+
+    os.environ.setdefault("SECRET_KEY", secrets.token_hex(32))  # 親プロセスの create_app で instance/secret_key を作らない
+    report = {}
+    workdir = tempfile.mkdtemp(prefix="session-workers-")
+    try:
+        for backend in args.backend:
+            db_path = os.path.join(workdir, f"{backend}.db")
+            app_factory.build_app(db_path)
+            workers = start_workers(args.workers, db_path, backend, os.path.join(workdir, f"{backend}-sessions"), args.control)
+            try:
+                urls = [url for url, _ in workers]
+                failures = []
+                for n in range(args.sessions):
+                    for name, index, ok in run_scenario(urls, f"session-workers-{backend}-{n}"):
+                        if not ok:
+                            failures.append(f"{name}@worker{index % len(urls)}")
+                report[backend] = {"workers": len(urls), "sessions": args.sessions, "failures": failures}
+            finally:
+                for _, process in workers:
+                    process.terminate()
+                    process.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    failed = any(r["failures"] for r in report.values())
+    if args.control:
+        if not failed:
+            print("❌ 別々の SECRET_KEY でもセッションが引き継がれました", file=sys.stderr)
+            sys.exit(1)
+        print("✅ 別々の SECRET_KEY ではセッションが引き継がれないことを確認しました")
+        return
+    if failed:
+        print("❌ ワーカー間でセッションが引き継がれませんでした", file=sys.stderr)
+        sys.exit(1)
+    print("✅ すべてのワーカーでセッションが引き継がれました")
+
+
+if __name__ == "__main__":
+    main()
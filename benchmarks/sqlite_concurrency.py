@@ -0,0 +1,114 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks import app_factory
+from benchmarks.corpus import all_messages
+from benchmarks.timing import summarize
+
+
+# ✅ 複数プロセスから同じ SQLite ファイルへ同時に /chat を送り、ロックエラーと書き込み漏れがないか確認する
+# （gunicorn の複数ワーカー相当。一時 DB を使うので instance/chat.db は変更しない）
+# 実行例: python -m benchmarks.sqlite_concurrency --processes 4 --requests 50
+# 失敗（5xx・"database is locked"・行数の不一致）があれば終了コード 1
+
+
+# fork した各ワーカーが1セッションとして requests 件の /chat を送る
+def run_worker(args):
+    worker_id, requests, messages, start_at = args
+    flask_app = WORKER_APP
+    with flask_app.app_context():
+        WORKER_DB.engine.dispose(close=False)
+
+    statuses = {}
+    locked = 0
+    latencies = []
+    session_id = f"concurrency-{worker_id}"
+    with flask_app.test_client() as client:
+        client.post("/login", data={"session_id": session_id})
+        client.post("/set_profile", json={"department": "営業部", "age_group": "30代", "preferred_response_type": "共感"})
+        while time.time() < start_at:
+            time.sleep(0.001)
+        for i in range(requests):
+            message = messages[(worker_id + i) % len(messages)]
+            started = time.perf_counter()
+            response = client.post("/chat", json={"message": message})
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            body = response.get_json(silent=True) or {}
+            if "database is locked" in str(body.get("error", "")):
+                locked += 1
+    return {"session_id": session_id, "statuses": statuses, "locked": locked, "latencies": latencies}
+
+
+WORKER_APP = None
+WORKER_DB = None
+
+
+def main():
+    global WORKER_APP, WORKER_DB
+    parser = argparse.ArgumentParser(description="SQLite 同時書き込みテスト（複数プロセス）")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=30, help="プロセスあたりの /chat 件数")
+    parser.add_argument("--disable-pragmas", action="store_true", help="WAL / busy_timeout を使わずに比較する")
+    parser.add_argument("--output", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="sqlite-concurrency-")
+    try:
+        appmod, flask_app = app_factory.build_app(
+            os.path.join(workdir, "chat.db"), {"SQLITE_PRAGMAS_ENABLED": not args.disable_pragmas}, preload=True
+        )
+        WORKER_APP, WORKER_DB = flask_app, appmod.db
+
+        messages = all_messages()
+        start_at = time.time() + 0.5
+        started = time.perf_counter()
+        with multiprocessing.get_context("fork").Pool(args.processes) as pool:
+            results = pool.map(run_worker, [(i, args.requests, messages, start_at) for i in range(args.processes)])
+        elapsed = time.perf_counter() - started - 0.5
+
+        statuses = {}
+        for r in results:
+            for code, count in r["statuses"].items():
+                statuses[code] = statuses.get(code, 0) + count
+        locked = sum(r["locked"] for r in results)
+        ok = statuses.get(200, 0)
+
+        with flask_app.app_context():
+            logged = appmod.ChatHistory.query.filter(appmod.ChatHistory.session_id.like("concurrency-%")).count()
+            journal_mode = appmod.db.session.execute(appmod.db.text("PRAGMA journal_mode")).scalar()
+
+        latencies = [latency for r in results for latency in r["latencies"]]
+        report = {
+            "processes": args.processes,
+            "requests": args.processes * args.requests,
+            "journal_mode": journal_mode,
+            "statuses": {str(code): statuses[code] for code in sorted(statuses)},
+            "database_locked": locked,
+            "logged_rows": logged,
+            "throughput_per_sec": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+            **summarize(latencies)
+        }
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        failed = ok != args.processes * args.requests or locked or logged != ok
+        if failed:
+            print("❌ 同時書き込みでエラーまたは書き込み漏れがありました", file=sys.stderr)
+            sys.exit(1)
+        print("✅ ロックエラー・書き込み漏れなし")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import re
+
+
+# ✅ GiNZA の代わりに使う軽量トークナイザ（ja_ginza が入っていない環境でベンチマークを回すため）
+# 文字種（漢字・カタカナ・ひらがな・英数字・記号）の連続で区切り、品詞は文字種から大まかに決める
+# 解析精度は GiNZA と異なるので、結果の比較は同じモード同士で行うこと
+TOKEN_PATTERN = re.compile(
+    r"(?P<NOUN>[一-鿿々]+|[゠-ヿー]+|[A-Za-z0-9Ａ-Ｚａ-ｚ０-９]+)"
+    r"|(?P<AUX>[぀-ゟ]+)"
+    r"|(?P<PUNCT>[^\s])"
+)
+
+
+class StubToken:
+    __slots__ = ("text", "pos_")
+
+    def __init__(self, text, pos):
+        self.text = text
+        self.pos_ = pos
+
+
+class StubNlp:
+    pipe_names = ["stub_tokenizer"]
+
+    def __call__(self, text):
+        return [StubToken(match.group(), match.lastgroup) for match in TOKEN_PATTERN.finditer(text)]
+
+    def pipe(self, texts, batch_size=None):
+        for text in texts:
+            yield self(text)
@@ -0,0 +1,23 @@
+import math
+import statistics
+
+
+# ✅ 計測値（秒）の要約：ops/s と p50/p95/p99（ミリ秒）
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, math.ceil(q / 100.0 * len(ordered)) - 1)
+    return ordered[index]
+
+
+def summarize(latencies):
+    total = sum(latencies)
+    return {
+        "count": len(latencies),
+        "ops_per_sec": round(len(latencies) / total, 2) if total else 0.0,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 4) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 4),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 4)
+    }
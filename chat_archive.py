@@ -0,0 +1,50 @@
+import gzip
+import io
+import json
+import os
+
+
+# ✅ ログのアーカイブファイル（月ごとの JSON Lines を gzip 圧縮したもの）
+# 1回の書き込み（バッチ）ごとに gzip のメンバーを1つ追記する。どこまでが確定した書き込みかは
+# 呼び出し側が DB に記録したバイト数（committed）で管理し、それより後ろは未確定として扱う
+# （追記後・DB のコミット前に止まった場合、次の追記の前に committed まで切り詰める。読むときも committed までしか読まない）
+
+def append_lines(path, committed, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = gzip.compress("".join(line + "\n" for line in lines).encode("utf-8"))
+    with open(path, "ab") as f:
+        if f.tell() != committed:
+            f.truncate(committed)
+            f.seek(committed)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return committed + len(data)
+
+
+class BoundedReader(io.RawIOBase):
+    def __init__(self, f, limit):
+        self.f = f
+        self.remaining = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        data = self.f.read(size)
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+
+def iter_lines(path, committed):
+    if not committed:
+        return
+    with open(path, "rb") as f:
+        with gzip.GzipFile(fileobj=io.BufferedReader(BoundedReader(f, committed))) as archive:
+            for line in io.TextIOWrapper(archive, encoding="utf-8"):
+                if line.strip():
+                    yield json.loads(line)
@@ -0,0 +1,27 @@
+import gc
+import os
+
+# ✅ gunicorn 設定（起動例: gunicorn app:app）
+# preload_app でマスターが create_app と NLP リソースの先読みを行い、fork したワーカーは
+# モデルのメモリを copy-on-write で共有する（ワーカーの再起動時もモデルの再読み込みが不要）
+os.environ.setdefault("NLP_PRELOAD", "1")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+# ログのライブ配信（SSE）と管理者通知の long-poll は接続中1スレッドを使う
+# （LOG_FEED_MAX_STREAMS + ADMIN_NOTIFICATION_MAX_WAITERS をスレッド数より小さくして /chat 用に残す）
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+preload_app = True
+
+
+# 先読みしたオブジェクトを GC の走査対象から外し、参照カウント以外でページが書き換わるのを防ぐ
+def when_ready(server):
+    gc.freeze()
+
+
+# ワーカー終了時に、遅延書き込み（CHAT_LOG_WRITE_BEHIND=1）で残っているログを書き込む
+def worker_exit(server, worker):
+    import app
+    writer = app.services(app.app).chat_log_writer
+    if writer is not None:
+        writer.close()
@@ -0,0 +1,316 @@
+import argparse
+import os
+import pickle
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+
+# ✅ パイプライン構成（アプリが使うのは token.text と token.pos_ だけ）
+# trimmed: 係り受け解析・固有表現抽出・文節認識を読み込まない（品詞は tok2vec + morphologizer が付与）
+PIPELINE_PROFILES = {
+    "full": [],
+    "trimmed": ["parser", "ner", "bunsetu_recognizer"]
+}
+
+POS_PROBE_TEXT = "今日は会社で上司と会議をした"
+
+
+# ✅ 起動時チェック：残したコンポーネントで品詞（名詞）が付与されるか確認する
+def validate_pos_tagging(nlp, profile):
+    pos_tags = [token.pos_ for token in nlp(POS_PROBE_TEXT)]
+    if not pos_tags or not all(pos_tags) or "NOUN" not in pos_tags:
+        raise RuntimeError(
+            f"パイプライン構成「{profile}」では品詞が付与されません（{nlp.pipe_names}）。"
+            "NLP_PIPELINE_PROFILE=full を指定してください。"
+        )
+
+
+# ✅ GiNZA モデルの読み込み（spaCy はここで初めて import する）
+def load_model(name="ja_ginza", profile="full"):
+    if profile not in PIPELINE_PROFILES:
+        raise ValueError(f"未知のパイプライン構成です: {profile}（{', '.join(PIPELINE_PROFILES)}）")
+
+    import spacy
+    nlp = spacy.load(name, exclude=PIPELINE_PROFILES[profile])
+    validate_pos_tagging(nlp, profile)
+    return nlp
+
+
+# ✅ spaCy Doc から、アプリが使う項目（表層形・品詞）だけを取り出す
+def doc_to_fields(doc):
+    return [token.text for token in doc], [token.pos_ for token in doc]
+
+
+def parse_with_model(nlp, texts):
+    return [doc_to_fields(doc) for doc in nlp.pipe(texts, batch_size=max(len(texts), 1))]
+
+
+# ✅ マイクロバッチ・スケジューラ
+# 同時に届いたメッセージを最大 max_wait_ms ミリ秒 / 最大 max_batch 件まで集め、
+# parse_many（nlp.pipe または解析サーバー）でまとめて解析してから、待っている各リクエストに結果を返す
+# timeout 秒待っても結果が返らなければ、待つのをやめて呼び出し元のスレッドで直接解析する
+class NlpBatchScheduler:
+    def __init__(self, parse_many, max_wait_ms=5, max_batch=32, timeout=10.0):
+        self.parse_many = parse_many
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self.batch_sizes = Counter()
+        self.timeouts = 0
+
+    # fork 後のワーカーではスレッドが引き継がれないため、最初の投入時に起動する
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="nlp-batch-scheduler", daemon=True)
+            self._thread.start()
+
+    def submit(self, text):
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def parse(self, text):
+        future = self.submit(text)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()  # まだバッチに入っていなければ解析しない
+            with self._lock:
+                self.timeouts += 1
+            return self.parse_many([text])[0]
+
+    # 待つのをやめた（cancel 済みの）依頼はバッチに入れない
+    def _collect(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch:
+            if deadline is None:
+                text, future = self._queue.get()
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    text, future = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if not future.set_running_or_notify_cancel():
+                continue
+            batch.append((text, future))
+            if deadline is None:
+                deadline = time.monotonic() + self.max_wait
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                results = self.parse_many(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), fields in zip(batch, results):
+                future.set_result(fields)
+            if len(results) != len(batch):
+                error = RuntimeError(f"解析結果の件数が一致しません（{len(batch)} 件に対して {len(results)} 件）")
+                for _, future in batch[len(results):]:
+                    future.set_exception(error)
+            with self._lock:
+                self.batch_sizes[len(batch)] += 1
+
+    def stats(self):
+        with self._lock:
+            sizes = dict(self.batch_sizes)
+            timeouts = self.timeouts
+        batches = sum(sizes.values())
+        items = sum(size * count for size, count in sizes.items())
+        return {
+            "batches": batches,
+            "items": items,
+            "avg_batch_size": round(items / batches, 2) if batches else 0,
+            "max_batch_size": max(sizes) if sizes else 0,
+            "batch_size_histogram": {str(size): sizes[size] for size in sorted(sizes)},
+            "timeouts": timeouts,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_batch": self.max_batch,
+            "timeout": self.timeout
+        }
+
+
+# ✅ 解析サーバーを使えないときの例外（呼び出し側はプロセス内モデルにフォールバックする）
+class NlpServerError(RuntimeError):
+    pass
+
+
+# 接続・認証の失敗、途中で切れた応答や読めない応答（unpickle できない）をまとめて扱う
+CLIENT_ERRORS = (OSError, EOFError, AuthenticationError, pickle.UnpicklingError,
+                 AttributeError, ImportError, ValueError, TypeError)
+
+
+# ✅ 解析サーバーとの接続は必ず認証する（受け取ったメッセージは pickle で復元するため、
+# 認証なしではソケットに接続できる誰もが相手のプロセスでコードを実行できる）
+def require_authkey(authkey):
+    if not authkey:
+        raise RuntimeError(
+            "NLP_SERVER_AUTHKEY が未設定です。解析サーバーとアプリに同じ値を設定してください"
+            "（生成例: python -c \"import secrets; print(secrets.token_hex(32))\"）"
+        )
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+# ✅ 解析サーバーのクライアント（Flask ワーカー側）
+# スレッドごとに Unix ソケット接続を持ち、接続できない・エラーが返った間は retry_interval 秒だけ利用を止める
+class NlpClient:
+    def __init__(self, address, authkey, retry_interval=30.0):
+        self.address = address
+        self.authkey = require_authkey(authkey)
+        self.retry_interval = retry_interval
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def available(self):
+        return time.monotonic() >= self._down_until
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # 失敗した接続は使い回さない（応答の途中で失敗すると、次の recv が前の応答を読んでしまう）
+    def _mark_down(self):
+        conn, self._local.conn = getattr(self._local, "conn", None), None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+        self._down_until = time.monotonic() + self.retry_interval
+
+    def _request(self, message):
+        try:
+            conn = self._connection()
+            conn.send(message)
+            status, payload = conn.recv()
+        except CLIENT_ERRORS as e:
+            self._mark_down()
+            raise NlpServerError(f"解析サーバーに接続できません: {e!r}") from e
+        if status != "ok":
+            self._mark_down()
+            raise NlpServerError(f"解析サーバーでエラーが発生しました: {payload}")
+        return payload
+
+    def parse_many(self, texts):
+        return [tuple(fields) for fields in self._request(("parse", list(texts)))]
+
+    # 死活確認（サーバーのモデル・構成・pid を返す。応答は str / list / int だけなので spaCy を import しない）
+    def ping(self):
+        return self._request(("ping", None))
+
+
+# ✅ 解析サーバー本体
+# モデルを読み込んだ後に processes 個へ fork し（モデルのページは copy-on-write で共有）、
+# 各プロセスが同じソケットで接続を受け付ける。解析はプロセス内で直列に行う
+# ソケットは所有者だけが読み書きできる権限（0600）で作り、接続ごとに authkey で認証する
+def _handle_connection(conn, nlp, parse_lock, model_name, profile):
+    with conn:
+        while True:
+            try:
+                command, payload = conn.recv()
+            except EOFError:
+                return
+            try:
+                if command == "parse":
+                    with parse_lock:
+                        results = parse_with_model(nlp, payload)
+                    conn.send(("ok", results))
+                elif command == "ping":
+                    conn.send(("ok", {"model": model_name, "profile": profile,
+                                      "pipeline": list(nlp.pipe_names), "pid": os.getpid()}))
+                else:
+                    conn.send(("error", f"unknown command: {command}"))
+            except (OSError, EOFError):
+                return
+            except Exception as e:
+                conn.send(("error", str(e)))
+
+
+def _accept_loop(listener, nlp, model_name, profile):
+    parse_lock = threading.Lock()
+    while True:
+        try:
+            conn = listener.accept()
+        except (OSError, AuthenticationError):
+            continue
+        threading.Thread(
+            target=_handle_connection, args=(conn, nlp, parse_lock, model_name, profile), daemon=True
+        ).start()
+
+
+def serve(address, model_name="ja_ginza", processes=1, authkey=None, profile="full"):
+    authkey = require_authkey(authkey)
+    nlp = load_model(model_name, profile)
+    os.makedirs(os.path.dirname(os.path.abspath(address)), mode=0o700, exist_ok=True)
+    if os.path.exists(address):
+        os.unlink(address)
+    old_umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(old_umask)
+    print(f"🧠 解析サーバー起動: {address}（モデル: {model_name}, 構成: {profile}, プロセス数: {processes}）")
+
+    children = []
+    for _ in range(processes - 1):
+        pid = os.fork()
+        if pid == 0:
+            _accept_loop(listener, nlp, model_name, profile)
+            os._exit(0)
+        children.append(pid)
+
+    try:
+        _accept_loop(listener, nlp, model_name, profile)
+    finally:
+        listener.close()
+        for pid in children:
+            try:
+                os.kill(pid, 15)
+            except OSError:
+                pass
+
+
+# ✅ 起動例: NLP_SERVER_AUTHKEY=... python nlp_backend.py --socket instance/nlp.sock --processes 2
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GiNZA 解析サーバー（Unix ソケット）")
+    parser.add_argument("--socket", default=os.getenv("NLP_SERVER_SOCKET", os.path.join("instance", "nlp.sock")))
+    parser.add_argument("--model", default="ja_ginza")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--profile", default=os.getenv("NLP_PIPELINE_PROFILE", "trimmed"), choices=sorted(PIPELINE_PROFILES))
+    args = parser.parse_args()
+
+    try:
+        authkey = require_authkey(os.getenv("NLP_SERVER_AUTHKEY"))
+    except RuntimeError as e:
+        parser.error(str(e))
+    serve(args.socket, args.model, args.processes, authkey, args.profile)
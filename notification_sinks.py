@@ -0,0 +1,87 @@
+import json
+import logging
+import smtplib
+import urllib.request
+from email.message import EmailMessage
+
+
+# ✅ 管理者通知の送り先（ADMIN_NOTIFICATION_SINKS にカンマ区切りで指定）
+# 各 sink は send(notification) を持つ。notification は AdminNotification を辞書にしたもの
+# 送れなかった場合は例外を投げる（ディスパッチャーが回数を数えて再送する）
+# 追加する場合は register_sink("名前", クラス) で登録する。クラスは app.config を受け取って初期化する
+logger = logging.getLogger(__name__)
+
+KIND_LABELS = {"harassment": "ハラスメント疑い"}
+
+
+def format_subject(notification):
+    label = KIND_LABELS.get(notification["kind"], notification["kind"])
+    return f"[管理者通知] {label}（{notification['department'] or '部署未設定'}）#{notification['id']}"
+
+
+def format_body(notification):
+    return (
+        f"種類: {KIND_LABELS.get(notification['kind'], notification['kind'])}\n"
+        f"セッションID: {notification['session_id']}\n"
+        f"部署: {notification['department'] or 'N/A'} / 年代: {notification['age_group'] or 'N/A'}\n"
+        f"日時(UTC): {notification['created_at']}\n"
+        f"発言: {notification['message']}\n"
+    )
+
+
+class LogSink:
+    def __init__(self, config):
+        pass
+
+    def send(self, notification):
+        logger.warning("🚨 %s %s", format_subject(notification), notification["message"])
+
+
+# 開発時はローカルのデバッグ用 SMTP サーバーに送る（例: python -m aiosmtpd -n -l localhost:1025）
+class SmtpSink:
+    def __init__(self, config):
+        self.host = config["SMTP_HOST"]
+        self.port = config["SMTP_PORT"]
+        self.sender = config["ADMIN_NOTIFICATION_EMAIL_FROM"]
+        self.recipients = [address.strip() for address in config["ADMIN_NOTIFICATION_EMAIL_TO"].split(",") if address.strip()]
+        self.timeout = config["ADMIN_NOTIFICATION_SINK_TIMEOUT"]
+
+    def send(self, notification):
+        message = EmailMessage()
+        message["Subject"] = format_subject(notification)
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.recipients)
+        message.set_content(format_body(notification))
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.send_message(message)
+
+
+# 任意の URL に JSON を POST する（チャットツールの Webhook など）
+class WebhookSink:
+    def __init__(self, config):
+        self.url = config["ADMIN_NOTIFICATION_WEBHOOK_URL"]
+        self.timeout = config["ADMIN_NOTIFICATION_SINK_TIMEOUT"]
+
+    def send(self, notification):
+        payload = {"text": format_subject(notification) + "\n" + format_body(notification), "notification": notification}
+        request = urllib.request.Request(
+            self.url, data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+SINKS = {"log": LogSink, "smtp": SmtpSink, "webhook": WebhookSink}
+
+
+def register_sink(name, sink_class):
+    SINKS[name] = sink_class
+
+
+def build_sinks(config):
+    names = [name.strip() for name in config["ADMIN_NOTIFICATION_SINKS"].split(",") if name.strip()]
+    unknown = [name for name in names if name not in SINKS]
+    if unknown:
+        raise ValueError(f"不明な通知先です: {', '.join(unknown)}（{', '.join(SINKS)}）")
+    return {name: SINKS[name](config) for name in names}
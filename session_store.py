@@ -0,0 +1,162 @@
+import json
+import os
+import secrets
+import tempfile
+from datetime import datetime
+
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+
+# ✅ サーバー側セッション（SESSION_BACKEND=database / filesystem）
+# Cookie には署名付きのセッションキーだけを入れ、中身は DB またはファイルに保存する
+# どのワーカー・ノードでも同じストア（同じ DB・共有ディレクトリ）と SECRET_KEY を使えば、スティッキーセッションなしで読める
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class DatabaseSessionStore:
+    def __init__(self, db, model):
+        self.db = db
+        self.table = model.__table__
+
+    def load(self, sid):
+        with self.db.engine.connect() as conn:
+            row = conn.execute(
+                self.db.select(self.table.c.data, self.table.c.expires_at).where(self.table.c.id == sid)
+            ).first()
+        if row is None or row.expires_at < datetime.utcnow():
+            return None
+        return row.data
+
+    # リクエスト中の db.session とは別の接続・トランザクションで書く（ビューの未コミットの変更を巻き込まない）
+    def save(self, sid, data, expires_at):
+        with self.db.engine.begin() as conn:
+            updated = conn.execute(
+                self.db.update(self.table).where(self.table.c.id == sid).values(data=data, expires_at=expires_at)
+            ).rowcount
+            if not updated:
+                conn.execute(self.db.insert(self.table).values(id=sid, data=data, expires_at=expires_at))
+
+    def delete(self, sid):
+        with self.db.engine.begin() as conn:
+            conn.execute(self.db.delete(self.table).where(self.table.c.id == sid))
+
+    def cleanup(self):
+        with self.db.engine.begin() as conn:
+            return conn.execute(self.db.delete(self.table).where(self.table.c.expires_at < datetime.utcnow())).rowcount
+
+
+class FileSessionStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, sid + ".json")
+
+    def load(self, sid):
+        try:
+            with open(self._path(sid), encoding="utf-8") as f:
+                record = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if record["expires_at"] < datetime.utcnow().timestamp():
+            return None
+        return record["data"]
+
+    # 一時ファイルに書いてから置き換える（別プロセスが書きかけのファイルを読まないように）
+    def save(self, sid, data, expires_at):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"data": data, "expires_at": (expires_at - datetime(1970, 1, 1)).total_seconds()}, f)
+        os.replace(tmp_path, self._path(sid))
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def cleanup(self):
+        removed = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            sid = name[:-len(".json")]
+            if self.load(sid) is None:
+                self.delete(sid)
+                removed += 1
+        return removed
+
+
+class ServerSessionInterface(SessionInterface):
+    salt = "server-session"
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt=self.salt)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                data = self.store.load(sid)
+                if data is not None:
+                    return ServerSideSession(session_json_serializer.loads(data), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    # 内容が変わったときだけストアに書く（読み取りだけのリクエストでは書き込まない）
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.modified:
+            expires_at = datetime.utcnow() + app.permanent_session_lifetime
+            self.store.save(session.sid, session_json_serializer.dumps(dict(session)), expires_at)
+
+        if not self.should_set_cookie(app, session):
+            return
+        response.vary.add("Cookie")
+        response.set_cookie(
+            name,
+            self._signer(app).sign(session.sid).decode(),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def create_session_interface(app, db, model):
+    backend = app.config["SESSION_BACKEND"]
+    if backend == "cookie":
+        return None
+    if backend == "database":
+        return ServerSessionInterface(DatabaseSessionStore(db, model))
+    if backend == "filesystem":
+        return ServerSessionInterface(FileSessionStore(app.config["SESSION_FILE_DIR"]))
+    raise ValueError(f"SESSION_BACKEND は cookie / database / filesystem のいずれかです: {backend}")